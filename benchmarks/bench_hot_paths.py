@@ -0,0 +1,177 @@
+"""
+Microbenchmarks for the CPU-side, per-turn bookkeeping of a negotiation.
+
+LLM calls are served by the fake backend (and sentiment is pre-cached), so the
+numbers only reflect price extraction, classification heuristics, state
+updates, prompt building and response serialization. Each benchmark runs on a
+realistic negotiation (10 turns) and a very long one (500 turns).
+
+    python -m benchmarks.bench_hot_paths            # run and print
+    python -m benchmarks.bench_hot_paths --save     # store results as the baseline
+    python -m benchmarks.bench_hot_paths --compare  # fail if slower than the baseline
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import timeit
+
+os.environ.setdefault("LLM_BACKEND", "fake")
+
+from src.api import NegotiationResponse  # noqa: E402
+from src.negotiation_logic import (  # noqa: E402
+    analyze_negotiation_sentiment,
+    build_seller_prompt,
+    classify_response,
+    evaluate_strategy,
+    extract_price_from_text,
+    update_negotiation_metrics,
+)
+from src.messages import parse_prices  # noqa: E402
+from src.negotiation_stage import NegotiationState  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+SHORT_SELLER = "I can come down to $24,500.00, which is still a great price for this car."
+LONG_SELLER = (
+    "I appreciate your persistence and I understand you've done your research on comparable "
+    "vehicles in the area. This Accord has been garage-kept, has a full service history and "
+    "brand new tires, and I've already had several other people ask about it this week. "
+    "That said, I'd like to close this out with you, so I cannot go below $21,750.00 on it, "
+    "and that's already well under what the dealer down the road is asking."
+)
+AMBIGUOUS_SELLER = (
+    "Let me think about it overnight and talk it over with my family before I get back to you, "
+    "I want to make sure everyone is comfortable with where we land."
+)
+BUYER_OFFER = "Based on what I've seen for similar cars, I can offer $21,000.00."
+
+
+def build_state(turns):
+    """Build a negotiation with `turns` buyer/seller exchanges."""
+    state = NegotiationState()
+    for i in range(turns):
+        state.add_to_history("Buyer", f"Based on what I've seen, I can offer ${19000 + i * 5:,.2f} for the car.")
+        state.add_to_history("Seller", f"I could come down to ${26000 - i * 5:,.2f}, which is still a great price.")
+    return state
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def make_benchmarks():
+    """Return (name, callable) pairs. Each callable performs one operation."""
+    for text in (SHORT_SELLER, LONG_SELLER, AMBIGUOUS_SELLER):
+        run(analyze_negotiation_sentiment(text))  # warm the sentiment cache
+
+    benchmarks = [
+        ("extract_price/short", lambda: extract_price_from_text(SHORT_SELLER)),
+        ("extract_price/long", lambda: extract_price_from_text(LONG_SELLER)),
+        ("extract_price/no_price", lambda: extract_price_from_text(AMBIGUOUS_SELLER)),
+        # extract_price hits parse_prices' cache; these parse every time, as a new message does
+        ("parse_prices/uncached_short", lambda: parse_prices.__wrapped__(SHORT_SELLER)),
+        ("parse_prices/uncached_long", lambda: parse_prices.__wrapped__(LONG_SELLER)),
+        ("parse_prices/uncached_no_price", lambda: parse_prices.__wrapped__(AMBIGUOUS_SELLER)),
+        ("classify_response/counter", lambda: run(classify_response(SHORT_SELLER, BUYER_OFFER))),
+        ("classify_response/minimum_price", lambda: run(classify_response(LONG_SELLER, BUYER_OFFER))),
+    ]
+    # Every benchmark gets its own state, since some of them append to it
+    for label, turns in (("10_turns", 10), ("500_turns", 500)):
+        benchmarks += [
+            (f"last_buyer_price/{label}", build_state(turns).get_last_buyer_price),
+            (f"last_seller_price/{label}", build_state(turns).get_last_seller_price),
+            (f"update_metrics/{label}",
+             lambda state=build_state(turns): run(update_negotiation_metrics(state, BUYER_OFFER, SHORT_SELLER, "counter-offer"))),
+            (f"evaluate_strategy/{label}",
+             lambda state=build_state(turns): evaluate_strategy(state, "split_difference", "counter-offer")),
+            (f"build_seller_prompt/{label}", lambda state=build_state(turns): build_seller_prompt(state, BUYER_OFFER)),
+            (f"serialize_response/{label}",
+             lambda state=build_state(turns): NegotiationResponse(
+                 negotiation_id="bench",
+                 history=state.history,
+                 current_offer=state.current_offer,
+                 agreed_price=state.agreed_price,
+                 available_offers=[BUYER_OFFER] * 4,
+                 progress_score=state.get_negotiation_progress(),
+                 metrics=state.metrics,
+                 sentiment=None
+             ).model_dump_json()),
+        ]
+    return benchmarks
+
+
+def measure(func, repeat=5):
+    """Return the best and median time per call in microseconds."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    times = sorted(t / number * 1e6 for t in timer.repeat(repeat=repeat, number=number))
+    return {"best_us": round(times[0], 3), "median_us": round(times[len(times) // 2], 3)}
+
+
+def run_benchmarks(selected=None):
+    results = {}
+    for name, func in make_benchmarks():
+        if selected and not any(pattern in name for pattern in selected):
+            continue
+        results[name] = measure(func)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print the change against the baseline; return the names that regressed."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline["results"]:
+            print(f"{name:40s} {result['best_us']:12.2f} us   (new)")
+            continue
+        before = baseline["results"][name]["best_us"]
+        ratio = result["best_us"] / before if before else float("inf")
+        flag = ""
+        if ratio > tolerance:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:40s} {result['best_us']:12.2f} us   {ratio:6.2f}x baseline{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--save", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--compare", action="store_true", help="compare against the stored baseline")
+    parser.add_argument("--tolerance", type=float, default=1.5,
+                        help="slowdown factor that counts as a regression (default: 1.5)")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline file")
+    parser.add_argument("-k", dest="selected", action="append", help="only run benchmarks containing this text")
+    args = parser.parse_args(argv)
+
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    results = run_benchmarks(args.selected)
+
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) slower than {args.tolerance}x baseline")
+            return 1
+    else:
+        for name, result in results.items():
+            print(f"{name:40s} {result['best_us']:12.2f} us   (median {result['median_us']:.2f} us)")
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": results
+            }, f, indent=2)
+            f.write("\n")
+        print(f"\nSaved baseline to {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,94 @@
 # Configuration settings (can expand later)
-MODEL_NAME = "claude-3.5-sonnet-20240229"
-MAX_TOKENS = 1000
-NUM_OFFERS = 3
\ No newline at end of file
+import os
+
+# Model, default completion length and number of buyer offers shown per turn
+MODEL_NAME = os.getenv("MODEL_NAME", "claude-3-7-sonnet-20250219")
+MAX_TOKENS = int(os.getenv("MAX_TOKENS", "1000"))
+NUM_OFFERS = int(os.getenv("NUM_OFFERS", "4"))
+
+# Sentiment cache: seller messages are analyzed once and reused for the rest of the turn
+SENTIMENT_CACHE_SIZE = int(os.getenv("SENTIMENT_CACHE_SIZE", "1024"))
+SENTIMENT_CACHE_TTL = float(os.getenv("SENTIMENT_CACHE_TTL", "600"))
+
+# Session store: "memory" (per-process, bounded) or "sqlite" (shared by workers, survives restarts)
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "negotiations.db")
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "3600"))
+# Event log: every session change is appended to this SQLite file ("" disables it) and
+# replayed from the latest snapshot after a restart. Writes are batched and fsync'd every
+# EVENT_LOG_FLUSH_INTERVAL seconds; a session is snapshotted every EVENT_LOG_SNAPSHOT_EVERY events
+EVENT_LOG_PATH = os.getenv("EVENT_LOG_PATH", "")
+EVENT_LOG_FLUSH_INTERVAL = float(os.getenv("EVENT_LOG_FLUSH_INTERVAL", "0.2"))
+EVENT_LOG_SNAPSHOT_EVERY = int(os.getenv("EVENT_LOG_SNAPSHOT_EVERY", "20"))
+# Page size of GET /negotiations when no limit is given, and the largest allowed
+SESSION_LIST_DEFAULT_LIMIT = int(os.getenv("SESSION_LIST_DEFAULT_LIMIT", "50"))
+SESSION_LIST_MAX_LIMIT = int(os.getenv("SESSION_LIST_MAX_LIMIT", "500"))
+# Batch endpoints: most items per request, and items of one batch played at once
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "16"))
+# Autopilot: most turns one run may play (also its default) and its default deadline in seconds
+AUTOPILOT_MAX_ROUNDS = int(os.getenv("AUTOPILOT_MAX_ROUNDS", "20"))
+AUTOPILOT_DEADLINE = float(os.getenv("AUTOPILOT_DEADLINE", "120"))
+
+# Prompt context: up to CONTEXT_RECENT_TURNS messages are sent verbatim, older ones
+# are folded into a short summary; the whole view is kept under CONTEXT_TOKEN_BUDGET.
+# Messages are folded CONTEXT_FOLD_CHUNK at a time, so the prompt prefix stays the
+# same between folds and stays above the provider's minimum cacheable length
+# (1024 tokens) after one.
+CONTEXT_RECENT_TURNS = int(os.getenv("CONTEXT_RECENT_TURNS", "40"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "4000"))
+CONTEXT_FOLD_CHUNK = int(os.getenv("CONTEXT_FOLD_CHUNK", "16"))
+
+# LLM backend: "anthropic" (default), "record" (anthropic + write a cassette),
+# "replay" (serve the cassette offline) or "fake" (fast deterministic responses)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "anthropic")
+LLM_CASSETTE_PATH = os.getenv("LLM_CASSETTE_PATH", "llm_cassette.jsonl")
+LLM_REPLAY_LATENCY = float(os.getenv("LLM_REPLAY_LATENCY", "0"))
+LLM_FAKE_LATENCY = float(os.getenv("LLM_FAKE_LATENCY", "0"))
+# LLM limiter: calls in flight, optional requests/input tokens per minute (0 = unlimited),
+# and jittered exponential backoff for rate-limited (429) or overloaded (529) calls
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "0"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1.0"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+# Number of recent calls whose token usage (cached vs. uncached input) is kept for /stats
+LLM_USAGE_LOG_SIZE = int(os.getenv("LLM_USAGE_LOG_SIZE", "1000"))
+
+# LLM output mode: "text" (default; free-text replies parsed with regexes and phrase
+# heuristics) or "structured" (tool-use calls: one returns the seller's reply with its
+# classification, stated minimum and sentiment, another the offers with prices and
+# strategy tags; the text path remains the fallback when they do not validate)
+LLM_OUTPUT_MODE = os.getenv("LLM_OUTPUT_MODE", "text")
+
+# Speculative seller replies: while the buyer reads the offers, precompute the seller's
+# reply to the SPECULATIVE_TOP_K most often picked offer positions (0 disables), with at
+# most SPECULATIVE_MAX_PER_SESSION per session and SPECULATIVE_MAX_GLOBAL running overall
+SPECULATIVE_TOP_K = int(os.getenv("SPECULATIVE_TOP_K", "0"))
+SPECULATIVE_MAX_PER_SESSION = int(os.getenv("SPECULATIVE_MAX_PER_SESSION", "4"))
+SPECULATIVE_MAX_GLOBAL = int(os.getenv("SPECULATIVE_MAX_GLOBAL", "64"))
+
+# Strategy recommendations: weight of the UCB exploration bonus against observed
+# effectiveness (0 always recommends the best-performing strategy so far)
+STRATEGY_EXPLORATION = float(os.getenv("STRATEGY_EXPLORATION", "1.0"))
+
+# Logging: level-gated records from the "src" loggers, as JSON lines ("json") or "text"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "WARNING")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# A session counts as active on /metrics if it was updated within this many seconds
+METRICS_ACTIVE_WINDOW = float(os.getenv("METRICS_ACTIVE_WINDOW", "300"))
+
+# Sentiment engine: "llm" (default), "local" (lexicon scorer, no LLM call) or "hybrid"
+# (local score, falling back to the LLM when fewer lexicon terms matched)
+SENTIMENT_ENGINE = os.getenv("SENTIMENT_ENGINE", "llm")
+SENTIMENT_HYBRID_MIN_CONFIDENCE = float(os.getenv("SENTIMENT_HYBRID_MIN_CONFIDENCE", "0.5"))
+
+# Responses larger than this many bytes are gzipped for clients that accept it
+# (the /make_offer/stream event stream is never compressed)
+GZIP_MINIMUM_SIZE = int(os.getenv("GZIP_MINIMUM_SIZE", "1000"))
+
+# Open a connection to the LLM provider when the app starts, so the first request
+# does not pay for the TCP/TLS handshake (network backends only)
+LLM_PREWARM = os.getenv("LLM_PREWARM", "true").lower() in ("1", "true", "yes")
@@ -1,32 +1,85 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import APIRouter, Body, Depends, FastAPI, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from prometheus_client import CollectorRegistry
+from pydantic import BaseModel, ValidationError
 from typing import List, Optional, Tuple, Dict, Any
 from .negotiation_stage import NegotiationState
 from .negotiation_logic import (
     generate_buyer_offers, 
-    simulate_seller_response, 
     classify_response, 
     update_state,
-    analyze_negotiation_sentiment
+    analyze_negotiation_sentiment,
+    stream_buyer_offers,
+    stream_seller_response,
+    get_classification_stats,
+    classification_stats,
+    structured_stats,
+    evaluate_strategy,
+    note_seller_minimum,
+    play_turn,
+    sentiment_cache,
+    sentiment_stats,
+    OFFER_STRATEGIES
 )
+from .llm_interface import create_llm_client, get_llm_usage_stats, use_llm_client
+from .event_log import create_event_log, mark_turn, turn_events
+from .logs import configure_logging
+from .messages import replace_prices
+from .metrics import CONTENT_TYPE, REGISTRY, STAGE_LATENCY, CallbackMetric, render, timed_stage, turn_scope
+from .policies import make_policy, offer_strategy
+from .rate_limit import LLMRateLimitError
+from .session_store import SESSION_STATUSES, SessionConflictError, SessionQuery, create_session_store
+from .speculation import create_speculator
+from .strategy_stats import strategy_context, strategy_stats
+from config import settings
+from contextlib import asynccontextmanager
+import asyncio
+import json
+import logging
+import random
 import uuid
 import time
-import re
+import weakref
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
 
-# Enable CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # In production, replace with your frontend URL
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+router = APIRouter()
+
+class NegotiationGZipMiddleware(GZipMiddleware):
+    """Gzip large responses, except event and batch streams (including autopilot runs), which must reach the client unbuffered."""
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and (scope["path"].endswith(("/stream", "/autopilot")) or scope["path"].startswith("/negotiations/batch/")):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+# Metrics read from existing counters when /metrics is scraped
+CallbackMetric(
+    "negotiation_classifications_total", "Seller responses classified, by method", "counter",
+    lambda: {
+        ("phrases",): classification_stats['total'] - classification_stats['llm_fallback'],
+        ("llm",): classification_stats['llm_fallback']
+    },
+    labelnames=["method"]
+)
+CallbackMetric(
+    "negotiation_classification_fallback_ratio", "Share of classifications that needed the LLM", "gauge",
+    lambda: get_classification_stats()['llm_fallback_rate']
+)
+CallbackMetric(
+    "llm_structured_fallbacks_total", "Structured calls that fell back to the text path", "counter",
+    lambda: structured_stats['fallbacks']
 )
 
-# Store active negotiations (in production, use a proper database)
-negotiations = {}
+async def llm_rate_limited(request: Request, exc: LLMRateLimitError):
+    """The provider kept rate limiting us: ask the client to retry later rather than failing with 500."""
+    logger.warning("llm rate limited", extra={"path": request.url.path, "retry_after": exc.retry_after})
+    headers = {"Retry-After": str(max(1, round(exc.retry_after or settings.LLM_BACKOFF_MAX)))}
+    return JSONResponse({"detail": "LLM provider is rate limited, try again later"}, status_code=503, headers=headers)
 
 class NegotiationResponse(BaseModel):
     negotiation_id: str
@@ -37,6 +90,113 @@ class NegotiationResponse(BaseModel):
     progress_score: float
     metrics: Dict[str, Any]
     sentiment: Optional[Dict[str, float]]
+    offer_strategies: Optional[List[Optional[str]]] = None  # Strategy tag per offer (structured mode)
+    version: int = 0  # Increases every time the negotiation is saved; also sent as the ETag
+    since: Optional[int] = None  # Set for delta responses: history and sentiment start after this entry
+
+async def get_services(request: Request):
+    """
+    The app's session store (`negotiations`), event log, speculator, turn locks
+    and LLM client, kept on `app.state` by `create_app`. The request's LLM calls,
+    including the ones of tasks it starts, go through the app's client.
+    """
+    use_llm_client(request.app.state.llm)
+    return request.app.state
+
+class TurnLocks:
+    """
+    One asyncio.Lock per negotiation, held while a turn is chosen, played and
+    saved, so make_offer, its stream, batch items and autopilot runs on the same
+    negotiation take turns. A lock lives as long as someone holds or awaits it.
+    """
+    
+    def __init__(self):
+        self._locks = weakref.WeakValueDictionary()
+    
+    def __call__(self, negotiation_id):
+        lock = self._locks.get(negotiation_id)
+        if lock is None:
+            lock = self._locks[negotiation_id] = asyncio.Lock()
+        return lock
+
+def save_negotiation(services, negotiation_id, negotiation):
+    """
+    Store a negotiation record under a new version, if the stored one is still
+    the version it was read at. Answers 409 if another request saved it since.
+    """
+    version = negotiation.get("version", 0)
+    negotiation["version"] = version + 1
+    try:
+        services.negotiations.put(negotiation_id, negotiation, expected_version=version)
+    except SessionConflictError:
+        negotiation["version"] = version
+        raise HTTPException(status_code=409, detail="Negotiation was changed by another request, try again")
+
+def log_turn(services, negotiation_id, negotiation, mark, classification, strategy_name, context):
+    """
+    Log a turn once it is saved, with the strategy's outcome in `context`, and
+    snapshot the session every EVENT_LOG_SNAPSHOT_EVERY events.
+    """
+    event_log = services.event_log
+    if event_log is None:
+        return
+    for kind, data in turn_events(negotiation["state"], mark, classification, negotiation["available_offers"],
+                                  strategy_name, context):
+        event_log.append(negotiation_id, kind, data)
+    event_log.snapshot(negotiation_id, negotiation)
+
+def negotiation_etag(negotiation):
+    return f'W/"{negotiation.get("version", 0)}"'
+
+def not_modified(request, negotiation):
+    """True if the client's If-None-Match already names the current version."""
+    tags = request.headers.get("if-none-match")
+    if not tags:
+        return False
+    # Weak comparison: W/"3" and "3" name the same version
+    current = negotiation_etag(negotiation).removeprefix("W/")
+    return tags.strip() == "*" or any(tag.strip().removeprefix("W/") == current for tag in tags.split(","))
+
+def check_offer_index(negotiation, offer_request):
+    if negotiation is None:
+        raise HTTPException(status_code=404, detail="Negotiation not found")
+    if offer_request.offer_index < 0 or offer_request.offer_index >= len(negotiation["available_offers"]):
+        raise HTTPException(status_code=400, detail="Invalid offer index")
+
+def check_since(state, since):
+    if since is not None and not 0 <= since <= len(state.history):
+        raise HTTPException(status_code=400, detail="since must be between 0 and the history length")
+
+def negotiation_response(negotiation_id, negotiation, sentiment, since=None):
+    """
+    Build the response for a negotiation record. With `since`, only the history
+    entries after the first `since` and the sentiment readings taken after them
+    are included, so polling costs the same however long the negotiation gets.
+    """
+    state = negotiation["state"]
+    offers = negotiation["available_offers"]
+    history, metrics = state.history, state.metrics
+    if since is not None:
+        check_since(state, since)
+        history, metrics = history[since:], state.metrics_since(since)
+    return NegotiationResponse(
+        negotiation_id=negotiation_id,
+        history=history,
+        current_offer=state.current_offer,
+        agreed_price=state.agreed_price,
+        available_offers=offers,
+        offer_strategies=offer_strategies(offers),
+        progress_score=state.get_negotiation_progress(),
+        metrics=metrics,
+        sentiment=sentiment,
+        version=negotiation.get("version", 0),
+        since=since
+    )
+
+def offer_strategies(offers):
+    """Strategy tags of the offers, or None if they came from the free-text path."""
+    tags = [getattr(offer, "strategy", None) for offer in offers]
+    return tags if any(tags) else None
 
 class OfferRequest(BaseModel):
     offer_index: int
@@ -46,12 +206,19 @@ class OfferRequest(BaseModel):
 
 class NegotiationOptions(BaseModel):
     include_stand_firm: bool = True
-    num_offers: int = 4
+    num_offers: int = settings.NUM_OFFERS
     initial_price_range: Optional[Tuple[float, float]] = None
 
-@app.post("/negotiations/start")
-async def start_negotiation(options: Optional[NegotiationOptions] = None):
+@router.post("/negotiations/start")
+async def start_negotiation(response: Response, options: Optional[NegotiationOptions] = None,
+                            services=Depends(get_services)):
     """Start a new negotiation session with optional configuration."""
+    negotiation_id, negotiation = await open_negotiation(services, options)
+    response.headers["ETag"] = negotiation_etag(negotiation)
+    return negotiation_response(negotiation_id, negotiation, None)  # No sentiment yet as negotiation just started
+
+async def open_negotiation(services, options=None):
+    """Create, store and log a new negotiation with its first offers. Returns its id and record."""
     # Use default options if none provided
     if options is None:
         options = NegotiationOptions()
@@ -64,7 +231,7 @@ async def start_negotiation(options: Optional[NegotiationOptions] = None):
         state.max_price = options.initial_price_range[1]
     
     # Generate initial offers
-    offers = generate_buyer_offers(
+    offers = await generate_buyer_offers(
         state, 
         num_offers=options.num_offers, 
         include_stand_firm=options.include_stand_firm
@@ -72,51 +239,49 @@ async def start_negotiation(options: Optional[NegotiationOptions] = None):
     
     # Store the state and offers
     negotiation_id = str(uuid.uuid4())
-    negotiations[negotiation_id] = {
+    negotiation = {
         "state": state,
         "available_offers": offers,
         "created_at": time.time(),
         "last_updated": time.time()
     }
-    
-    return NegotiationResponse(
-        negotiation_id=negotiation_id,
-        history=state.history,
-        current_offer=state.current_offer,
-        agreed_price=state.agreed_price,
-        available_offers=offers,
-        progress_score=state.get_negotiation_progress(),
-        metrics=state.metrics,
-        sentiment=None  # No sentiment yet as negotiation just started
-    )
+    save_negotiation(services, negotiation_id, negotiation)
+    if services.event_log is not None:
+        services.event_log.append(negotiation_id, "start", {"created_at": negotiation["created_at"]})
+        services.event_log.snapshot(negotiation_id, negotiation, force=True)
+    services.speculator.start(negotiation_id, state, offers)
+    return negotiation_id, negotiation
 
-@app.post("/negotiations/{negotiation_id}/make_offer")
-async def make_offer(negotiation_id: str, offer_request: OfferRequest):
-    """Make an offer and get the seller's response."""
-    if negotiation_id not in negotiations:
-        raise HTTPException(status_code=404, detail="Negotiation not found")
-    
-    negotiation = negotiations[negotiation_id]
+def prepare_buyer_turn(services, negotiation_id, offer_request, since=None):
+    """
+    Validate an offer request and add the buyer's message to a private copy of
+    the negotiation, which the turn is played on and which is only saved (and
+    logged) once the turn is complete, so a turn that fails or is abandoned
+    halfway leaves no trace. Returns the negotiation record, the chosen offer
+    text, the strategy name and the context the strategy is chosen in (for the
+    cross-session strategy stats).
+    """
+    negotiation = services.negotiations.checkout(negotiation_id)
+    check_offer_index(negotiation, offer_request)
     state = negotiation["state"]
     offers = negotiation["available_offers"]
-    
-    if offer_request.offer_index < 0 or offer_request.offer_index >= len(offers):
-        raise HTTPException(status_code=400, detail="Invalid offer index")
+    check_since(state, since)
+    context = strategy_context(state)
     
     # Record the chosen strategy if provided
     strategy_name = None
     if offer_request.strategy:
         strategy_name = offer_request.strategy
-        print(f"Strategy selected: {strategy_name}")  # Debug print
+        logger.debug("Strategy selected", extra={"negotiation_id": negotiation_id, "strategy": strategy_name})
         state.record_strategy(strategy_name)
     
     # Use explicit offer text if provided, otherwise use the offer from available offers
     chosen_offer = offer_request.offer_text if offer_request.offer_text else offers[offer_request.offer_index]
-    print(f"Chosen offer: {chosen_offer}")  # Debug print
+    logger.debug("Offer chosen", extra={"negotiation_id": negotiation_id, "offer": chosen_offer})
     
     # If explicit price is provided from the frontend, use it
     if offer_request.explicit_price is not None:
-        print(f"Using explicit price: ${offer_request.explicit_price}")  # Debug print
+        logger.debug("Using explicit price", extra={"negotiation_id": negotiation_id, "price": offer_request.explicit_price})
         
         # For stand_firm strategy, we need to ensure we're using the correct price
         if strategy_name == "stand_firm":
@@ -124,15 +289,11 @@ async def make_offer(negotiation_id: str, offer_request: OfferRequest):
             buyer_last_price = state.get_last_buyer_price()
             
             if buyer_last_price is not None:
-                print(f"Standing firm at buyer's last price: ${buyer_last_price}")
+                logger.debug("Standing firm at the buyer's last price", extra={"price": buyer_last_price})
                 # Use the buyer's last price
                 state.current_offer = buyer_last_price
                 # Update the offer text to reflect the correct price
-                chosen_offer = re.sub(
-                    r'\$[0-9,]+(?:\.[0-9]+)?', 
-                    f"${buyer_last_price:,.2f}", 
-                    chosen_offer
-                )
+                chosen_offer = replace_prices(chosen_offer, buyer_last_price)
             else:
                 # If no previous buyer price, use the explicit price
                 state.current_offer = offer_request.explicit_price
@@ -143,118 +304,500 @@ async def make_offer(negotiation_id: str, offer_request: OfferRequest):
     # Add the buyer's message to history BEFORE generating the seller's response
     state.add_to_history("Buyer", chosen_offer)
     
-    # Generate the seller's response based on the updated state
-    seller_response = simulate_seller_response(state, chosen_offer)
+    return negotiation, chosen_offer, strategy_name, context
+
+@router.post("/negotiations/{negotiation_id}/make_offer")
+async def make_offer(negotiation_id: str, offer_request: OfferRequest, response: Response, since: Optional[int] = None,
+                     services=Depends(get_services)):
+    """Make an offer and get the seller's response (only what changed after `since` history entries, if given)."""
+    async with services.turn_locks(negotiation_id):
+        negotiation, sentiment = await play_offer(services, negotiation_id, offer_request, since)
+    response.headers["ETag"] = negotiation_etag(negotiation)
+    return negotiation_response(negotiation_id, negotiation, sentiment, since)
+
+async def play_offer(services, negotiation_id, offer_request, since=None):
+    """
+    Play one turn of a negotiation with the buyer's chosen offer, then store
+    and log it. Returns the record and the sentiment of the seller's reply.
+    A `since` the response cannot be built for is rejected before the turn is
+    played. The caller holds the negotiation's turn lock.
+    """
+    negotiation, chosen_offer, strategy_name, context = prepare_buyer_turn(services, negotiation_id, offer_request, since)
+    state = negotiation["state"]
+    mark = mark_turn(state, strategy_name)
     
-    # Analyze the response
-    classification = classify_response(seller_response, chosen_offer)
-    print(f"Response classification: {classification}")  # Debug print
+    seller_turn = await services.speculator.claim(negotiation_id, offer_request.offer_index, chosen_offer, state)
+    results = await play_turn(state, chosen_offer, strategy_name, seller_turn=seller_turn, context=context)
+    seller_response = results["seller"]
+    new_offers = results["offers"]
+    logger.debug("Turn played", extra={"negotiation_id": negotiation_id, "classification": results['classification']})
     
-    # Update the state with the new information (but don't add the buyer's message again)
-    # We'll modify update_state to avoid adding the buyer's message twice
-    update_state(state, None, seller_response, classification)
+    # Update negotiation with new offers
+    negotiation["available_offers"] = new_offers
+    save_negotiation(services, negotiation_id, negotiation)
+    log_turn(services, negotiation_id, negotiation, mark, results["classification"], strategy_name, context)
+    services.speculator.start(negotiation_id, state, new_offers)
+    return negotiation, results["sentiment"] if seller_response else None
+
+def sse_event(event, data):
+    """Format one Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/negotiations/{negotiation_id}/make_offer/stream")
+async def make_offer_stream(negotiation_id: str, offer_request: OfferRequest, services=Depends(get_services)):
+    """
+    Streaming variant of make_offer. Sends the seller's reply token by token,
+    then the classification, state and metrics, then each new buyer offer as
+    it is generated, and finally the full negotiation response. The turn is
+    saved just before that, so a client that disconnects mid-stream leaves the
+    negotiation as it was. The turn is played under the negotiation's turn
+    lock; errors once the stream has started (such as an offer that is gone by
+    the time the lock is free) are sent as an "error" event.
+    """
+    check_offer_index(services.negotiations.get(negotiation_id), offer_request)
     
-    # Evaluate if the strategy was effective
-    if strategy_name:
-        # A strategy is effective if:
-        # 1. The seller accepted the offer
-        # 2. The seller made a counter-offer that's better than previous
-        # 3. The sentiment improved
-        was_effective = False
-        
-        if classification == "accept":
-            was_effective = True
-        elif classification == "counter-offer" and state.current_offer:
-            # Check if this counter-offer is better than previous
-            previous_offers = [price for speaker, price in state.price_history if speaker == "Seller"]
-            if previous_offers and len(previous_offers) >= 2:
-                if previous_offers[-1] < previous_offers[-2]:
-                    was_effective = True
-        
-        # Update strategy effectiveness
-        state.record_strategy(strategy_name, was_effective)
-        print(f"Strategy {strategy_name} effectiveness: {was_effective}")  # Debug print
+    async def events():
+        try:
+            async with services.turn_locks(negotiation_id):
+                negotiation, chosen_offer, strategy_name, context = prepare_buyer_turn(services, negotiation_id, offer_request)
+                state = negotiation["state"]
+                mark = mark_turn(state, strategy_name)
+                with turn_scope():
+                    seller_turn = await services.speculator.claim(negotiation_id, offer_request.offer_index, chosen_offer, state)
+                    if seller_turn is not None:
+                        # Precomputed while the buyer was choosing: send the reply in one piece
+                        seller_response = seller_turn.message
+                        yield sse_event("seller_token", {"text": seller_response})
+                    else:
+                        chunks = []
+                        start = time.perf_counter()
+                        async for chunk in stream_seller_response(state, chosen_offer):
+                            chunks.append(chunk)
+                            yield sse_event("seller_token", {"text": chunk})
+                        seller_response = "".join(chunks)
+                        STAGE_LATENCY.labels("seller").observe(time.perf_counter() - start)
+                    yield sse_event("seller_message", {"text": seller_response})
+            
+                    if seller_turn is not None:
+                        classification, sentiment = seller_turn.classification, seller_turn.sentiment
+                    else:
+                        classification, sentiment = await asyncio.gather(
+                            timed_stage("classification", classify_response(seller_response, chosen_offer, state)),
+                            timed_stage("sentiment", analyze_negotiation_sentiment(seller_response, state))
+                        )
+                    yield sse_event("classification", {"classification": classification})
+            
+                    await update_state(state, None, seller_response, classification,
+                                       seller_turn.minimum_price if seller_turn is not None else None)
+                    if strategy_name:
+                        evaluate_strategy(state, strategy_name, classification, context)
+                    yield sse_event("state", {
+                        "current_offer": state.current_offer,
+                        "agreed_price": state.agreed_price,
+                        "progress_score": state.get_negotiation_progress()
+                    })
+                    yield sse_event("metrics", {"metrics": state.metrics, "sentiment": sentiment})
+            
+                    new_offers = []
+                    if not state.agreed_price:
+                        note_seller_minimum(state, classification)
+                        start = time.perf_counter()
+                        async for offer in stream_buyer_offers(state, include_stand_firm=True):
+                            yield sse_event("offer", {"index": len(new_offers), "text": offer})
+                            new_offers.append(offer)
+                        STAGE_LATENCY.labels("offers").observe(time.perf_counter() - start)
+                    negotiation["available_offers"] = new_offers
+                    save_negotiation(services, negotiation_id, negotiation)
+                    log_turn(services, negotiation_id, negotiation, mark, classification, strategy_name, context)
+                    services.speculator.start(negotiation_id, state, new_offers)
+            
+                    response = negotiation_response(negotiation_id, negotiation, sentiment)
+                    yield sse_event("done", response.model_dump())
+        except Exception as e:
+            logger.exception("Error streaming offer response", extra={"negotiation_id": negotiation_id})
+            yield sse_event("error", {"detail": str(e)})
     
-    # Generate new offers if negotiation is still ongoing
-    new_offers = []
-    if not state.agreed_price:
-        include_stand_firm = True
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+class AutopilotRequest(BaseModel):
+    policy: str = "first"  # A buyer policy from src/policies.py
+    policy_options: Dict[str, Any] = {}  # e.g. {"index": 2} for "pick", {"target_price": 21000} for "target_price"
+    max_rounds: int = settings.AUTOPILOT_MAX_ROUNDS
+    deadline: float = settings.AUTOPILOT_DEADLINE  # Seconds; no new turn starts after it
+    seed: Optional[int] = None  # For the "random" policy
+
+@router.post("/negotiations/{negotiation_id}/autopilot")
+async def autopilot(negotiation_id: str, request: AutopilotRequest, services=Depends(get_services)):
+    """
+    Play a negotiation server-side with a buyer policy until the seller agrees,
+    `max_rounds` turns have been played or the deadline passes. Streams a "turn"
+    event per round (as Server-Sent Events) and a final "done" event with the
+    reason it stopped and the full negotiation response.
+    """
+    if services.negotiations.get(negotiation_id) is None:
+        raise HTTPException(status_code=404, detail="Negotiation not found")
+    if not 1 <= request.max_rounds <= settings.AUTOPILOT_MAX_ROUNDS:
+        raise HTTPException(status_code=400, detail=f"max_rounds must be between 1 and {settings.AUTOPILOT_MAX_ROUNDS}")
+    try:
+        policy = make_policy(request.policy, **request.policy_options)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    rng = random.Random(request.seed)
+    deadline = time.monotonic() + request.deadline
+    
+    async def events():
+        try:
+            rounds, reason, sentiment = 0, None, None
+            while reason is None:
+                # No other turn on the negotiation between choosing the offer and playing it
+                async with services.turn_locks(negotiation_id):
+                    negotiation = services.negotiations.get(negotiation_id)
+                    if negotiation is None:
+                        reason = "deleted"
+                    elif negotiation["state"].is_terminal():
+                        reason = "agreed"
+                    elif not negotiation["available_offers"]:
+                        reason = "no_offers"
+                    elif rounds >= request.max_rounds:
+                        reason = "max_rounds"
+                    elif time.monotonic() >= deadline:
+                        reason = "deadline"
+                    else:
+                        state, offers = negotiation["state"], negotiation["available_offers"]
+                        index = policy.choose(state, offers, rng)
+                        known = len(state.history)
+                        offer_request = OfferRequest(offer_index=index, strategy=offer_strategy(state, offers[index]))
+                        negotiation, sentiment = await play_offer(services, negotiation_id, offer_request)
+                if reason is None:
+                    state = negotiation["state"]  # The copy of the record the turn was played on
+                    rounds += 1
+                    yield sse_event("turn", {
+                        "round": rounds,
+                        "offer_index": index,
+                        "strategy": offer_request.strategy,
+                        "history": state.history[known:],
+                        "current_offer": state.current_offer,
+                        "agreed_price": state.agreed_price,
+                        "progress_score": state.get_negotiation_progress(),
+                        "sentiment": sentiment
+                    })
+            done = {"reason": reason, "rounds": rounds}
+            if negotiation is not None:
+                done["negotiation"] = negotiation_response(negotiation_id, negotiation, sentiment).model_dump()
+            logger.info("Autopilot finished", extra={"negotiation_id": negotiation_id, "reason": reason, "rounds": rounds})
+            yield sse_event("done", done)
+        except Exception as e:
+            logger.exception("Error in autopilot", extra={"negotiation_id": negotiation_id})
+            yield sse_event("error", {"detail": str(e)})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+class BatchOfferRequest(OfferRequest):
+    negotiation_id: str
+
+def check_batch_size(items):
+    if not 1 <= len(items) <= settings.BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"A batch must have between 1 and {settings.BATCH_MAX_ITEMS} items")
+
+async def batch_item(index, job):
+    """Run one batch item; its errors become its result instead of failing the batch."""
+    try:
+        negotiation_id, negotiation, sentiment = await job()
+        response = negotiation_response(negotiation_id, negotiation, sentiment)
+        return {"index": index, "status": 200, "negotiation": response.model_dump()}
+    except HTTPException as e:
+        return {"index": index, "status": e.status_code, "detail": e.detail}
+    except ValidationError as e:
+        return {"index": index, "status": 422, "detail": jsonable_encoder(e.errors(include_url=False))}
+    except LLMRateLimitError:
+        return {"index": index, "status": 503, "detail": "LLM provider is rate limited, try again later"}
+    except Exception as e:
+        logger.exception("Batch item failed", extra={"index": index})
+        return {"index": index, "status": 500, "detail": str(e)}
+
+def parse_batch_item(model, item):
+    """Validate one batch item as `model`: the parsed item, or the ValidationError that becomes its result."""
+    try:
+        return model.model_validate(item)
+    except ValidationError as e:
+        return e
+
+def invalid_item(error):
+    async def job():
+        raise error
+    return job
+
+def batch_response(chains):
+    """
+    Run batch items concurrently, at most BATCH_CONCURRENCY at a time (their LLM
+    calls also go through the limiter), and stream one NDJSON line per item in
+    completion order. `chains` are lists of (index, job) run one after another:
+    offers to the same negotiation must not overlap.
+    """
+    async def lines():
+        semaphore = asyncio.Semaphore(settings.BATCH_CONCURRENCY)
+        done = asyncio.Queue()
         
-        # If the seller rejected with a minimum price, make sure we generate offers accordingly
-        if classification == "reject" and hasattr(state, 'seller_minimum_price'):
-            print(f"Generating offers considering seller's minimum price: ${state.seller_minimum_price}")
-            # If the minimum price is higher than the current offer, generate offers accordingly
-            if state.current_offer < state.seller_minimum_price:
-                # Add an information message about the seller's minimum price
-                seller_minimum_note = f"The seller has indicated they cannot go below ${state.seller_minimum_price:,.2f}."
-                state.add_to_history("System", seller_minimum_note)
+        async def run_chain(chain):
+            for index, job in chain:
+                async with semaphore:
+                    result = await batch_item(index, job)
+                await done.put(result)
         
-        # Generate new offers
-        new_offers = generate_buyer_offers(state, include_stand_firm=include_stand_firm)
+        tasks = [asyncio.create_task(run_chain(chain)) for chain in chains]
+        try:
+            for _ in range(sum(len(chain) for chain in chains)):
+                yield json.dumps(await done.get()) + "\n"
+        finally:
+            for task in tasks:  # The client went away: stop what is left
+                task.cancel()
     
-    # Update negotiation with new offers
-    negotiation["available_offers"] = new_offers
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers={"Cache-Control": "no-cache"})
+
+@router.post("/negotiations/batch/start")
+async def start_negotiations(options: List[Any] = Body(...), services=Depends(get_services)):
+    """
+    Start many negotiations at once. Returns NDJSON lines {"index", "status",
+    "negotiation"} (or "detail" for a failed item) as each one is ready. Items
+    are validated one by one, so a malformed item gets a 422 line of its own.
+    """
+    check_batch_size(options)
     
-    # Prepare response
-    response = NegotiationResponse(
-        negotiation_id=negotiation_id,
-        history=state.history,
-        current_offer=state.current_offer,
-        agreed_price=state.agreed_price,
-        available_offers=new_offers,
-        progress_score=state.get_negotiation_progress(),
-        metrics=state.metrics,
-        sentiment=analyze_negotiation_sentiment(seller_response) if seller_response else None
-    )
+    def job(item_options):
+        if isinstance(item_options, ValidationError):
+            return invalid_item(item_options)
+        async def start():
+            negotiation_id, negotiation = await open_negotiation(services, item_options)
+            return negotiation_id, negotiation, None
+        return start
     
-    return response
+    return batch_response([
+        [(index, job(None if item is None else parse_batch_item(NegotiationOptions, item)))]
+        for index, item in enumerate(options)
+    ])
 
-@app.get("/negotiations/{negotiation_id}")
-async def get_negotiation(negotiation_id: str):
-    """Get the current state of a negotiation."""
-    if negotiation_id not in negotiations:
+@router.post("/negotiations/batch/offers")
+async def make_offers(offers: List[Any] = Body(...), services=Depends(get_services)):
+    """
+    Make offers in many negotiations at once; offers to the same negotiation are
+    played in the order given. Returns NDJSON lines like /negotiations/batch/start.
+    """
+    check_batch_size(offers)
+    
+    def job(offer_request):
+        if isinstance(offer_request, ValidationError):
+            return invalid_item(offer_request)
+        async def play():
+            async with services.turn_locks(offer_request.negotiation_id):
+                negotiation, sentiment = await play_offer(services, offer_request.negotiation_id, offer_request)
+            return offer_request.negotiation_id, negotiation, sentiment
+        return play
+    
+    chains = {}
+    for index, item in enumerate(offers):
+        offer_request = parse_batch_item(BatchOfferRequest, item)
+        key = index if isinstance(offer_request, ValidationError) else offer_request.negotiation_id
+        chains.setdefault(key, []).append((index, job(offer_request)))
+    return batch_response(list(chains.values()))
+
+@router.get("/negotiations/{negotiation_id}")
+async def get_negotiation(negotiation_id: str, request: Request, response: Response, since: Optional[int] = None,
+                          services=Depends(get_services)):
+    """
+    Get the current state of a negotiation. Answers 304 if If-None-Match names the
+    current version; with `since`, returns only what changed after that many history entries.
+    """
+    negotiation = services.negotiations.get(negotiation_id)
+    if negotiation is None:
         raise HTTPException(status_code=404, detail="Negotiation not found")
     
-    negotiation = negotiations[negotiation_id]
+    etag = negotiation_etag(negotiation)
+    if not_modified(request, negotiation):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    
     state = negotiation["state"]
     
     # Get the latest sentiment if available
     latest_sentiment = None
-    if state.metrics['sentiment_history']:
+    if state.metrics.get('sentiment_history'):
         latest_sentiment = state.metrics['sentiment_history'][-1]
     
-    return NegotiationResponse(
-        negotiation_id=negotiation_id,
-        history=state.history,
-        current_offer=state.current_offer,
-        agreed_price=state.agreed_price,
-        available_offers=negotiation["available_offers"],
-        progress_score=state.get_negotiation_progress(),
-        metrics=state.metrics,
-        sentiment=latest_sentiment
-    )
+    return negotiation_response(negotiation_id, negotiation, latest_sentiment, since)
+
+@router.get("/negotiations/{negotiation_id}/strategy_recommendation")
+async def recommend_strategy(negotiation_id: str, candidates: Optional[str] = None, services=Depends(get_services)):
+    """
+    Rank strategies for the negotiation's next turn from their effectiveness
+    across all sessions in the same context (round, gap to the seller's minimum,
+    seller sentiment), best first. `candidates` is a comma-separated list of
+    strategy tags; by default every offer strategy tag is ranked. No LLM call is made.
+    """
+    negotiation = services.negotiations.get(negotiation_id)
+    if negotiation is None:
+        raise HTTPException(status_code=404, detail="Negotiation not found")
+    if candidates:
+        names = list(dict.fromkeys(name.strip() for name in candidates.split(",") if name.strip()))
+    else:
+        names = [name for name in OFFER_STRATEGIES if name != "other"]
+    context = strategy_context(negotiation["state"])
+    ranking = strategy_stats.rank(context, names)
+    return {
+        "context": context._asdict(),
+        "recommended": ranking[0]["strategy"] if ranking else None,
+        "strategies": ranking
+    }
 
-@app.get("/negotiations")
-async def list_negotiations():
-    """List all active negotiations."""
-    result = []
-    for negotiation_id, negotiation in negotiations.items():
-        state = negotiation["state"]
-        result.append({
-            "negotiation_id": negotiation_id,
-            "created_at": negotiation["created_at"],
-            "last_updated": negotiation["last_updated"],
-            "message_count": len(state.history),
-            "is_complete": state.is_terminal(),
-            "progress_score": state.get_negotiation_progress()
-        })
-    return result
-
-@app.delete("/negotiations/{negotiation_id}")
-async def delete_negotiation(negotiation_id: str):
+@router.get("/negotiations")
+async def list_negotiations(
+    response: Response,
+    status: Optional[str] = None,
+    created_after: Optional[float] = None,
+    created_before: Optional[float] = None,
+    updated_after: Optional[float] = None,
+    updated_before: Optional[float] = None,
+    min_rounds: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = settings.SESSION_LIST_DEFAULT_LIMIT,
+    services=Depends(get_services)
+):
+    """
+    List negotiations, most recently updated first, one page at a time. Filters
+    are optional; pass the X-Next-Cursor header of a page as `cursor` to get the
+    next one (the header is absent on the last page).
+    """
+    if status is not None and status not in SESSION_STATUSES:
+        raise HTTPException(status_code=400, detail=f"status must be one of {', '.join(SESSION_STATUSES)}")
+    if not 1 <= limit <= settings.SESSION_LIST_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {settings.SESSION_LIST_MAX_LIMIT}")
+    
+    query = SessionQuery(status, created_after, created_before, updated_after, updated_before, min_rounds)
+    try:
+        sessions, next_cursor = services.negotiations.list_sessions(query, cursor, limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return sessions
+
+@router.delete("/negotiations/{negotiation_id}")
+async def delete_negotiation(negotiation_id: str, services=Depends(get_services)):
     """Delete a negotiation."""
-    if negotiation_id not in negotiations:
+    services.speculator.discard(negotiation_id)
+    if services.event_log is not None:
+        services.event_log.delete(negotiation_id)
+    if not services.negotiations.delete(negotiation_id):
         raise HTTPException(status_code=404, detail="Negotiation not found")
     
-    del negotiations[negotiation_id]
-    return {"status": "success", "message": f"Negotiation {negotiation_id} deleted"} 
\ No newline at end of file
+    return {"status": "success", "message": f"Negotiation {negotiation_id} deleted"} 
+
+@router.get("/metrics")
+async def get_metrics(services=Depends(get_services)):
+    """Prometheus metrics: stage and LLM latencies, LLM calls and tokens, fallbacks and sessions."""
+    return Response(render(REGISTRY, services.metrics), media_type=CONTENT_TYPE)
+
+@router.get("/stats")
+async def get_stats(services=Depends(get_services)):
+    """Report cache and classification counters for the negotiation pipeline."""
+    return {
+        "sentiment_cache": sentiment_cache.stats(),
+        "sentiment_engine": {"engine": settings.SENTIMENT_ENGINE, **sentiment_stats},
+        "classification": get_classification_stats(),
+        "structured_output": {"mode": settings.LLM_OUTPUT_MODE, **structured_stats},
+        "llm_usage": get_llm_usage_stats(),
+        "llm_limiter": services.llm.limiter.stats(),
+        "speculation": services.speculator.stats(),
+        "strategies": strategy_stats.stats(),
+        "event_log": services.event_log.stats() if services.event_log is not None else None,
+        "sessions": services.negotiations.stats()
+    }
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Recover the sessions from the event log and start its writer, and build and
+    pre-warm the LLM client before serving; close them and pending speculations on shutdown.
+    """
+    start = time.perf_counter()
+    services = app.state
+    event_log = services.event_log
+    if event_log is not None:
+        # Sessions the store evicts from now on are tombstoned in the log, so they are not recovered
+        services.negotiations.on_evict = event_log.delete
+        restore_sessions(services, event_log.recover(idle_ttl=settings.SESSION_IDLE_TTL))
+        strategy_stats.restore(event_log.strategy_outcomes())
+        event_log.start()
+    await services.llm.start()
+    logger.info("Startup complete", extra={"backend": settings.LLM_BACKEND, "seconds": round(time.perf_counter() - start, 3)})
+    yield
+    services.speculator.close()
+    await services.llm.aclose()
+    if event_log is not None:
+        services.negotiations.on_evict = None
+        event_log.close()
+
+def restore_sessions(services, records):
+    """Put recovered sessions the store does not already have back into it, keeping their timestamps."""
+    negotiations = services.negotiations
+    for negotiation_id, record in sorted(records.items(), key=lambda item: item[1]["last_updated"]):
+        if negotiation_id not in negotiations:
+            negotiations.put(negotiation_id, record, touch=False)
+
+def session_metrics(services):
+    """Metrics of the app's session store and LLM limiter, read when /metrics is scraped."""
+    registry = CollectorRegistry()
+    CallbackMetric("negotiation_sessions", "Sessions in the session store", "gauge",
+                   lambda: len(services.negotiations), registry=registry)
+    CallbackMetric(
+        "negotiation_active_sessions", "Sessions updated within METRICS_ACTIVE_WINDOW seconds", "gauge",
+        lambda: services.negotiations.count_updated_since(time.time() - settings.METRICS_ACTIVE_WINDOW),
+        registry=registry
+    )
+    CallbackMetric(
+        "llm_queue_depth", "LLM calls waiting for the limiter", "gauge",
+        lambda: {(name,): depth for name, depth in services.llm.limiter.queue_depth().items()},
+        labelnames=["priority"], registry=registry
+    )
+    return registry
+
+def create_app():
+    """
+    Build the FastAPI app: routes, middleware, error handlers and the
+    startup/shutdown hooks, and the services its routes use, on `app.state`:
+    the session store (backend selected in config/settings.py), the durable log
+    of every session change (disabled unless EVENT_LOG_PATH is set; its writer
+    runs between startup and shutdown), the speculator that precomputes
+    seller replies (disabled unless SPECULATIVE_TOP_K > 0) and the LLM client:
+    the backend selected by LLM_BACKEND and the limiter its calls go through.
+    """
+    configure_logging()
+    app = FastAPI(lifespan=lifespan)
+    app.state.negotiations = create_session_store()
+    app.state.event_log = create_event_log()
+    app.state.speculator = create_speculator()
+    app.state.turn_locks = TurnLocks()
+    app.state.llm = create_llm_client()
+    app.state.metrics = session_metrics(app.state)
+    app.include_router(router)
+    # Enable CORS
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # In production, replace with your frontend URL
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["ETag", "X-Next-Cursor"],
+    )
+    app.add_middleware(NegotiationGZipMiddleware, minimum_size=settings.GZIP_MINIMUM_SIZE)
+    app.add_exception_handler(LLMRateLimitError, llm_rate_limited)
+    return app
+
+app = create_app()
@@ -0,0 +1,349 @@
+import json
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+from typing import NamedTuple, Optional
+
+from config import settings
+from .negotiation_logic import Offer, record_turn_metrics
+from .strategy_stats import StrategyContext
+
+logger = logging.getLogger(__name__)
+
+
+class TurnMark(NamedTuple):
+    """Where a session stood when the seller's side of a turn started (see `turn_events`)."""
+    history_length: int
+    current_offer: Optional[float]  # After the buyer's offer
+    sentiments: int
+    seller_minimum_price: Optional[float]
+    effective: int  # Times the turn's strategy had been effective
+
+
+def mark_turn(state, strategy_name=None):
+    """Take a TurnMark after the buyer's offer has been added to the history."""
+    effective = state.metrics['strategy_effectiveness'].get(strategy_name, {}).get('effective', 0)
+    return TurnMark(len(state.history), state.current_offer, len(state.sentiment_positions),
+                    state.seller_minimum_price, effective)
+
+
+def offers_event(offers):
+    """Event data for the offers shown to the buyer (with prices and tags from structured calls)."""
+    data = {"offers": [str(offer) for offer in offers]}
+    if any(getattr(offer, "strategy", None) for offer in offers):
+        data["prices"] = [getattr(offer, "price", None) for offer in offers]
+        data["strategies"] = [getattr(offer, "strategy", None) for offer in offers]
+    return data
+
+
+def turn_events(state, mark, classification, offers, strategy_name=None, context=None):
+    """
+    The events of a turn: the buyer's offer, the seller's reply and the sentiment
+    recorded for it, the classification and the prices it settled, a newly
+    stated minimum price (or a note about it), the strategy's outcome with the
+    context it was chosen in (see `strategy_context`) and the next offers. Read
+    off the state after the turn, relative to `mark`.
+    """
+    yield "buyer_offer", {
+        "text": state.history[mark.history_length - 1][1], "strategy": strategy_name, "current_offer": mark.current_offer
+    }
+    sentiment = state.metrics['sentiment_history'][-1] if len(state.sentiment_positions) > mark.sentiments else None
+    yield "seller_reply", {"text": state.history[mark.history_length][1], "sentiment": sentiment}
+    yield "classification", {
+        "classification": classification,
+        "current_offer": state.current_offer,
+        "agreed_price": state.agreed_price
+    }
+    notes = [text for speaker, text in state.history[mark.history_length + 1:] if speaker == "System"]
+    if notes or state.seller_minimum_price != mark.seller_minimum_price:
+        yield "minimum_price", {"price": state.seller_minimum_price, "notes": notes}
+    if strategy_name:
+        effective = state.metrics['strategy_effectiveness'][strategy_name]['effective'] > mark.effective
+        yield "strategy_outcome", {
+            "name": strategy_name,
+            "effective": effective,
+            "context": context._asdict() if context is not None else None
+        }
+    yield "offers", offers_event(offers)
+
+
+def apply_event(record, kind, data):
+    """Re-apply one logged event to a session record, as the live code changed it."""
+    state = record["state"]
+    if kind == "start":
+        pass  # A session's first snapshot is taken with its start event
+    elif kind == "buyer_offer":
+        if data["strategy"]:
+            state.record_strategy(data["strategy"])
+        state.current_offer = data["current_offer"]
+        state.add_to_history("Buyer", data["text"])
+    elif kind == "seller_reply":
+        state.add_to_history("Seller", data["text"])
+        record_turn_metrics(state, data["sentiment"])
+    elif kind == "classification":
+        state.current_offer = data["current_offer"]
+        state.agreed_price = data["agreed_price"]
+    elif kind == "minimum_price":
+        state.seller_minimum_price = data["price"]
+        for note in data["notes"]:
+            state.add_to_history("System", note)
+    elif kind == "strategy_outcome":
+        state.record_strategy(data["name"], data["effective"])
+    elif kind == "offers":
+        offers = data["offers"]
+        if "strategies" in data:
+            offers = [Offer(*fields) for fields in zip(offers, data["prices"], data["strategies"])]
+        record["available_offers"] = offers
+        record["version"] = record.get("version", 0) + 1  # Offers are logged once per save
+    else:
+        raise ValueError(f"Unknown event kind: {kind!r}")
+
+
+class EventLog:
+    """
+    Append-only log of session events in a SQLite file, with snapshots.
+
+    `append` and `snapshot` only queue in memory; once `start` is called, a
+    background thread writes the queue in one transaction every
+    `flush_interval` seconds, and the commit is fsync'd (synchronous=FULL), so a
+    request never waits on the disk and a crash loses at most the last interval.
+    SQLite numbers the events as it writes them, so several workers can share
+    the file. A snapshot is a pickled session record tagged with the sequence
+    number of the session's last event before it; writing it drops the events it covers, so
+    `recover` loads one snapshot per session and replays only the few events
+    logged after it. A deleted or evicted session leaves a tombstone event,
+    and `recover` skips sessions that have one.
+
+    Strategy outcomes are also counted per strategy and context in a table of
+    their own, which outlives the sessions, to rebuild the cross-session
+    strategy stats from at startup.
+    """
+
+    def __init__(self, path, flush_interval=0.2, snapshot_every=20):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.snapshot_every = snapshot_every
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"  # Never reused, so a snapshot's seq stays behind later events
+            " negotiation_id TEXT NOT NULL,"
+            " ts REAL NOT NULL,"
+            " kind TEXT NOT NULL,"
+            " data TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS events_session ON events (negotiation_id, seq)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS snapshots ("
+            " negotiation_id TEXT PRIMARY KEY,"
+            " seq INTEGER NOT NULL,"
+            " data BLOB NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS strategy_outcomes ("
+            " strategy TEXT NOT NULL,"
+            " round INTEGER NOT NULL,"
+            " gap TEXT NOT NULL,"
+            " sentiment TEXT NOT NULL,"
+            " used INTEGER NOT NULL,"
+            " effective INTEGER NOT NULL,"
+            " PRIMARY KEY (strategy, round, gap, sentiment))"
+        )
+        self._since_snapshot = {}  # negotiation_id -> events since its latest snapshot
+        # Events and snapshots in the order they were queued: (negotiation_id, kind, ts, data),
+        # with kind None for a snapshot, which covers the session's events queued before it
+        self._queue = []
+        self._outcomes = []
+        self._lock = threading.Lock()  # Guards the queues
+        self._write_lock = threading.Lock()  # One writer at a time
+        self._stop = threading.Event()
+        self._thread = None
+        self.counts = dict.fromkeys(("events", "snapshots", "flushes", "tombstones"), 0)
+
+    def start(self):
+        """Start the background writer (called at app startup)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="event-log", daemon=True)
+            self._thread.start()
+
+    def append(self, negotiation_id, kind, data):
+        """Queue an event for a session."""
+        with self._lock:
+            self._since_snapshot[negotiation_id] = self._since_snapshot.get(negotiation_id, 0) + 1
+            self._queue.append((negotiation_id, kind, time.time(), json.dumps(data)))
+            if kind == "strategy_outcome" and data["context"] is not None:
+                context = data["context"]
+                self._outcomes.append((data["name"], context["round"], context["gap"], context["sentiment"],
+                                       int(data["effective"])))
+
+    def snapshot(self, negotiation_id, record, force=False):
+        """
+        Queue a snapshot of a session record if `snapshot_every` events were
+        logged since the last one (or `force`). The record is pickled now, as it
+        keeps changing after this call.
+        """
+        if not force and self._since_snapshot.get(negotiation_id, 0) < self.snapshot_every:
+            return
+        data = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._queue.append((negotiation_id, None, None, data))
+            self._since_snapshot[negotiation_id] = 0
+
+    def delete(self, negotiation_id):
+        """
+        Forget a deleted or evicted session: queue a tombstone event, which
+        removes the session's earlier events and snapshot when it is written.
+        """
+        with self._lock:
+            self._queue.append((negotiation_id, "tombstone", time.time(), "{}"))
+            self._since_snapshot.pop(negotiation_id, None)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Event log flush failed")
+
+    def flush(self):
+        """
+        Write everything queued in one fsync'd transaction. If the write fails
+        (the database is locked, say) the batch goes back to the front of the
+        queues for the next flush, and the error is raised.
+        """
+        with self._lock:
+            batch, self._queue = self._queue, []
+            outcomes, self._outcomes = self._outcomes, []
+        if not batch:
+            return
+        counts = dict.fromkeys(("events", "snapshots", "tombstones"), 0)
+        with self._write_lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                for negotiation_id, kind, ts, data in batch:
+                    if kind is None:
+                        self._conn.execute(
+                            "INSERT OR REPLACE INTO snapshots (negotiation_id, seq, data)"
+                            " SELECT ?, COALESCE(MAX(seq), 0), ? FROM events WHERE negotiation_id = ?",
+                            (negotiation_id, data, negotiation_id)
+                        )
+                        self._conn.execute(
+                            "DELETE FROM events WHERE negotiation_id = ?"
+                            " AND seq <= (SELECT seq FROM snapshots WHERE negotiation_id = ?)",
+                            (negotiation_id, negotiation_id)
+                        )
+                        counts["snapshots"] += 1
+                        continue
+                    seq = self._conn.execute(
+                        "INSERT INTO events (negotiation_id, ts, kind, data) VALUES (?, ?, ?, ?)",
+                        (negotiation_id, ts, kind, data)
+                    ).lastrowid
+                    counts["events"] += 1
+                    if kind == "tombstone":
+                        self._conn.execute("DELETE FROM events WHERE negotiation_id = ? AND seq < ?", (negotiation_id, seq))
+                        self._conn.execute("DELETE FROM snapshots WHERE negotiation_id = ? AND seq < ?", (negotiation_id, seq))
+                        counts["tombstones"] += 1
+                self._conn.executemany(
+                    "INSERT INTO strategy_outcomes (strategy, round, gap, sentiment, used, effective)"
+                    " VALUES (?, ?, ?, ?, 1, ?) ON CONFLICT (strategy, round, gap, sentiment)"
+                    " DO UPDATE SET used = used + 1, effective = effective + excluded.effective",
+                    outcomes
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                with self._lock:
+                    self._queue[:0] = batch
+                    self._outcomes[:0] = outcomes
+                raise
+        for name, count in counts.items():
+            self.counts[name] += count
+        self.counts["flushes"] += 1
+
+    def recover(self, idle_ttl=None):
+        """
+        Rebuild the session records from the snapshots and the events after them.
+        Tombstoned sessions are skipped, and their rows dropped for good; sessions
+        idle for longer than `idle_ttl` seconds are dropped from the log.
+        Returns {negotiation_id: record}.
+        """
+        self.flush()
+        start = time.perf_counter()
+        with self._write_lock:
+            tombstoned = [
+                (negotiation_id,) for negotiation_id, in
+                self._conn.execute("SELECT DISTINCT negotiation_id FROM events WHERE kind = 'tombstone'")
+            ]
+            self._conn.execute("BEGIN")
+            self._conn.executemany("DELETE FROM events WHERE negotiation_id = ?", tombstoned)
+            self._conn.executemany("DELETE FROM snapshots WHERE negotiation_id = ?", tombstoned)
+            self._conn.execute("COMMIT")
+
+            records, covered = {}, {}
+            for negotiation_id, seq, data in self._conn.execute("SELECT negotiation_id, seq, data FROM snapshots"):
+                records[negotiation_id] = pickle.loads(data)
+                covered[negotiation_id] = seq
+            replayed = 0
+            for seq, negotiation_id, ts, kind, data in self._conn.execute(
+                "SELECT seq, negotiation_id, ts, kind, data FROM events ORDER BY seq"
+            ):
+                record = records.get(negotiation_id)
+                if record is None or seq <= covered[negotiation_id]:
+                    continue  # No snapshot to start from (never happens for logged sessions), or already covered
+                apply_event(record, kind, json.loads(data))
+                record["last_updated"] = ts
+                self._since_snapshot[negotiation_id] = self._since_snapshot.get(negotiation_id, 0) + 1
+                replayed += 1
+
+        if idle_ttl is not None:
+            cutoff = time.time() - idle_ttl
+            for negotiation_id in [key for key, record in records.items() if record["last_updated"] <= cutoff]:
+                del records[negotiation_id]
+                self.delete(negotiation_id)
+            self.flush()
+        logger.info("Sessions recovered from the event log", extra={
+            "sessions": len(records), "events_replayed": replayed, "tombstoned": len(tombstoned),
+            "seconds": round(time.perf_counter() - start, 3)
+        })
+        return records
+
+    def strategy_outcomes(self):
+        """Every strategy outcome logged, as (strategy, StrategyContext, used, effective) tuples."""
+        self.flush()
+        with self._write_lock:
+            rows = self._conn.execute(
+                "SELECT strategy, round, gap, sentiment, used, effective FROM strategy_outcomes"
+            ).fetchall()
+        return [
+            (strategy_name, StrategyContext(round_bucket, gap, sentiment), used, effective)
+            for strategy_name, round_bucket, gap, sentiment, used, effective in rows
+        ]
+
+    def close(self):
+        """Stop the writer and write what is still queued."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        self._conn.close()
+
+    def stats(self):
+        with self._lock:
+            queued = sum(kind is not None for _, kind, _, _ in self._queue)
+        return {"path": self.path, "flush_interval": self.flush_interval, "queued": queued, **self.counts}
+
+
+def create_event_log():
+    """Build the event log configured by EVENT_LOG_PATH in config/settings.py, or None if it is disabled."""
+    if not settings.EVENT_LOG_PATH:
+        return None
+    return EventLog(
+        settings.EVENT_LOG_PATH,
+        flush_interval=settings.EVENT_LOG_FLUSH_INTERVAL,
+        snapshot_every=settings.EVENT_LOG_SNAPSHOT_EVERY
+    )
@@ -1,27 +1,656 @@
+import asyncio
+import hashlib
+import json
+import logging
 import os
-from anthropic import Anthropic
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import NamedTuple, Tuple
 from dotenv import load_dotenv
+from config import settings
+from .metrics import LLM_QUEUE_WAIT, LLM_RETRIES, LLM_TOKENS, llm_call
+from .rate_limit import (
+    INTERACTIVE, PRIORITY_NAMES, LLMLimiter, LLMRateLimitError, PriorityGroup,
+    backoff_delay, retry_after, retry_status
+)
 
 # Load environment variables
 load_dotenv()
 
-api_key = os.getenv("ANTHROPIC_API_KEY")
-if not api_key:
-    raise ValueError("ANTHROPIC_API_KEY not found in environment variables")
-
-# Initialize Anthropic client
-client = Anthropic()
-
-def get_llm_response(prompt, max_tokens=1000):
-    """Get a response from the LLM."""
-    message = client.messages.create(
-        model="claude-3-7-sonnet-20250219",
-        max_tokens=max_tokens,
-        messages=[
-            {
-                "role": "user",
-                "content": prompt
-            }
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = settings.MODEL_NAME
+
+# Marks the end of a prompt prefix that the provider may cache and reuse
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+class Prompt(NamedTuple):
+    """
+    A prompt laid out for provider-side prefix caching: `system` holds the
+    instructions shared by every call, `transcript` the conversation blocks
+    (which only grow at the end between context folds) and `task` what this
+    call should do. Cache breakpoints follow the system block and the last
+    transcript block, after which only the task differs: the seller,
+    classification, sentiment and offer calls of a turn, and the next turn's
+    calls, reuse the prefix written by the previous call instead of paying for it
+    in full. The provider only caches prefixes of 1024 tokens or more, which the
+    context window settings (CONTEXT_RECENT_TURNS, CONTEXT_FOLD_CHUNK) allow for.
+    """
+    system: str
+    transcript: Tuple[str, ...]
+    task: str
+    name: str = "prompt"  # Kind of call, for usage accounting
+
+    def text(self):
+        """The prompt as a single string (cassette keys, the fake backend)."""
+        return "\n\n".join(part for part in (self.system, "\n".join(self.transcript), self.task) if part)
+
+    def request(self):
+        """The `system` and `messages` arguments of a Messages API request."""
+        content = [{"type": "text", "text": block} for block in self.transcript]
+        if content:
+            content[-1]["cache_control"] = CACHE_CONTROL
+        content.append({"type": "text", "text": self.task})
+        return {
+            "system": [{"type": "text", "text": self.system, "cache_control": CACHE_CONTROL}],
+            "messages": [{"role": "user", "content": content}]
+        }
+
+
+def prompt_text(prompt):
+    """Flatten a Prompt (or pass through a plain string prompt)."""
+    return prompt.text() if isinstance(prompt, Prompt) else prompt
+
+
+def prompt_name(prompt):
+    """Kind of call a prompt is for ("prompt" for plain strings)."""
+    return prompt.name if isinstance(prompt, Prompt) else "prompt"
+
+
+# Token usage reported by the provider: running totals and the most recent calls.
+# input_tokens are billed in full, cache_read_input_tokens come from the prompt
+# cache and cache_creation_input_tokens were written to it.
+USAGE_FIELDS = ("input_tokens", "cache_creation_input_tokens", "cache_read_input_tokens", "output_tokens")
+llm_usage = dict.fromkeys(("calls",) + USAGE_FIELDS, 0)
+llm_usage_log = deque(maxlen=settings.LLM_USAGE_LOG_SIZE)
+
+
+def record_usage(prompt, usage):
+    """Record the token usage of one call."""
+    record = {"name": prompt_name(prompt)}
+    for field in USAGE_FIELDS:
+        record[field] = getattr(usage, field, None) or 0
+        llm_usage[field] += record[field]
+        LLM_TOKENS.labels(field.replace("_tokens", "")).inc(record[field])
+    llm_usage["calls"] += 1
+    llm_usage_log.append(record)
+    return record
+
+
+def get_llm_usage_stats():
+    """Return the token totals, the share of input tokens served from the cache and the latest calls."""
+    total_input = llm_usage["input_tokens"] + llm_usage["cache_creation_input_tokens"] + llm_usage["cache_read_input_tokens"]
+    return {
+        **llm_usage,
+        "cache_hit_rate": llm_usage["cache_read_input_tokens"] / total_input if total_input else 0.0,
+        "recent_calls": list(llm_usage_log)[-20:]
+    }
+
+
+class AnthropicBackend:
+    """
+    Sends prompts to the Anthropic API. The async client is used by the API so
+    that a slow completion never blocks the event loop; the sync client backs
+    the blocking `get_llm_response`. Clients can be passed in (e.g. stubs in tests).
+
+    Clients are created on first use, so importing the app needs neither the
+    SDK nor credentials. The async client shares one pooled HTTP client sized
+    to the limiter's concurrency; `start` creates it and opens a connection ahead
+    of the first request.
+    """
+
+    def __init__(self, client=None, async_client=None, max_connections=None):
+        self._client = client
+        self._async_client = async_client
+        self._http_client = None
+        self.max_connections = max_connections or settings.LLM_MAX_CONCURRENCY
+
+    @staticmethod
+    def _api_key():
+        api_key = os.getenv("ANTHROPIC_API_KEY")
+        if not api_key:
+            raise ValueError("ANTHROPIC_API_KEY not found in environment variables")
+        return api_key
+
+    @property
+    def client(self):
+        if self._client is None:
+            from anthropic import Anthropic
+
+            self._client = Anthropic(api_key=self._api_key())
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            import httpx
+            from anthropic import AsyncAnthropic, DefaultAsyncHttpxClient
+
+            self._http_client = DefaultAsyncHttpxClient(limits=httpx.Limits(
+                max_connections=self.max_connections, max_keepalive_connections=self.max_connections
+            ))
+            self._async_client = AsyncAnthropic(api_key=self._api_key(), http_client=self._http_client)
+        return self._async_client
+
+    async def start(self):
+        """Create the async client and, with LLM_PREWARM, open a pooled connection to the API."""
+        client = self.async_client
+        if not settings.LLM_PREWARM or self._http_client is None:
+            return
+        start = time.perf_counter()
+        try:
+            # Any response will do: the point is the TCP/TLS handshake, which the pool keeps alive
+            await self._http_client.head(str(client.base_url), timeout=5.0)
+        except Exception as e:
+            logger.warning("LLM connection pre-warm failed", extra={"error": repr(e)})
+            return
+        logger.info("LLM connection pre-warmed", extra={"seconds": round(time.perf_counter() - start, 3)})
+
+    async def aclose(self):
+        if self._async_client is not None and self._http_client is not None:
+            await self._async_client.close()
+            self._async_client = self._http_client = None
+
+    def _request(self, prompt, max_tokens):
+        request = {
+            "model": MODEL_NAME,
+            "max_tokens": max_tokens
+        }
+        if isinstance(prompt, Prompt):
+            request.update(prompt.request())
+        else:
+            request["messages"] = [
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ]
+        return request
+
+    def complete(self, prompt, max_tokens=1000):
+        message = self.client.messages.create(**self._request(prompt, max_tokens))
+        record_usage(prompt, message.usage)
+        return message.content[0].text
+
+    async def acomplete(self, prompt, max_tokens=1000):
+        message = await self.async_client.messages.create(**self._request(prompt, max_tokens))
+        record_usage(prompt, message.usage)
+        return message.content[0].text
+
+    async def stream(self, prompt, max_tokens=1000):
+        async with self.async_client.messages.stream(**self._request(prompt, max_tokens)) as stream:
+            async for text in stream.text_stream:
+                yield text
+            message = await stream.get_final_message()
+        record_usage(prompt, message.usage)
+
+    async def acomplete_structured(self, prompt, tool_name, tools, max_tokens=1000):
+        # All tools are sent with every call (and cached after the last one);
+        # tool_choice forces the one whose input we want back
+        request = self._request(prompt, max_tokens)
+        request["tools"] = [dict(tool) for tool in tools]
+        request["tools"][-1]["cache_control"] = CACHE_CONTROL
+        request["tool_choice"] = {"type": "tool", "name": tool_name}
+        message = await self.async_client.messages.create(**request)
+        record_usage(prompt, message.usage)
+        for block in message.content:
+            if block.type == "tool_use" and block.name == tool_name:
+                return block.input
+        raise StructuredOutputError(f"Response has no {tool_name} tool call")
+
+
+class StructuredOutputError(ValueError):
+    """Raised when a structured (tool-use) response is missing or malformed."""
+
+
+def cassette_key(prompt, max_tokens, tool_name=None):
+    """Content address of a request in a cassette file."""
+    text = prompt_text(prompt) if tool_name is None else f"{prompt_text(prompt)}\0{tool_name}"
+    return hashlib.sha256(f"{MODEL_NAME}\0{max_tokens}\0{text}".encode("utf-8")).hexdigest()
+
+
+class CassetteMissError(LookupError):
+    """Raised when a replayed prompt was never recorded."""
+
+
+class RecordingBackend:
+    """Passes requests to another backend and appends each prompt/response pair to a cassette."""
+
+    def __init__(self, inner, cassette_path):
+        self.inner = inner
+        self.cassette_path = cassette_path
+        self._lock = threading.Lock()
+
+    async def start(self):
+        await self.inner.start()
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+    def _record(self, prompt, max_tokens, response, tool_name=None):
+        entry = {
+            "key": cassette_key(prompt, max_tokens, tool_name),
+            "max_tokens": max_tokens,
+            "prompt": prompt_text(prompt),
+            "response": response
+        }
+        if tool_name is not None:
+            entry["tool"] = tool_name
+        with self._lock, open(self.cassette_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def complete(self, prompt, max_tokens=1000):
+        response = self.inner.complete(prompt, max_tokens)
+        self._record(prompt, max_tokens, response)
+        return response
+
+    async def acomplete(self, prompt, max_tokens=1000):
+        response = await self.inner.acomplete(prompt, max_tokens)
+        self._record(prompt, max_tokens, response)
+        return response
+
+    async def stream(self, prompt, max_tokens=1000):
+        chunks = []
+        async for chunk in self.inner.stream(prompt, max_tokens):
+            chunks.append(chunk)
+            yield chunk
+        self._record(prompt, max_tokens, "".join(chunks))
+
+    async def acomplete_structured(self, prompt, tool_name, tools, max_tokens=1000):
+        response = await self.inner.acomplete_structured(prompt, tool_name, tools, max_tokens)
+        self._record(prompt, max_tokens, response, tool_name)
+        return response
+
+
+def _chunks(text, size=16):
+    """Split a response into stream-sized pieces."""
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+class ReplayBackend:
+    """Serves responses recorded by RecordingBackend, with optional synthetic latency per call."""
+
+    def __init__(self, cassette_path, latency=0.0):
+        self.latency = latency
+        self.responses = {}
+        with open(cassette_path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.responses[entry["key"]] = entry["response"]
+
+    def _lookup(self, prompt, max_tokens, tool_name=None):
+        key = cassette_key(prompt, max_tokens, tool_name)
+        if key not in self.responses:
+            raise CassetteMissError(f"No recorded response for prompt {key[:12]} ({prompt_text(prompt).strip()[:60]!r}...)")
+        return self.responses[key]
+
+    def complete(self, prompt, max_tokens=1000):
+        response = self._lookup(prompt, max_tokens)
+        if self.latency:
+            time.sleep(self.latency)
+        return response
+
+    async def acomplete(self, prompt, max_tokens=1000):
+        response = self._lookup(prompt, max_tokens)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return response
+
+    async def stream(self, prompt, max_tokens=1000):
+        chunks = _chunks(self._lookup(prompt, max_tokens))
+        for chunk in chunks:
+            if self.latency:
+                await asyncio.sleep(self.latency / len(chunks))
+            yield chunk
+
+    async def acomplete_structured(self, prompt, tool_name, tools, max_tokens=1000):
+        response = self._lookup(prompt, max_tokens, tool_name)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return response
+
+
+PRICE_PATTERN = re.compile(r'\$([0-9,]+(?:\.[0-9]+)?)')
+
+
+def _price(match):
+    return float(match.replace(',', ''))
+
+
+class FakeBackend:
+    """
+    Fast, deterministic stand-in for the LLM. It recognizes the prompts built in
+    negotiation_logic and answers with well-formed offers, seller replies,
+    classifications and sentiment JSON. The same prompt always gets the same answer.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def respond(self, prompt):
+        prompt = prompt_text(prompt)
+        rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).digest())
+        if "Rate each of these aspects" in prompt:
+            return self._sentiment(prompt, rng)
+        if "strategic offers" in prompt:
+            return self._offers(prompt, rng)
+        if "Classify the seller's response" in prompt:
+            return self._classification(prompt)
+        if "car seller" in prompt:
+            return self._seller_reply(prompt, rng)
+        return "OK"
+
+    def _sentiment(self, prompt, rng):
+        message = re.search(r'intent:\s*"(.*)"\s*Rate each', prompt, re.DOTALL)
+        text = message.group(1).lower() if message else ""
+        return json.dumps(self._sentiment_scores(text, rng), indent=2)
+
+    def _sentiment_scores(self, text, rng):
+        firm = any(word in text for word in ("cannot", "can't", "won't", "minimum", "firm"))
+        agreeable = any(word in text for word in ("deal", "accept", "works", "happy"))
+        scores = {
+            "positivity": rng.randint(6, 9) if agreeable else rng.randint(3, 7),
+            "openness": rng.randint(2, 5) if firm else rng.randint(5, 8),
+            "firmness": rng.randint(7, 9) if firm else rng.randint(3, 6),
+            "flexibility": rng.randint(1, 4) if firm else rng.randint(4, 8)
+        }
+        return scores
+
+    def _offers(self, prompt, rng):
+        lines = [text for _, text in self._offer_lines(prompt, rng)]
+        return "\n".join(f"{i}. {line}" for i, line in enumerate(lines, start=1))
+
+    def _offer_lines(self, prompt, rng):
+        """The offers to make, as (strategy tag, text) pairs."""
+        num_offers = int(re.search(r'Generate exactly (\d+)', prompt).group(1))
+        stand_firm = re.search(r'stand firm on the previous offer of \$([0-9,]+(?:\.[0-9]+)?)', prompt)
+        minimum = re.search(r'cannot go below \$([0-9,]+(?:\.[0-9]+)?)', prompt)
+        prices = [_price(p) for p in PRICE_PATTERN.findall(prompt)]
+
+        if stand_firm:
+            base = _price(stand_firm.group(1))
+        elif prices:
+            base = round(prices[0] * 0.75, -2)
+        else:
+            base = 20000.0
+
+        lines = []
+        if stand_firm:
+            lines.append(("stand_firm", f"I'm standing firm at my offer of ${base:,.2f}; it's a fair price for this car."))
+        if minimum and _price(minimum.group(1)) > base:
+            target = _price(minimum.group(1))
+            lines.append(("meet_minimum", f"I can meet your minimum of ${target:,.2f} if you include an extended warranty."))
+        tactics = [
+            ("market_comparison", "Based on what I've seen for similar cars, I can offer ${:,.2f}."),
+            ("split_difference", "Let's meet in the middle: ${:,.2f} and we can close today."),
+            ("cash_offer", "I'm paying cash, so I can go up to ${:,.2f}."),
+            ("final_offer", "My best offer is ${:,.2f}, and I'm ready to sign now.")
         ]
-    )
-    return message.content[0].text
\ No newline at end of file
+        step = 1.0
+        while len(lines) < num_offers:
+            step += rng.uniform(0.02, 0.05)
+            strategy, template = tactics[len(lines) % len(tactics)]
+            lines.append((strategy, template.format(round(base * step, -1))))
+        return lines[:num_offers]
+
+    def _classification(self, prompt):
+        response = re.search(r"seller's response: '(.*)'", prompt, re.DOTALL)
+        return self._classify(response.group(1).lower() if response else "")
+
+    def _classify(self, text):
+        if any(word in text for word in ("deal", "accept", "works")):
+            return "accept"
+        if PRICE_PATTERN.search(text):
+            return "counter-offer"
+        return "reject"
+
+    def _seller_reply(self, prompt, rng):
+        offer = re.search(r"The buyer's current offer is: \$([0-9,]+(?:\.[0-9]+)?)", prompt)
+        minimum = re.search(r'Your minimum acceptable price is \$([0-9,]+(?:\.[0-9]+)?)', prompt)
+        seller_prices = [_price(p) for p in re.findall(r'^\s*Seller: .*?\$([0-9,]+(?:\.[0-9]+)?)', prompt, re.MULTILINE)]
+        if not offer:
+            return "I'd need to hear a specific price before I can respond to that."
+
+        buyer_price = _price(offer.group(1))
+        if minimum:
+            return (f"I appreciate the offer, but I cannot go below ${_price(minimum.group(1)):,.2f} "
+                    "for a car in this condition.")
+
+        last_price = seller_prices[-1] if seller_prices else buyer_price * 1.2
+        if buyer_price >= last_price * rng.uniform(0.96, 0.99):
+            return f"You've got yourself a deal at ${buyer_price:,.2f}. I'll get the paperwork ready."
+
+        counter = max(buyer_price, round((buyer_price + last_price) / 2, -1))
+        return (f"I understand you're looking for value, but ${buyer_price:,.2f} is a bit low. "
+                f"I could come down to ${counter:,.2f}, which is still a great price for this car.")
+
+    def complete(self, prompt, max_tokens=1000):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.respond(prompt)
+
+    async def acomplete(self, prompt, max_tokens=1000):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.respond(prompt)
+
+    async def stream(self, prompt, max_tokens=1000):
+        chunks = _chunks(self.respond(prompt))
+        for chunk in chunks:
+            if self.latency:
+                await asyncio.sleep(self.latency / len(chunks))
+            yield chunk
+
+    def respond_structured(self, prompt, tool_name):
+        prompt = prompt_text(prompt)
+        rng = random.Random(hashlib.sha256(f"{prompt}\0{tool_name}".encode("utf-8")).digest())
+        if tool_name == "seller_turn":
+            message = self._seller_reply(prompt, rng)
+            minimum = re.search(r'cannot go below \$([0-9,]+(?:\.[0-9]+)?)', message)
+            return {
+                "message": message,
+                "classification": self._classify(message.lower()),
+                "minimum_price": _price(minimum.group(1)) if minimum else None,
+                "sentiment": self._sentiment_scores(message.lower(), rng)
+            }
+        if tool_name == "buyer_offers":
+            return {"offers": [
+                {"text": text, "price": _price(PRICE_PATTERN.search(text).group(1)), "strategy": strategy}
+                for strategy, text in self._offer_lines(prompt, rng)
+            ]}
+        raise StructuredOutputError(f"Fake backend has no answer for tool {tool_name!r}")
+
+    async def acomplete_structured(self, prompt, tool_name, tools, max_tokens=1000):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.respond_structured(prompt, tool_name)
+
+
+def create_backend(name=None):
+    """Build the LLM backend selected by LLM_BACKEND in config/settings.py."""
+    name = name or settings.LLM_BACKEND
+    if name == "anthropic":
+        return AnthropicBackend()
+    if name == "record":
+        return RecordingBackend(AnthropicBackend(), settings.LLM_CASSETTE_PATH)
+    if name == "replay":
+        return ReplayBackend(settings.LLM_CASSETTE_PATH, latency=settings.LLM_REPLAY_LATENCY)
+    if name == "fake":
+        return FakeBackend(latency=settings.LLM_FAKE_LATENCY)
+    raise ValueError(f"Unknown LLM backend: {name!r}")
+
+
+class LLMClient:
+    """
+    An LLM backend and the limiter its async calls are admitted through. An app
+    builds its own (see `create_llm_client`) and makes its requests use it with
+    `use_llm_client`, so apps in one process do not share connections or budgets.
+    """
+
+    def __init__(self, backend, limiter):
+        self.backend = backend
+        self.limiter = limiter
+
+    async def start(self):
+        """Prepare the backend's clients and connections (network backends only); called at app startup."""
+        start = getattr(self.backend, "start", None)
+        if start is not None:
+            await start()
+
+    async def aclose(self):
+        """Close the backend's pooled connections; called at app shutdown."""
+        aclose = getattr(self.backend, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+def create_llm_client(backend=None):
+    """Build an LLMClient for the backend selected by LLM_BACKEND (or `backend`), limited by the LLM_* settings."""
+    return LLMClient(backend or create_backend(), LLMLimiter(
+        max_concurrency=settings.LLM_MAX_CONCURRENCY,
+        requests_per_minute=settings.LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute=settings.LLM_TOKENS_PER_MINUTE
+    ))
+
+
+_client = ContextVar("llm_client", default=None)
+_default_client = None
+
+def use_llm_client(client):
+    """Make the LLM calls of the current task, and of tasks started from it, go through `client`."""
+    _client.set(client)
+
+def current_llm_client():
+    """
+    The client set with `use_llm_client` (the app's, in a request), or else one
+    built on first use for callers outside an app: the batch simulator and benchmarks.
+    """
+    global _default_client
+    client = _client.get()
+    if client is not None:
+        return client
+    if _default_client is None:
+        _default_client = create_llm_client()
+    return _default_client
+
+# Calls are interactive (part of some buyer's turn) unless made under llm_priority(BACKGROUND).
+# Priority follows the caller, not the prompt: the same sentiment call is on the critical
+# path of a turn and background work when it runs for a speculative reply.
+_priority = ContextVar("llm_priority", default=None)
+
+@contextmanager
+def llm_priority(priority):
+    """
+    Run the LLM calls made in this block, and in tasks started from it, at
+    `priority`. Yields their PriorityGroup, for `promote_llm_calls`.
+    """
+    group = PriorityGroup(priority)
+    token = _priority.set(group)
+    try:
+        yield group
+    finally:
+        _priority.reset(token)
+
+def promote_llm_calls(group, priority=INTERACTIVE):
+    """Raise a group of calls to `priority`, the ones already waiting for the limiter included."""
+    current_llm_client().limiter.promote(group, priority)
+
+def _admission(prompt):
+    """Priority group (None for interactive calls) and estimated input tokens (about four characters per token) of a call."""
+    return _priority.get(), len(prompt_text(prompt)) // 4 + 1
+
+async def _acquire(limiter, group, tokens):
+    waited = await limiter.acquire(INTERACTIVE, tokens, group)
+    priority = group.priority if group is not None else INTERACTIVE
+    LLM_QUEUE_WAIT.labels(PRIORITY_NAMES[priority]).observe(waited)
+
+async def _back_off(limiter, error, attempt):
+    """
+    Wait before retrying a rate-limited or overloaded call. Re-raises errors
+    that should not be retried, and raises LLMRateLimitError once retries run out.
+    """
+    status = retry_status(error)
+    if status is None:
+        raise error
+    if attempt >= settings.LLM_MAX_RETRIES:
+        raise LLMRateLimitError(f"LLM still rate limited after {attempt} retries", retry_after(error)) from error
+    limiter.retries += 1
+    LLM_RETRIES.labels(str(status)).inc()
+    await asyncio.sleep(backoff_delay(attempt, settings.LLM_BACKOFF_BASE, settings.LLM_BACKOFF_MAX, error))
+
+async def _limited(prompt, call):
+    """Run `call(backend)` under the current client's limiter, retrying rate-limited attempts."""
+    client = current_llm_client()
+    group, tokens = _admission(prompt)
+    attempt = 0
+    while True:
+        await _acquire(client.limiter, group, tokens)
+        try:
+            with llm_call(prompt_name(prompt)):
+                return await call(client.backend)
+        except Exception as e:
+            error = e
+        finally:
+            client.limiter.release()
+        await _back_off(client.limiter, error, attempt)
+        attempt += 1
+
+async def get_llm_response_async(prompt, max_tokens=settings.MAX_TOKENS):
+    """Get a response from the LLM without blocking the event loop."""
+    return await _limited(prompt, lambda backend: backend.acomplete(prompt, max_tokens))
+
+def get_llm_response(prompt, max_tokens=settings.MAX_TOKENS):
+    """Get a response from the LLM (blocking; not subject to the async limiter)."""
+    with llm_call(prompt_name(prompt)):
+        return current_llm_client().backend.complete(prompt, max_tokens)
+
+async def stream_llm_response(prompt, max_tokens=settings.MAX_TOKENS):
+    """
+    Yield the LLM response text as it is generated. The call holds a limiter
+    slot until the stream ends; it is retried only if it fails before any text.
+    """
+    client = current_llm_client()
+    group, tokens = _admission(prompt)
+    attempt = 0
+    while True:
+        await _acquire(client.limiter, group, tokens)
+        started = False
+        try:
+            with llm_call(prompt_name(prompt)):
+                async for chunk in client.backend.stream(prompt, max_tokens):
+                    started = True
+                    yield chunk
+            return
+        except Exception as e:
+            if started:
+                raise
+            error = e
+        finally:
+            client.limiter.release()
+        await _back_off(client.limiter, error, attempt)
+        attempt += 1
+
+async def get_llm_structured_async(prompt, tool_name, tools, max_tokens=settings.MAX_TOKENS):
+    """
+    Get a structured response: the input of the `tool_name` tool, which the LLM
+    is forced to call. `tools` lists every tool definition the caller uses, so
+    that all structured calls share one cacheable prefix.
+    """
+    return await _limited(prompt, lambda backend: backend.acomplete_structured(prompt, tool_name, tools, max_tokens))
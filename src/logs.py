@@ -0,0 +1,58 @@
+import json
+import logging
+import sys
+
+from config import settings
+
+# Attributes every LogRecord has; anything else was passed as `extra` and becomes a field
+_RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+def _fields(record):
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, event and the `extra` fields."""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage(),
+            **_fields(record)
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class KeyValueFormatter(logging.Formatter):
+    """Human-readable lines: level, logger and event, followed by key=value fields."""
+
+    def format(self, record):
+        line = f"{record.levelname:<7} {record.name}: {record.getMessage()}"
+        fields = " ".join(f"{key}={value!r}" for key, value in _fields(record).items())
+        if fields:
+            line = f"{line} {fields}"
+        if record.exc_info:
+            line = f"{line}\n{self.formatException(record.exc_info)}"
+        return line
+
+
+def configure_logging(level=None, fmt=None):
+    """
+    Send the package's log records (loggers under "src") to stderr at LOG_LEVEL,
+    formatted as LOG_FORMAT ("json" or "text"). Safe to call more than once.
+    """
+    logger = logging.getLogger(__name__.rpartition(".")[0] or __name__)
+    logger.setLevel((level or settings.LOG_LEVEL).upper())
+    handler = next((h for h in logger.handlers if getattr(h, "_negotiation_handler", False)), None)
+    if handler is None:
+        handler = logging.StreamHandler(sys.stderr)
+        handler._negotiation_handler = True
+        logger.addHandler(handler)
+        logger.propagate = False
+    handler.setFormatter(JSONFormatter() if (fmt or settings.LOG_FORMAT) == "json" else KeyValueFormatter())
+    return logger
@@ -1,18 +1,198 @@
-from negotiation_stage import NegotiationState
-from negotiation_logic import generate_buyer_offers, simulate_seller_response, classify_response, update_state
+"""
+Headless batch simulator: runs complete buyer-vs-seller negotiations under a
+buyer policy and reports aggregate outcomes. Use a local LLM backend for speed:
 
-def main():
+    LLM_BACKEND=fake SENTIMENT_ENGINE=local python -m src.main --runs 5000 --policy random
+"""
+import argparse
+import asyncio
+import math
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .logs import configure_logging
+from .negotiation_stage import NegotiationState
+from .negotiation_logic import generate_buyer_offers, play_turn
+from .policies import POLICIES, make_policy, offer_strategy
+
+# Per-run outcome columns and their dtypes
+OUTCOME_COLUMNS = {
+    'seed': np.int64,
+    'agreed': np.bool_,
+    'agreed_price': np.float64,  # NaN when no agreement was reached
+    'initial_price': np.float64,
+    'rounds': np.int32,
+    'concessions': np.int32,
+    'average_concession': np.float64,
+    'strategies_used': np.int32,
+    'strategies_effective': np.int32,
+}
+
+async def simulate_negotiation(policy, seed, max_rounds=20):
+    """Run one negotiation to agreement or `max_rounds`. Returns its outcome row and strategy stats."""
+    rng = random.Random(seed)
+    random.seed(seed)  # NegotiationState draws its asking price from the global generator
     state = NegotiationState()
-    print("Starting Negotiation...")
-    offers = generate_buyer_offers(state)
-    chosen_offer = offers[0]  # Simple choice for now
-    print(f"Buyer says: {chosen_offer}")
-    seller_response = simulate_seller_response(state, chosen_offer)
-    print(f"Seller says: {seller_response}")
-    classification = classify_response(seller_response)
-    print(f"Response Type: {classification}")
-    update_state(state, chosen_offer, seller_response, classification)
-    print("Updated State:", state)
+
+    offers = await generate_buyer_offers(state)
+    while offers and not state.is_terminal() and state.metrics['rounds'] < max_rounds:
+        offer = offers[policy.choose(state, offers, rng)]
+        strategy = offer_strategy(state, offer)
+        state.record_strategy(strategy)
+        state.add_to_history("Buyer", offer)
+        results = await play_turn(state, offer, strategy)
+        offers = results["offers"]
+
+    strategies = state.metrics['strategy_effectiveness']
+    row = {
+        'seed': seed,
+        'agreed': state.is_terminal(),
+        'agreed_price': state.agreed_price if state.agreed_price is not None else math.nan,
+        'initial_price': state.initial_price,
+        'rounds': state.metrics['rounds'],
+        'concessions': state.metrics['concessions_made'],
+        'average_concession': state.metrics['average_concession'],
+        'strategies_used': sum(data['used'] for data in strategies.values()),
+        'strategies_effective': sum(data['effective'] for data in strategies.values()),
+    }
+    return row, strategies
+
+def run_batch(seeds, policy_name, policy_options, max_rounds, concurrency, verbose=False):
+    """
+    Simulate one chunk of negotiations (in a worker process). Returns the outcome
+    columns as NumPy arrays and the strategy counts summed over the chunk.
+    """
+    configure_logging("DEBUG" if verbose else None, "text" if verbose else None)
+    policy = make_policy(policy_name, **policy_options)
+
+    async def run_all():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run_one(seed):
+            async with semaphore:
+                return await simulate_negotiation(policy, seed, max_rounds)
+
+        return await asyncio.gather(*(run_one(seed) for seed in seeds))
+
+    results = asyncio.run(run_all())
+
+    columns = {
+        name: np.fromiter((row[name] for row, _ in results), dtype=dtype, count=len(results))
+        for name, dtype in OUTCOME_COLUMNS.items()
+    }
+    strategy_counts = defaultdict(lambda: [0, 0])
+    for _, strategies in results:
+        for name, data in strategies.items():
+            strategy_counts[name][0] += data['used']
+            strategy_counts[name][1] += data['effective']
+    return columns, dict(strategy_counts)
+
+def run_simulations(runs, policy_name, policy_options=None, max_rounds=20, workers=None,
+                    concurrency=16, seed=0, verbose=False):
+    """
+    Run `runs` negotiations spread over a process pool. Returns the outcome
+    columns (one entry per run, ordered by seed) and the strategy counts.
+    """
+    policy_options = policy_options or {}
+    workers = workers or os.cpu_count() or 1
+    seeds = list(range(seed, seed + runs))
+    chunk_size = max(1, math.ceil(runs / (workers * 4)))
+    chunks = [seeds[i:i + chunk_size] for i in range(0, runs, chunk_size)]
+    args = (policy_name, policy_options, max_rounds, concurrency, verbose)
+
+    if workers == 1:
+        batches = [run_batch(chunk, *args) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(run_batch, chunk, *args) for chunk in chunks]
+            batches = [future.result() for future in futures]
+
+    columns = {
+        name: np.concatenate([batch[name] for batch, _ in batches])
+        for name in OUTCOME_COLUMNS
+    }
+    strategy_counts = defaultdict(lambda: [0, 0])
+    for _, counts in batches:
+        for name, (used, effective) in counts.items():
+            strategy_counts[name][0] += used
+            strategy_counts[name][1] += effective
+    return columns, dict(strategy_counts)
+
+def summarize(columns, strategy_counts):
+    """Aggregate statistics over the outcome columns."""
+    agreed = columns['agreed']
+    agreed_prices = columns['agreed_price'][agreed]
+    discounts = 1 - agreed_prices / columns['initial_price'][agreed]
+    return {
+        'runs': int(agreed.size),
+        'agreement_rate': float(agreed.mean()) if agreed.size else 0.0,
+        'mean_agreed_price': float(agreed_prices.mean()) if agreed_prices.size else math.nan,
+        'median_agreed_price': float(np.median(agreed_prices)) if agreed_prices.size else math.nan,
+        'mean_discount': float(discounts.mean()) if discounts.size else math.nan,
+        'mean_rounds': float(columns['rounds'].mean()) if agreed.size else 0.0,
+        'p95_rounds': float(np.percentile(columns['rounds'], 95)) if agreed.size else 0.0,
+        'mean_concessions': float(columns['concessions'].mean()) if agreed.size else 0.0,
+        'strategy_effectiveness': {
+            name: effective / used if used else 0.0
+            for name, (used, effective) in sorted(strategy_counts.items())
+        },
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=1, help="number of negotiations to simulate")
+    parser.add_argument("--policy", choices=sorted(POLICIES), default="first", help="buyer policy")
+    parser.add_argument("--k", type=int, default=2, help="rounds before standing firm (stand_firm_after_k)")
+    parser.add_argument("--index", type=int, default=0, help="offer to take every round (pick)")
+    parser.add_argument("--target-price", type=float, default=None, help="highest price to offer (target_price)")
+    parser.add_argument("--max-rounds", type=int, default=20, help="give up after this many rounds")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--concurrency", type=int, default=16,
+                        help="negotiations in flight per worker (helps with slow LLM backends)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first run")
+    parser.add_argument("--output", help="save the per-run outcome columns to this .npz file")
+    parser.add_argument("--verbose", action="store_true", help="log every negotiation step (debug level)")
+    args = parser.parse_args(argv)
+
+    policy_options = {
+        "stand_firm_after_k": {"k": args.k},
+        "pick": {"index": args.index},
+        "target_price": {"target_price": args.target_price},
+    }.get(args.policy, {})
+    if args.policy == "target_price" and args.target_price is None:
+        parser.error("--target-price is required with --policy target_price")
+    start = time.perf_counter()
+    columns, strategy_counts = run_simulations(
+        args.runs, args.policy, policy_options,
+        max_rounds=args.max_rounds,
+        workers=args.workers,
+        concurrency=args.concurrency,
+        seed=args.seed,
+        verbose=args.verbose
+    )
+    elapsed = time.perf_counter() - start
+
+    summary = summarize(columns, strategy_counts)
+    print(f"Simulated {summary['runs']} negotiations with policy '{args.policy}' "
+          f"in {elapsed:.2f}s ({summary['runs'] / elapsed * 60:,.0f}/min)")
+    print(f"  agreement rate:      {summary['agreement_rate']:.1%}")
+    print(f"  mean agreed price:   ${summary['mean_agreed_price']:,.2f} (median ${summary['median_agreed_price']:,.2f})")
+    print(f"  mean discount:       {summary['mean_discount']:.1%} off the asking price")
+    print(f"  rounds:              {summary['mean_rounds']:.2f} mean, {summary['p95_rounds']:.0f} p95")
+    print(f"  buyer concessions:   {summary['mean_concessions']:.2f} mean")
+    for name, effectiveness in summary['strategy_effectiveness'].items():
+        print(f"  {name + ':':20s} {effectiveness:.1%} effective")
+
+    if args.output:
+        np.savez(args.output, **columns)
+        print(f"Saved per-run outcomes to {args.output}")
+    return 0
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
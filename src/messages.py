@@ -0,0 +1,120 @@
+import re
+from functools import lru_cache
+from typing import NamedTuple, Optional, Tuple
+
+# One amount: "$20,000", "$ 20000.50", "20k", "$20.5K". Bare numbers are only
+# prices as part of a range with a priced end ("$20,000-22,000", "20-22k");
+# "45k miles" is mileage, not a price.
+_AMOUNT_PATTERN = re.compile(
+    r"(?P<dollar>\$\s?)?"
+    r"(?P<number>\d{1,3}(?:,\d{3})+|\d+)(?P<fraction>\.\d+)?"
+    r"(?:\s?(?P<k>[kK])\b)?"
+    r"(?!\s*(?:miles?\b|mi\b|km\b|kilomet))"
+)
+
+# Text between the two ends of a range: "$20,000-$22,000", "20 to 22k", "between $20k and $21k"
+_RANGE_SEPARATOR = re.compile(r"\s*(?:-|–|—|to)\s*|\s+and\s+")
+_BETWEEN = re.compile(r"\bbetween\s*$", re.IGNORECASE)
+
+
+class PriceMention(NamedTuple):
+    """A price in a message. `high` is set for ranges, whose low end is `value`."""
+    value: float
+    start: int
+    end: int
+    high: Optional[float] = None
+
+
+class _Amount(NamedTuple):
+    value: float
+    start: int
+    end: int
+    priced: bool  # Has a "$" or a "k"
+    thousands: bool  # Has a "k"
+
+
+def _amounts(text):
+    for match in _AMOUNT_PATTERN.finditer(text):
+        value = float(match.group("number").replace(",", "") + (match.group("fraction") or ""))
+        thousands = match.group("k") is not None
+        if thousands:
+            value *= 1000
+        yield _Amount(value, match.start(), match.end(), bool(match.group("dollar")) or thousands, thousands)
+
+
+def _is_range(text, low, high):
+    separator = _RANGE_SEPARATOR.fullmatch(text, low.end, high.start)
+    if separator is None:
+        return False
+    # "and" only joins the ends of a range after "between"
+    return "and" not in separator.group(0) or _BETWEEN.search(text, 0, low.start) is not None
+
+
+@lru_cache(maxsize=4096)
+def parse_prices(text: str) -> Tuple[PriceMention, ...]:
+    """
+    Every price mentioned in `text`, in order, with its span. Cached: the same
+    message is looked at by several stages of a turn.
+    """
+    amounts = list(_amounts(text))
+    mentions = []
+    i = 0
+    while i < len(amounts):
+        low = amounts[i]
+        high = amounts[i + 1] if i + 1 < len(amounts) else None
+        if high is not None and (low.priced or high.priced) and _is_range(text, low, high):
+            low_value = low.value
+            if high.thousands and not low.thousands and low_value < 1000:
+                low_value *= 1000  # "20-22k"
+            mentions.append(PriceMention(low_value, low.start, high.end, high.value))
+            i += 2
+            continue
+        if low.priced:
+            mentions.append(PriceMention(low.value, low.start, low.end))
+        i += 1
+    return tuple(mentions)
+
+
+def extract_price_from_text(text: str) -> Optional[float]:
+    """The first price mentioned in `text` (the low end of a range), or None."""
+    mentions = parse_prices(text)
+    return mentions[0].value if mentions else None
+
+
+def replace_prices(text: str, price: float) -> str:
+    """
+    Rewrite every price mentioned in `text` as `price` ("$21,000.00"). Whole
+    mentions are replaced, "k" suffixes and both ends of a range included.
+    """
+    for mention in reversed(parse_prices(text)):
+        text = f"{text[:mention.start]}${price:,.2f}{text[mention.end:]}"
+    return text
+
+
+class Message(tuple):
+    """
+    A history entry: a (speaker, message) tuple, so it unpacks and serializes
+    like one, that also carries the prices found in the message when it was added.
+    """
+
+    def __new__(cls, speaker, text, prices=None):
+        message = super().__new__(cls, (speaker, text))
+        message.prices = parse_prices(text) if prices is None else prices
+        return message
+
+    def __getnewargs__(self):
+        # Pickle and deepcopy restore the parsed prices instead of parsing again
+        return (self[0], self[1], self.prices)
+
+    @property
+    def speaker(self):
+        return self[0]
+
+    @property
+    def text(self):
+        return self[1]
+
+    @property
+    def price(self):
+        """The first price mentioned, or None."""
+        return self.prices[0].value if self.prices else None
@@ -0,0 +1,120 @@
+"""
+Prometheus metrics for the negotiation pipeline, kept with `prometheus_client`
+and rendered in the Prometheus text format by `GET /metrics`.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import CONTENT_TYPE_LATEST as CONTENT_TYPE
+from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# The app's own metrics; the client's default registry also carries process and GC collectors
+REGISTRY = CollectorRegistry()
+
+
+def render(*registries):
+    """Return the metrics of `registries` in the Prometheus text exposition format."""
+    return b"".join(generate_latest(registry) for registry in registries)
+
+
+class CallbackMetric:
+    """
+    A metric read from existing state when /metrics is scraped. `func` returns
+    a number, or a dict mapping tuples of label values to numbers. `type` is
+    "counter" or "gauge".
+    """
+
+    families = {"counter": CounterMetricFamily, "gauge": GaugeMetricFamily}
+
+    def __init__(self, name, documentation, type, func, labelnames=(), registry=REGISTRY):
+        if type not in self.families:
+            raise ValueError(f"Unsupported callback metric type: {type!r}")
+        self.name = name
+        self.documentation = documentation
+        self.type = type
+        self.func = func
+        self.labelnames = tuple(labelnames)
+        if registry is not None:
+            registry.register(self)
+
+    def _family(self):
+        return self.families[self.type](self.name, self.documentation, labels=self.labelnames)
+
+    def describe(self):
+        return [self._family()]
+
+    def collect(self):
+        family = self._family()
+        values = self.func()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for label_values, value in values.items():
+            family.add_metric(list(label_values), value)
+        return [family]
+
+
+# Pipeline metrics
+STAGE_LATENCY = Histogram("negotiation_stage_seconds", "Time spent in each stage of a turn", ["stage"],
+                          buckets=DEFAULT_BUCKETS, registry=REGISTRY)
+TURN_LATENCY = Histogram("negotiation_turn_seconds", "Time to play the seller's side of one turn",
+                         buckets=DEFAULT_BUCKETS, registry=REGISTRY)
+LLM_CALLS = Counter("llm_calls_total", "LLM calls by kind of prompt", ["kind"], registry=REGISTRY)
+LLM_LATENCY = Histogram("llm_call_seconds", "LLM call latency by kind of prompt", ["kind"],
+                        buckets=DEFAULT_BUCKETS, registry=REGISTRY)
+LLM_CALLS_PER_TURN = Histogram("llm_calls_per_turn", "LLM calls made while playing one turn",
+                               buckets=(0, 1, 2, 3, 4, 5, 6, 8, 10, 15), registry=REGISTRY)
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens reported by the LLM provider", ["type"], registry=REGISTRY)
+LLM_QUEUE_WAIT = Histogram("llm_queue_wait_seconds", "Time LLM calls waited for the limiter", ["priority"],
+                           buckets=DEFAULT_BUCKETS, registry=REGISTRY)
+LLM_RETRIES = Counter("llm_retries_total", "LLM calls retried after a rate-limit or overload error", ["status"],
+                      registry=REGISTRY)
+
+# LLM calls made by the turn running in the current context (None outside a turn)
+_turn_llm_calls = ContextVar("turn_llm_calls", default=None)
+
+
+@contextmanager
+def llm_call(kind):
+    """Count and time one LLM call, attributing it to the current turn if there is one."""
+    LLM_CALLS.labels(kind).inc()
+    calls = _turn_llm_calls.get()
+    if calls is not None:
+        calls[0] += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        LLM_LATENCY.labels(kind).observe(time.perf_counter() - start)
+
+
+@contextmanager
+def turn_scope():
+    """Time one turn and count the LLM calls made in it (including concurrent stages)."""
+    calls = [0]
+    token = _turn_llm_calls.set(calls)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _turn_llm_calls.reset(token)
+        TURN_LATENCY.observe(time.perf_counter() - start)
+        LLM_CALLS_PER_TURN.observe(calls[0])
+
+
+def observe_stages(timings):
+    """Record stage timings collected by `run_stages`."""
+    for stage, seconds in timings.items():
+        STAGE_LATENCY.labels(stage).observe(seconds)
+
+
+async def timed_stage(stage, awaitable):
+    """Await a stage run outside `run_stages` and record its latency."""
+    start = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        STAGE_LATENCY.labels(stage).observe(time.perf_counter() - start)
@@ -1,30 +1,297 @@
-from .llm_interface import get_llm_response
+from .llm_interface import (
+    Prompt, StructuredOutputError, get_llm_response_async, get_llm_structured_async, stream_llm_response
+)
+from .cache import TTLCache
+from .messages import extract_price_from_text, parse_prices
+from .sentiment import DIMENSIONS, local_scorer
+from .pipeline import Stage, run_stages
+from .metrics import observe_stages, turn_scope
+from .strategy_stats import strategy_stats
+from config import settings
+import asyncio
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
 import re
-from typing import List, Dict, Any, Tuple
-import numpy as np
+from typing import List, Dict, Any, NamedTuple, Optional, Tuple
 from functools import lru_cache
 
-# Cache for expensive LLM operations
-@lru_cache(maxsize=128)
-def cached_llm_response(prompt_key, max_tokens=1000):
-    """Cached version of LLM response to avoid duplicate calls."""
-    return get_llm_response(prompt_key, max_tokens)
-
-def extract_price_from_text(text: str) -> float:
-    """Extract price from text using regex pattern matching."""
-    # Look for dollar amounts in the text
-    price_matches = re.findall(r'\$([0-9,]+(?:\.[0-9]+)?)', text)
-    if price_matches:
-        # Convert the first match to a float
-        return float(price_matches[0].replace(',', ''))
-    return None
+logger = logging.getLogger(__name__)
+
+# Sentiment results keyed by message text. The same seller reply is analyzed by
+# the metrics update, the offer generator and the API response within one turn.
+sentiment_cache = TTLCache(maxsize=settings.SENTIMENT_CACHE_SIZE, ttl=settings.SENTIMENT_CACHE_TTL)
+
+# Which engine produced each (uncached) sentiment score
+sentiment_stats = {'local': 0, 'llm': 0}
+
+# Counter updates of speculative work, held until its result is used (see `held_counts`)
+_held_counts = ContextVar("held_counts", default=None)
+
+def count(stats, key):
+    """Add one to a pipeline counter, or hold the update inside `held_counts`."""
+    held = _held_counts.get()
+    if held is None:
+        stats[key] += 1
+    else:
+        held.append((stats, key))
+
+@contextmanager
+def held_counts():
+    """
+    Hold the counter updates made in this block, and in tasks started from it,
+    in the list this yields; `apply_counts` makes them count. Speculative turns
+    that are never claimed do not show up in the classification and sentiment stats.
+    """
+    held = []
+    token = _held_counts.set(held)
+    try:
+        yield held
+    finally:
+        _held_counts.reset(token)
+
+def apply_counts(held):
+    for stats, key in held:
+        stats[key] += 1
+
+# Instructions shared by every LLM call. Prompts put this first, then the
+# transcript, then the call's own task, so the provider can cache the common prefix.
+NEGOTIATION_SYSTEM_PROMPT = """You are part of a simulated negotiation over a used 2019 Honda Accord between a buyer and a seller.
+Each request may start with the negotiation so far, one message per line as "Speaker: message", possibly preceded by a bracketed summary of older messages.
+The task at the end of the request says which part to play: write the buyer's possible offers, reply as the seller, classify the seller's response, or rate the sentiment of a message.
+Follow the output format the task asks for exactly."""
+
+# Phrases a seller uses to state a price floor; a price right after one is their minimum
+MINIMUM_PRICE_PHRASES = [
+    "cannot go below", "can't go below", "can't go any lower", 
+    "won't go below", "won't accept less than", "minimum is",
+    "lowest i can go", "bottom line is", "absolute bottom line"
+]
+
+REJECTION_PHRASES = MINIMUM_PRICE_PHRASES + [
+    "can't accept", "cannot accept", "won't accept", "don't accept",
+    "reject", "decline", "not acceptable", "too low",
+    "can't do that", "cannot do that", "won't do that"
+]
+
+ACCEPTANCE_PHRASES = [
+    "accept", "agreed", "deal", "sold", "you got it", 
+    "we have a deal", "i'll take it", "that works"
+]
+
+# All phrases in one alternation, longest first so overlapping phrases resolve to
+# the more specific one (e.g. "can't accept" rather than "accept"). It matches the
+# original text, so match offsets line up with the price spans; each phrase is
+# its own group, since the matched text may not lowercase back to it (e.g. "İ")
+_PHRASE_KINDS = {phrase: "acceptance" for phrase in ACCEPTANCE_PHRASES}
+_PHRASE_KINDS.update({phrase: "rejection" for phrase in REJECTION_PHRASES})
+_PHRASES = sorted(_PHRASE_KINDS, key=len, reverse=True)
+_PHRASE_PATTERN = re.compile("|".join(f"({re.escape(phrase)})" for phrase in _PHRASES), re.IGNORECASE)
+_MINIMUM_PRICE_PHRASES = frozenset(MINIMUM_PRICE_PHRASES)
+
+# How far past a rejection phrase to look for the price it refers to
+CONSTRAINT_WINDOW = 50
+
+class PhraseScan(NamedTuple):
+    """Phrase matches found in a seller message."""
+    has_acceptance: bool
+    has_rejection: bool
+    constraint_price: Optional[float]  # First price following any rejection phrase
+    minimum_price: Optional[float]  # First price following a minimum-price phrase
+
+# How often classify_response has to fall back to the LLM
+classification_stats = {'total': 0, 'llm_fallback': 0}
+
+@lru_cache(maxsize=256)
+def scan_seller_phrases(text: str) -> PhraseScan:
+    """
+    Scan a seller message once for acceptance and rejection phrases, and for the
+    price stated right after a rejection or minimum-price phrase.
+    Cached, since classify_response and update_state scan the same reply.
+    """
+    has_acceptance = False
+    has_rejection = False
+    constraint_price = None
+    minimum_price = None
+    prices = parse_prices(text)
+    
+    for match in _PHRASE_PATTERN.finditer(text):
+        phrase = _PHRASES[match.lastindex - 1]
+        if _PHRASE_KINDS[phrase] == "acceptance":
+            has_acceptance = True
+            continue
+        
+        has_rejection = True
+        if constraint_price is not None and minimum_price is not None:
+            continue
+        price = next((mention.value for mention in prices
+                      if match.end() <= mention.start and mention.end <= match.end() + CONSTRAINT_WINDOW), None)
+        if price is None:
+            continue
+        if constraint_price is None:
+            constraint_price = price
+        if minimum_price is None and phrase in _MINIMUM_PRICE_PHRASES:
+            minimum_price = price
+    
+    return PhraseScan(has_acceptance, has_rejection, constraint_price, minimum_price)
+
+# Structured output (LLM_OUTPUT_MODE="structured"): tool definitions for the two
+# calls of a turn. Both are sent with every structured call, only tool_choice
+# differs, so the tool block stays part of the cached prompt prefix.
+CLASSIFICATIONS = ("accept", "counter-offer", "reject")
+
+OFFER_STRATEGIES = (
+    "stand_firm", "meet_minimum", "market_comparison", "split_difference",
+    "cash_offer", "final_offer", "value_add", "other"
+)
+
+SELLER_TURN_TOOL = {
+    "name": "seller_turn",
+    "description": "The seller's reply to the buyer's latest offer, how it answers the offer, and its sentiment.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "message": {"type": "string", "description": "The seller's reply to the buyer, a single paragraph."},
+            "classification": {"type": "string", "enum": list(CLASSIFICATIONS)},
+            "minimum_price": {
+                "type": ["number", "null"],
+                "description": "The minimum price the reply states the seller will accept, or null."
+            },
+            "sentiment": {
+                "type": "object",
+                "description": "Sentiment of the reply, each dimension rated 0-10.",
+                "properties": {name: {"type": "number", "minimum": 0, "maximum": 10} for name in DIMENSIONS},
+                "required": list(DIMENSIONS)
+            }
+        },
+        "required": ["message", "classification", "minimum_price", "sentiment"]
+    }
+}
+
+BUYER_OFFERS_TOOL = {
+    "name": "buyer_offers",
+    "description": "The offers the buyer can make next.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "offers": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "text": {"type": "string", "description": "The offer as the buyer would say it, naming the price in dollars."},
+                        "price": {"type": "number", "description": "The price named in the text."},
+                        "strategy": {"type": "string", "enum": list(OFFER_STRATEGIES)}
+                    },
+                    "required": ["text", "price", "strategy"]
+                }
+            }
+        },
+        "required": ["offers"]
+    }
+}
+
+STRUCTURED_TOOLS = (SELLER_TURN_TOOL, BUYER_OFFERS_TOOL)
 
-def analyze_negotiation_sentiment(text: str) -> Dict[str, float]:
+# Structured calls made and how many of them fell back to the text path
+structured_stats = {'calls': 0, 'fallbacks': 0}
+
+class SellerTurn(NamedTuple):
+    """The seller's reply with its classification, stated minimum price and sentiment."""
+    message: str
+    classification: str
+    minimum_price: Optional[float]
+    sentiment: Dict[str, float]
+
+class Offer(str):
+    """An offer's text, carrying the price and strategy tag returned by a structured call."""
+    
+    def __new__(cls, text, price=None, strategy=None):
+        offer = super().__new__(cls, text)
+        offer.price = price
+        offer.strategy = strategy
+        return offer
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def parse_seller_turn(data) -> Optional[SellerTurn]:
+    """Validate the input of a seller_turn tool call. Returns None if it is malformed."""
+    if not isinstance(data, dict):
+        return None
+    message = data.get("message")
+    classification = data.get("classification")
+    minimum_price = data.get("minimum_price")
+    sentiment = data.get("sentiment")
+    if not isinstance(message, str) or not message.strip() or classification not in CLASSIFICATIONS:
+        return None
+    if minimum_price is not None and not (_is_number(minimum_price) and minimum_price > 0):
+        return None
+    if not isinstance(sentiment, dict) or not all(
+        _is_number(sentiment.get(name)) and 0 <= sentiment[name] <= 10 for name in DIMENSIONS
+    ):
+        return None
+    return SellerTurn(message.strip(), classification, minimum_price,
+                      {name: sentiment[name] for name in DIMENSIONS})
+
+def parse_structured_offers(data) -> List[Offer]:
+    """
+    Validate the input of a buyer_offers tool call. Offers whose text does not
+    name the price they claim are dropped; unknown strategy tags become "other".
+    """
+    offers = []
+    items = data.get("offers") if isinstance(data, dict) else None
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict) or not isinstance(item.get("text"), str) or not _is_number(item.get("price")):
+            continue
+        text = item["text"].strip()
+        price = extract_price_from_text(text)
+        if price is None or abs(price - item["price"]) >= 1:
+            continue
+        strategy = item.get("strategy") if item.get("strategy") in OFFER_STRATEGIES else "other"
+        offers.append(Offer(text, price, strategy))
+    return offers
+
+def get_classification_stats():
+    """Return classification counts and the share that needed the LLM."""
+    total = classification_stats['total']
+    return {
+        **classification_stats,
+        'llm_fallback_rate': classification_stats['llm_fallback'] / total if total else 0.0
+    }
+
+def context_blocks(state):
+    """
+    The transcript blocks a prompt about `state` starts with (none without a
+    state). Every call of a turn uses the same blocks, so they share one cached prefix.
+    """
+    return tuple(state.get_context_blocks()) if state is not None else ()
+
+async def analyze_negotiation_sentiment(text: str, state=None) -> Dict[str, float]:
     """
     Analyze the sentiment of a negotiation message.
     Returns a dictionary with sentiment scores.
+    Results are cached by message text, see `sentiment_cache`. Given the
+    negotiation's `state`, the LLM prompt starts with its context, so it shares
+    the cached prefix of the turn's other calls.
+    
+    SENTIMENT_ENGINE selects the scorer: "llm" asks the LLM, "local" uses the
+    lexicon scorer in src/sentiment.py, and "hybrid" uses the local score unless
+    its confidence is below SENTIMENT_HYBRID_MIN_CONFIDENCE.
     """
-    prompt = f"""
+    cached = sentiment_cache.get(text)
+    if cached is not None:
+        return dict(cached)
+    
+    if settings.SENTIMENT_ENGINE in ("local", "hybrid"):
+        sentiment_data, confidence = local_scorer.score(text)
+        if settings.SENTIMENT_ENGINE == "local" or confidence >= settings.SENTIMENT_HYBRID_MIN_CONFIDENCE:
+            count(sentiment_stats, 'local')
+            sentiment_cache.set(text, sentiment_data)
+            return dict(sentiment_data)
+    
+    count(sentiment_stats, 'llm')
+    task = f"""
     Analyze the following negotiation message for sentiment and intent:
     "{text}"
     
@@ -42,8 +309,9 @@ def analyze_negotiation_sentiment(text: str) -> Dict[str, float]:
       "flexibility": 4
     }}
     """
+    prompt = Prompt(NEGOTIATION_SYSTEM_PROMPT, context_blocks(state), task, name="sentiment")
     
-    response = get_llm_response(prompt, max_tokens=200)
+    response = await get_llm_response_async(prompt, max_tokens=200)
     
     # Extract JSON from response
     try:
@@ -52,6 +320,7 @@ def analyze_negotiation_sentiment(text: str) -> Dict[str, float]:
         json_match = re.search(r'\{.*\}', response, re.DOTALL)
         if json_match:
             sentiment_data = json.loads(json_match.group(0))
+            sentiment_cache.set(text, sentiment_data)
             return sentiment_data
         else:
             # Fallback values if parsing fails
@@ -62,7 +331,7 @@ def analyze_negotiation_sentiment(text: str) -> Dict[str, float]:
                 "flexibility": 5
             }
     except Exception as e:
-        print(f"Error parsing sentiment: {e}")
+        logger.warning("Could not parse sentiment", extra={"error": str(e)})
         return {
             "positivity": 5,
             "openness": 5,
@@ -70,37 +339,31 @@ def analyze_negotiation_sentiment(text: str) -> Dict[str, float]:
             "flexibility": 5
         }
 
-def generate_buyer_offers(state, num_offers=4, include_stand_firm=True):
+async def build_offer_prompt(state, num_offers=settings.NUM_OFFERS, include_stand_firm=True, structured=False):
     """
-    Generate possible offers from the buyer using the LLM.
-    Now includes awareness of seller's minimum price constraints.
+    Build the prompt for generating the buyer's next offers.
+    Returns the prompt and the buyer's last offered price (or None).
+    With `structured`, the offers are requested through the buyer_offers tool.
     """
-    history_str = "\n".join([f"{speaker}: {msg}" for speaker, msg in state.history])
+    transcript = context_blocks(state)
     
     # Determine the last buyer offer price if any
-    last_buyer_price = None
-    for speaker, msg in reversed(state.history):
-        if speaker == "Buyer":
-            extracted_price = extract_price_from_text(msg)
-            if extracted_price:
-                last_buyer_price = extracted_price
-                break
+    last_buyer_price = state.get_last_buyer_price()
     
     # Analyze seller's sentiment if there's history
     seller_sentiment = None
     if state.history:
         for speaker, msg in reversed(state.history):
             if speaker == "Seller":
-                seller_sentiment = analyze_negotiation_sentiment(msg)
+                seller_sentiment = await analyze_negotiation_sentiment(msg, state)
                 break
     
     # Check if seller has indicated a minimum price
-    seller_minimum = getattr(state, 'seller_minimum_price', None)
+    seller_minimum = state.seller_minimum_price
     
     # Construct a more sophisticated prompt based on negotiation state
-    prompt = f"""
-    You are an expert negotiator helping a buyer purchase a car. The current negotiation history is:
-    {history_str}
+    prompt = """
+    You are an expert negotiator helping the buyer purchase the car in the negotiation above.
     
     """
     
@@ -140,13 +403,22 @@ def generate_buyer_offers(state, num_offers=4, include_stand_firm=True):
     
     """
     
-    prompt += f"""
+    prompt += """
     Each offer should:
     1. Include a specific price in dollars
     2. Be a natural, persuasive sentence
     3. Use a different negotiation tactic
     4. Consider the seller's previous responses
+    """
+    
+    if structured:
+        prompt += """
+    Answer with the buyer_offers tool: for each offer give its full text, the dollar price
+    the text names, and the tactic it uses as the strategy.
+    """
+        return Prompt(NEGOTIATION_SYSTEM_PROMPT, transcript, prompt, name="offers"), last_buyer_price
     
+    prompt += """
     Format your response exactly like this:
     
     1. [First offer with specific price]
@@ -157,26 +429,96 @@ def generate_buyer_offers(state, num_offers=4, include_stand_firm=True):
     Make sure each offer includes a specific dollar amount.
     """
     
-    response = get_llm_response(prompt)
+    return Prompt(NEGOTIATION_SYSTEM_PROMPT, transcript, prompt, name="offers"), last_buyer_price
+
+def parse_offer_line(line):
+    """Return the offer text from a numbered line like '1. ...', or None for other lines."""
+    if line.strip() and line.strip()[0].isdigit() and ". " in line:
+        return line.split(". ", 1)[1].strip()
+    return None
+
+def fallback_offers(last_buyer_price, include_stand_firm=True):
+    """Offers to show when the LLM response could not be parsed."""
+    offers = ["I would like to offer $20,000 for the car."]
+    if include_stand_firm and last_buyer_price:
+        offers.append(f"I'm standing firm at my offer of ${last_buyer_price:,.2f}.")
+    return offers
+
+async def generate_structured_offers(state, num_offers=settings.NUM_OFFERS, include_stand_firm=True):
+    """
+    Generate the buyer's offers with one buyer_offers tool call. Returns validated
+    Offer objects, or an empty list if the response could not be used.
+    """
+    prompt, _ = await build_offer_prompt(state, num_offers, include_stand_firm, structured=True)
+    count(structured_stats, 'calls')
+    try:
+        data = await get_llm_structured_async(prompt, BUYER_OFFERS_TOOL["name"], STRUCTURED_TOOLS)
+    except StructuredOutputError as e:
+        logger.warning("Structured offers failed", extra={"error": str(e)})
+        data = None
+    offers = parse_structured_offers(data)
+    if not offers:
+        count(structured_stats, 'fallbacks')
+    return offers[:num_offers]
+
+async def generate_buyer_offers(state, num_offers=settings.NUM_OFFERS, include_stand_firm=True):
+    """
+    Generate possible offers from the buyer using the LLM.
+    Now includes awareness of seller's minimum price constraints.
+    In structured mode the offers come from a tool call, falling back to the
+    free-text prompt if it returns no valid offers.
+    """
+    if settings.LLM_OUTPUT_MODE == "structured":
+        offers = await generate_structured_offers(state, num_offers, include_stand_firm)
+        if offers:
+            return offers
+    
+    prompt, last_buyer_price = await build_offer_prompt(state, num_offers, include_stand_firm)
+    response = await get_llm_response_async(prompt)
     
-    # Split by newlines and filter for lines that start with a number followed by a period
-    offers = [line.split(". ", 1)[1].strip() for line in response.split("\n") 
-              if line.strip() and line.strip()[0].isdigit() and ". " in line]
+    # Split by newlines and keep lines that start with a number followed by a period
+    offers = [offer for offer in map(parse_offer_line, response.split("\n")) if offer is not None]
     
     if not offers:
         # Fallback offers if parsing fails
-        offers = ["I would like to offer $20,000 for the car."]
-        if include_stand_firm and last_buyer_price:
-            offers.append(f"I'm standing firm at my offer of ${last_buyer_price:,.2f}.")
+        offers = fallback_offers(last_buyer_price, include_stand_firm)
     
     return offers[:num_offers]
 
-def simulate_seller_response(state, buyer_offer):
+async def stream_buyer_offers(state, num_offers=settings.NUM_OFFERS, include_stand_firm=True):
+    """
+    Like `generate_buyer_offers`, but yield each offer as soon as the LLM has
+    finished writing its line.
+    """
+    prompt, last_buyer_price = await build_offer_prompt(state, num_offers, include_stand_firm)
+    
+    emitted = 0
+    buffer = ""
+    async for chunk in stream_llm_response(prompt):
+        buffer += chunk
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            offer = parse_offer_line(line)
+            if offer is not None and emitted < num_offers:
+                emitted += 1
+                yield offer
+    
+    offer = parse_offer_line(buffer)
+    if offer is not None and emitted < num_offers:
+        emitted += 1
+        yield offer
+    
+    if not emitted:
+        for offer in fallback_offers(last_buyer_price, include_stand_firm)[:num_offers]:
+            yield offer
+
+def build_seller_prompt(state, buyer_offer, structured=False):
     """
-    Simulate the seller's response to the buyer's offer using the LLM.
+    Build the prompt for simulating the seller's response to the buyer's offer.
     Enhanced with memory of negotiation patterns and more realistic behavior.
+    With `structured`, the reply is requested through the seller_turn tool.
     """
-    history_str = "\n".join([f"{speaker}: {msg}" for speaker, msg in state.history])
+    transcript = context_blocks(state)
     
     # Extract price from buyer's offer
     buyer_price = extract_price_from_text(buyer_offer)
@@ -184,18 +526,13 @@ def simulate_seller_response(state, buyer_offer):
     # Determine if this is a "stand firm" offer
     is_standing_firm = False
     last_buyer_price = None
+    buyer_offers = state.buyer_prices
     
-    if len(state.price_history) >= 2:
-        buyer_prices = [price for speaker, price in state.price_history if speaker == "Buyer"]
-        if len(buyer_prices) >= 2:
-            last_buyer_price = buyer_prices[-2]  # Get the previous buyer price
-            if buyer_price and last_buyer_price and abs(buyer_price - last_buyer_price) < 0.01:
-                is_standing_firm = True
-                print(f"Detected buyer standing firm at ${buyer_price}")
-    
-    # Calculate negotiation statistics
-    buyer_offers = [price for speaker, price in state.price_history if speaker == "Buyer"]
-    seller_offers = [price for speaker, price in state.price_history if speaker == "Seller"]
+    if len(buyer_offers) >= 2:
+        last_buyer_price = buyer_offers[-2]  # Get the previous buyer price
+        if buyer_price and last_buyer_price and abs(buyer_price - last_buyer_price) < 0.01:
+            is_standing_firm = True
+            logger.debug("Buyer is standing firm", extra={"price": buyer_price})
     
     # Calculate trends
     buyer_trend = "unknown"
@@ -208,12 +545,11 @@ def simulate_seller_response(state, buyer_offer):
             buyer_trend = "stable"
     
     # Check if seller has a minimum price constraint
-    seller_minimum = getattr(state, 'seller_minimum_price', state.min_price)
+    seller_minimum = state.seller_minimum_price if state.seller_minimum_price is not None else state.min_price
     
     # Construct a more sophisticated prompt
     prompt = f"""
-    You are an experienced car seller in a negotiation. The current negotiation history is:
-    {history_str}
+    You are an experienced car seller in the negotiation above.
     
     The buyer just said: '{buyer_offer}'
     """
@@ -249,35 +585,88 @@ def simulate_seller_response(state, buyer_offer):
     If you have already stated a minimum price and the buyer is still below it, be firm but polite in rejecting.
     """
     
-    return get_llm_response(prompt)
+    if structured:
+        prompt += """
+    Answer with the seller_turn tool: your reply as the message, whether it accepts, counters or
+    rejects the buyer's offer, the minimum price the reply states (or null), and the sentiment of
+    your reply rated 0-10 for positivity, openness, firmness and flexibility.
+    """
+        return Prompt(NEGOTIATION_SYSTEM_PROMPT, transcript, prompt, name="seller_turn")
+    
+    return Prompt(NEGOTIATION_SYSTEM_PROMPT, transcript, prompt, name="seller")
+
+async def simulate_seller_response(state, buyer_offer):
+    """Simulate the seller's response to the buyer's offer using the LLM."""
+    return await get_llm_response_async(build_seller_prompt(state, buyer_offer))
+
+async def simulate_seller_turn(state, buyer_offer) -> SellerTurn:
+    """
+    Simulate the seller's reply, its classification, any stated minimum price and
+    its sentiment with a single seller_turn tool call. If the call fails or does
+    not validate, the parts that are missing come from the usual text reply,
+    phrase heuristics and sentiment engine.
+    """
+    count(structured_stats, 'calls')
+    try:
+        data = await get_llm_structured_async(build_seller_prompt(state, buyer_offer, structured=True),
+                                              SELLER_TURN_TOOL["name"], STRUCTURED_TOOLS)
+    except StructuredOutputError as e:
+        logger.warning("Structured seller turn failed", extra={"error": str(e)})
+        data = None
+    
+    turn = parse_seller_turn(data)
+    if turn is not None:
+        # Later sentiment lookups for this reply (metrics, offers, API) hit the cache
+        sentiment_cache.set(turn.message, turn.sentiment)
+        return turn
+    
+    count(structured_stats, 'fallbacks')
+    message = data.get("message") if isinstance(data, dict) else None
+    if not isinstance(message, str) or not message.strip():
+        message = await simulate_seller_response(state, buyer_offer)
+    classification, sentiment = await asyncio.gather(
+        classify_response(message, buyer_offer, state),
+        analyze_negotiation_sentiment(message, state)
+    )
+    return SellerTurn(message.strip(), classification, None, sentiment)
 
-def classify_response(response, buyer_offer):
+async def precompute_seller_turn(state, buyer_offer) -> SellerTurn:
+    """
+    Compute the seller's side of a turn as if the buyer had just made `buyer_offer`:
+    the reply, its classification and sentiment. `state` is modified (the offer is
+    added to its history), so pass a copy of the live state.
+    """
+    state.add_to_history("Buyer", buyer_offer)
+    if settings.LLM_OUTPUT_MODE == "structured":
+        return await simulate_seller_turn(state, buyer_offer)
+    message = await simulate_seller_response(state, buyer_offer)
+    classification, sentiment = await asyncio.gather(
+        classify_response(message, buyer_offer, state),
+        analyze_negotiation_sentiment(message, state)
+    )
+    return SellerTurn(message, classification, None, sentiment)
+
+async def stream_seller_response(state, buyer_offer):
+    """Yield the simulated seller's response as it is generated."""
+    async for chunk in stream_llm_response(build_seller_prompt(state, buyer_offer)):
+        yield chunk
+
+async def classify_response(response, buyer_offer, state=None):
     """
     Classify the seller's response as accept, counter-offer, or reject.
-    Enhanced with more sophisticated analysis.
+    Enhanced with more sophisticated analysis. Given the negotiation's `state`,
+    an LLM fallback prompt starts with its context, like the seller's prompt.
     """
+    count(classification_stats, 'total')
+    
     # Extract prices
     seller_price = extract_price_from_text(response)
     buyer_price = extract_price_from_text(buyer_offer)
     
-    # Look for acceptance phrases
-    acceptance_phrases = [
-        "accept", "agreed", "deal", "sold", "you got it", 
-        "we have a deal", "i'll take it", "that works"
-    ]
-    
-    # Look for explicit rejection phrases
-    rejection_phrases = [
-        "cannot go below", "can't go below", "can't go any lower", 
-        "won't go below", "won't accept less than", "minimum is",
-        "lowest I can go", "bottom line is", "absolute bottom line",
-        "can't accept", "cannot accept", "won't accept", "don't accept",
-        "reject", "decline", "not acceptable", "too low",
-        "can't do that", "cannot do that", "won't do that"
-    ]
-    
-    has_acceptance = any(phrase in response.lower() for phrase in acceptance_phrases)
-    has_rejection = any(phrase in response.lower() for phrase in rejection_phrases)
+    # Find acceptance, rejection and minimum-price phrases in one pass
+    scan = scan_seller_phrases(response)
+    has_acceptance = scan.has_acceptance
+    has_rejection = scan.has_rejection
     
     # If there are conflicting signals (both acceptance and rejection phrases),
     # we need to analyze more carefully
@@ -285,47 +674,38 @@ def classify_response(response, buyer_offer):
         has_acceptance = False  # Give preference to rejection in this case
     
     # Check for price constraint rejection
-    has_price_constraint = False
-    constraint_price = None
-    
-    for phrase in rejection_phrases:
-        if phrase in response.lower():
-            # Extract the constraint price mentioned after the phrase
-            constraint_index = response.lower().find(phrase) + len(phrase)
-            constraint_text = response[constraint_index:constraint_index + 50]  # Look ahead 50 chars
-            constraint_match = re.search(r'\$([0-9,]+(?:\.[0-9]+)?)', constraint_text)
-            
-            if constraint_match:
-                constraint_price = float(constraint_match.group(1).replace(',', ''))
-                has_price_constraint = True
-                print(f"Found price constraint: ${constraint_price}")
-                break
+    constraint_price = scan.constraint_price
+    has_price_constraint = constraint_price is not None
+    if has_price_constraint:
+        logger.debug("Found price constraint", extra={"price": constraint_price})
     
     # Absolute rejection rules:
     
     # 1. If seller explicitly states a minimum price and it's higher than buyer's offer
     if has_price_constraint and buyer_price and constraint_price > buyer_price:
-        print(f"Rejecting because constraint price ${constraint_price} > buyer price ${buyer_price}")
+        logger.debug("Classified as reject: constraint price above the offer",
+                     extra={"constraint_price": constraint_price, "buyer_price": buyer_price})
         return "reject"
     
     # 2. If there are explicit rejection phrases and no acceptance phrases
     if has_rejection and not has_acceptance:
-        print("Rejecting because found rejection phrase without acceptance phrase")
+        logger.debug("Classified as reject: rejection phrase without acceptance phrase")
         return "reject"
     
     # 3. If there are explicit acceptance phrases
     if has_acceptance and not has_rejection:
-        print("Accepting because found acceptance phrase without rejection phrase")
+        logger.debug("Classified as accept: acceptance phrase without rejection phrase")
         return "accept"
     
     # 4. If seller provides a counter-offer (a specific price)
     if seller_price and not has_price_constraint and not has_acceptance:
-        print(f"Counter-offering with ${seller_price}")
+        logger.debug("Classified as counter-offer", extra={"price": seller_price})
         return "counter-offer"
     
     # 5. For ambiguous cases, use the LLM to classify
-    print("Using LLM to classify ambiguous response")
-    prompt = f"""
+    logger.debug("Using the LLM to classify an ambiguous response")
+    count(classification_stats, 'llm_fallback')
+    task = f"""
     Given the buyer's offer: '{buyer_offer}'
     And the seller's response: '{response}'
     
@@ -341,31 +721,34 @@ def classify_response(response, buyer_offer):
     
     Return only the classification word.
     """
-    classification = get_llm_response(prompt, max_tokens=20).strip().lower()
-    print(f"LLM classification: {classification}")
+    prompt = Prompt(NEGOTIATION_SYSTEM_PROMPT, context_blocks(state), task, name="classification")
+    classification = (await get_llm_response_async(prompt, max_tokens=20)).strip().lower()
+    logger.debug("LLM classification", extra={"classification": classification})
     return classification
 
-def update_state(state, buyer_offer, seller_response, classification):
+async def update_state(state, buyer_offer, seller_response, classification, minimum_price=None):
     """
     Update the negotiation state based on the offer and response.
     Enhanced with better price extraction and state management.
+    `minimum_price` is the seller's stated minimum if already known (structured
+    mode); otherwise it is looked for in the seller's response.
     """
     # Only add buyer offer to history if provided (not None)
     if buyer_offer is not None:
-        state.add_to_history("Buyer", buyer_offer)
+        buyer_message = state.add_to_history("Buyer", buyer_offer)
     
     # Always add seller response to history
-    state.add_to_history("Seller", seller_response)
+    seller_message = state.add_to_history("Seller", seller_response)
     
-    # Extract prices
+    # Prices were parsed when the messages were added to the history
     buyer_price = None
     if buyer_offer:
-        buyer_price = extract_price_from_text(buyer_offer)
+        buyer_price = buyer_message.price
     else:
         # If buyer_offer is None, get the last buyer price from history
         buyer_price = state.get_last_buyer_price()
     
-    seller_price = extract_price_from_text(seller_response)
+    seller_price = seller_message.price
     
     if classification == "accept":
         # If seller accepts, use the buyer's price
@@ -382,77 +765,141 @@ def update_state(state, buyer_offer, seller_response, classification):
     elif classification == "reject":
         # Generate new offers that take into account the rejection
         # We don't update the price here, but we can add a note to the next offers
-        print("Seller rejected the offer without a specific counter-offer.")
+        logger.debug("Seller rejected the offer without a specific counter-offer")
         
         # Check for minimum price mentioned in the rejection
-        minimum_price = None
-        minimum_phrases = [
-            "cannot go below", "can't go below", "can't go any lower", 
-            "won't go below", "won't accept less than", "minimum is",
-            "lowest I can go", "bottom line is", "absolute bottom line"
-        ]
-        
-        for phrase in minimum_phrases:
-            if phrase in seller_response.lower():
-                # Extract the constraint price mentioned after the phrase
-                constraint_index = seller_response.lower().find(phrase) + len(phrase)
-                constraint_text = seller_response[constraint_index:constraint_index + 50]
-                constraint_match = re.search(r'\$([0-9,]+(?:\.[0-9]+)?)', constraint_text)
-                
-                if constraint_match:
-                    minimum_price = float(constraint_match.group(1).replace(',', ''))
-                    break
+        if minimum_price is None:
+            minimum_price = scan_seller_phrases(seller_response).minimum_price
         
         if minimum_price:
-            print(f"Seller indicated they won't go below ${minimum_price}.")
+            logger.debug("Seller stated a minimum price", extra={"price": minimum_price})
             # Store this information in the state for generating future offers
             state.seller_minimum_price = minimum_price
     
     # Update negotiation metrics
-    update_negotiation_metrics(state, buyer_offer or "", seller_response, classification)
+    await update_negotiation_metrics(state, buyer_offer or "", seller_response, classification)
     
     return state
 
-def update_negotiation_metrics(state, buyer_offer, seller_response, classification):
+async def update_negotiation_metrics(state, buyer_offer, seller_response, classification):
     """
     Update negotiation metrics to track progress and strategy effectiveness.
     """
-    if not hasattr(state, 'metrics'):
-        state.metrics = {
-            'rounds': 0,
-            'concessions_made': 0,
-            'average_concession': 0,
-            'strategy_effectiveness': {}
-        }
+    # Add sentiment analysis to the metrics
+    sentiment = await analyze_negotiation_sentiment(seller_response, state)
+    record_turn_metrics(state, sentiment)
     
-    # Increment rounds
+    if classification == "accept":
+        last_buyer_price = state.get_last_buyer_price()
+        logger.info("Negotiation agreed", extra={"price": last_buyer_price, "rounds": state.metrics['rounds']})
+        
+    return state
+
+def record_turn_metrics(state, sentiment):
+    """Count a round and record the seller reply's sentiment (also used when replaying the event log)."""
     state.metrics['rounds'] += 1
     
-    # Track price changes using price_history instead of parsing messages again
-    buyer_prices = [price for speaker, price in state.price_history if speaker == "Buyer"]
-    seller_prices = [price for speaker, price in state.price_history if speaker == "Seller"]
-    
-    # Check for buyer concessions
-    if len(buyer_prices) >= 2:
-        # Check if buyer offered more
-        if buyer_prices[-1] > buyer_prices[-2]:
-            state.metrics['concessions_made'] += 1
-            concession_amount = buyer_prices[-1] - buyer_prices[-2]
-            
-            # Update average concession
-            current_avg = state.metrics.get('average_concession', 0)
-            concessions_count = state.metrics.get('concessions_made', 1)
-            state.metrics['average_concession'] = (current_avg * (concessions_count - 1) + concession_amount) / concessions_count
+    # Buyer concessions are tracked as prices are recorded, see NegotiationState.record_price
+    state.metrics['concessions_made'] = state.buyer_concessions
+    state.metrics['average_concession'] = state.get_average_buyer_concession()
+    
+    if sentiment:
+        state.record_sentiment(sentiment)
+
+def evaluate_strategy(state, strategy_name, classification, context=None):
+    """
+    Record whether the strategy used for this turn moved the seller, and count
+    it in the cross-session stats under `context` (see `strategy_context`) if given.
+    """
+    # A strategy is effective if:
+    # 1. The seller accepted the offer
+    # 2. The seller made a counter-offer that's better than previous
+    # 3. The sentiment improved
+    was_effective = False
     
     if classification == "accept":
-        print(f"Negotiation successful! Accepted price: {buyer_prices[-1] if buyer_prices else 'unknown'}")
+        was_effective = True
+    elif classification == "counter-offer" and state.current_offer:
+        # Check if this counter-offer is better than previous
+        previous_offers = state.seller_prices
+        if len(previous_offers) >= 2 and previous_offers[-1] < previous_offers[-2]:
+            was_effective = True
+    
+    # Update strategy effectiveness
+    state.record_strategy(strategy_name, was_effective)
+    if context is not None:
+        strategy_stats.record(strategy_name, context, was_effective)
+    logger.debug("Strategy evaluated", extra={"strategy": strategy_name, "effective": was_effective})
+    return was_effective
+
+def note_seller_minimum(state, classification):
+    """Add a system note to the history when the seller rejected below their stated minimum."""
+    # If the seller rejected with a minimum price, make sure we generate offers accordingly
+    if classification == "reject" and state.seller_minimum_price is not None:
+        logger.debug("Generating offers around the seller's minimum price", extra={"price": state.seller_minimum_price})
+        # If the minimum price is higher than the current offer, generate offers accordingly
+        if state.current_offer < state.seller_minimum_price:
+            # Add an information message about the seller's minimum price
+            seller_minimum_note = f"The seller has indicated they cannot go below ${state.seller_minimum_price:,.2f}."
+            state.add_to_history("System", seller_minimum_note)
+
+async def generate_next_offers(state, classification):
+    """Generate the buyer's next offers, or none if the negotiation is settled."""
+    if state.agreed_price:
+        return []
     
-    # Add sentiment analysis to the metrics
-    sentiment = analyze_negotiation_sentiment(seller_response)
-    if sentiment:
-        # Ensure the sentiment_history list exists
-        if 'sentiment_history' not in state.metrics:
-            state.metrics['sentiment_history'] = []
-        state.metrics['sentiment_history'].append(sentiment)
-        
-    return state
\ No newline at end of file
+    note_seller_minimum(state, classification)
+    return await generate_buyer_offers(state, include_stand_firm=True)
+
+async def play_turn(state, buyer_offer, strategy_name=None, timings=None, seller_turn=None, context=None):
+    """
+    Play the seller's side of one turn after the buyer's offer has been added to
+    the history: simulate the reply, classify it, update the state and generate
+    the buyer's next offers.
+    
+    The turn runs as a dependency graph: classification and sentiment only need
+    the seller's reply, so they run concurrently; the state update needs both,
+    and the next offers are generated from the updated state. Returns the stage
+    results ("seller", "classification", "sentiment", "update", "offers").
+    
+    In structured mode (LLM_OUTPUT_MODE="structured") one "turn" call returns the
+    reply, classification and sentiment together, and the offers take one more call;
+    the call is timed as the "turn" stage, with no timings for the three parts.
+    A `seller_turn` computed in advance (see `precompute_seller_turn`) is used
+    as the "turn" result instead of asking the LLM. The strategy's outcome is
+    counted in the cross-session stats under `context`, if given.
+    """
+    async def update(seller, classification, sentiment, minimum_price=None):
+        # Update the state with the new information (but don't add the buyer's message again)
+        await update_state(state, None, seller, classification, minimum_price)
+        if strategy_name:
+            evaluate_strategy(state, strategy_name, classification, context)
+    
+    if timings is None:
+        timings = {}
+    with turn_scope():
+        results = await run_stages(turn_stages(state, buyer_offer, update, seller_turn), timings=timings)
+    observe_stages(timings)
+    return results
+
+def turn_stages(state, buyer_offer, update, seller_turn=None):
+    """The stage graph of one turn, see `play_turn`."""
+    if seller_turn is not None or settings.LLM_OUTPUT_MODE == "structured":
+        return [
+            Stage("turn", lambda: seller_turn or simulate_seller_turn(state, buyer_offer)),
+            # Parts of the "turn" result: its time is recorded under "turn"
+            Stage("seller", lambda turn: turn.message, depends_on=["turn"], timed=False),
+            Stage("classification", lambda turn: turn.classification, depends_on=["turn"], timed=False),
+            Stage("sentiment", lambda turn: turn.sentiment, depends_on=["turn"], timed=False),
+            Stage("update", lambda turn: update(turn.message, turn.classification, turn.sentiment, turn.minimum_price),
+                  depends_on=["turn"]),
+            Stage("offers", lambda classification, update: generate_next_offers(state, classification), depends_on=["classification", "update"]),
+        ]
+    
+    return [
+        Stage("seller", lambda: simulate_seller_response(state, buyer_offer)),
+        Stage("classification", lambda seller: classify_response(seller, buyer_offer, state), depends_on=["seller"]),
+        Stage("sentiment", lambda seller: analyze_negotiation_sentiment(seller, state), depends_on=["seller"]),
+        Stage("update", update, depends_on=["seller", "classification", "sentiment"]),
+        Stage("offers", lambda classification, update: generate_next_offers(state, classification), depends_on=["classification", "update"]),
+    ]
@@ -1,13 +1,52 @@
+import logging
 import random
-from .negotiation_logic import extract_price_from_text
+from array import array
+from bisect import bisect_right
+from config import settings
+from .messages import Message
+
+logger = logging.getLogger(__name__)
+
+def estimate_tokens(text):
+    """Rough token count for prompt budgeting (about four characters per token)."""
+    return len(text) // 4 + 1
+
+def transcript_line(speaker, message):
+    """A history entry as it appears in prompts."""
+    return f"{speaker}: {message}"
+
+# Speaker codes for the compact price trajectory
+PRICE_SPEAKERS = ("Buyer", "Seller")
+_SPEAKER_CODES = {speaker: code for code, speaker in enumerate(PRICE_SPEAKERS)}
 
 class NegotiationState:
     """Represents the state of a negotiation session, including history and current offer."""
     
+    __slots__ = (
+        'history', 'price_speakers', 'price_values', 'buyer_prices', 'seller_prices',
+        'buyer_concessions', 'buyer_concession_total', 'seller_concessions', 'seller_concession_total',
+        'current_offer', 'agreed_price', 'min_price', 'max_price', 'initial_price', 'target_price',
+        'flexibility', 'seller_minimum_price', 'strategies_used',
+        'context_start', 'context_tokens', 'context_turns', 'context_token_budget', 'context_fold_chunk',
+        'folded_counts', 'folded_notes', 'folded_prices', 'metrics', 'sentiment_positions'
+    )
+    
     def __init__(self):
         """Initialize a new negotiation state."""
-        self.history = []  # List of (speaker, message) tuples
-        self.price_history = []  # List of (speaker, price) tuples
+        self.history = []  # Message records: (speaker, message) tuples with the prices parsed once
+        
+        # Prices mentioned in the conversation: the interleaved trajectory as
+        # speaker codes and values, plus a series per side. Concession statistics
+        # are updated as prices are appended so no per-turn rescans are needed.
+        self.price_speakers = bytearray()  # Index into PRICE_SPEAKERS
+        self.price_values = array('d')
+        self.buyer_prices = array('d')
+        self.seller_prices = array('d')
+        self.buyer_concessions = 0  # Times the buyer raised their price
+        self.buyer_concession_total = 0.0
+        self.seller_concessions = 0  # Times the seller lowered their price
+        self.seller_concession_total = 0.0
+        
         self.current_offer = None  # The current offer price
         self.agreed_price = None  # The agreed-upon price (if any)
         self.min_price = 18000  # Minimum seller price
@@ -15,8 +54,20 @@ class NegotiationState:
         self.initial_price = random.uniform(self.min_price * 1.15, self.max_price)  # Initial asking price
         self.target_price = self.min_price * 1.1  # Seller's target price
         self.flexibility = random.uniform(0.05, 0.15)  # Seller's price flexibility (5-15%)
+        self.seller_minimum_price = None  # Minimum price the seller has stated (if any)
         self.strategies_used = []  # List of strategies used in this negotiation
         
+        # Prompts show history[context_start:] verbatim plus a summary of the folded
+        # messages; the window's token estimate is kept up to date as messages come and go
+        self.context_start = 0
+        self.context_tokens = 0  # Estimated tokens of the window's transcript lines
+        self.context_turns = settings.CONTEXT_RECENT_TURNS
+        self.context_token_budget = settings.CONTEXT_TOKEN_BUDGET
+        self.context_fold_chunk = settings.CONTEXT_FOLD_CHUNK  # Messages folded at a time
+        self.folded_counts = {}  # Messages per speaker folded out of the context window
+        self.folded_notes = []  # System notes folded out of the context window
+        self.folded_prices = 0  # Price points (price_values[:folded_prices]) of the folded messages
+        
         # Initialize metrics dictionary
         self.metrics = {
             'rounds': 0,
@@ -24,6 +75,8 @@ class NegotiationState:
             'average_concession': 0,
             'strategy_effectiveness': {}
         }
+        # History length when each sentiment_history entry was recorded
+        self.sentiment_positions = array('I')
         
         # Add initial greeting from the seller
         self.add_initial_greeting()
@@ -31,34 +84,116 @@ class NegotiationState:
     def add_initial_greeting(self):
         """Add the initial seller greeting to the history."""
         greeting = f"Welcome! I'm selling a 2019 Honda Accord in excellent condition. It has low mileage, a clean history, and has been well-maintained. I'm asking ${self.initial_price:,.2f} for it, which is competitive for this model in this condition."
-        self.add_to_history("Seller", greeting)
+        self.add_to_history("Seller", greeting)  # Also records the asking price
         self.current_offer = self.initial_price
-        self.price_history.append(("Seller", self.initial_price))
     
     def add_to_history(self, speaker, message):
-        """Add a message to the conversation history."""
-        self.history.append((speaker, message))
+        """Add a message to the conversation history. Returns its Message record."""
+        record = Message(speaker, message)
+        self.history.append(record)
+        self.context_tokens += estimate_tokens(transcript_line(speaker, message))
+        self._fold_context()
         
         # If this is a buyer or seller message (not system), extract price and add to price history
         if speaker in ["Buyer", "Seller"]:
-            price = extract_price_from_text(message)
+            price = record.price
             if price is not None:
-                self.price_history.append((speaker, price))
-                print(f"Added price to history: {speaker} - ${price}")
+                self.record_price(speaker, price)
+                logger.debug("Price recorded", extra={"speaker": speaker, "price": price})
+        return record
+    
+    def record_price(self, speaker, price):
+        """Append a price offered by the buyer or seller and update the concession statistics."""
+        self.price_speakers.append(_SPEAKER_CODES[speaker])
+        self.price_values.append(price)
+        if speaker == "Buyer":
+            if self.buyer_prices and price > self.buyer_prices[-1]:
+                self.buyer_concessions += 1
+                self.buyer_concession_total += price - self.buyer_prices[-1]
+            self.buyer_prices.append(price)
+        else:
+            if self.seller_prices and price < self.seller_prices[-1]:
+                self.seller_concessions += 1
+                self.seller_concession_total += self.seller_prices[-1] - price
+            self.seller_prices.append(price)
+    
+    @property
+    def price_history(self):
+        """List of (speaker, price) tuples in the order they were offered."""
+        return [(PRICE_SPEAKERS[code], price) for code, price in zip(self.price_speakers, self.price_values)]
+    
+    def get_average_buyer_concession(self):
+        """Average amount by which the buyer raised their price."""
+        return self.buyer_concession_total / self.buyer_concessions if self.buyer_concessions else 0
+    
+    def _fold_context(self):
+        """
+        Move the oldest lines out of the context window once it exceeds the turn
+        or token limit. Lines are folded `context_fold_chunk` at a time and the
+        summary only covers folded lines, so between folds the context only grows
+        at the end and prompts share their prefix up to the previous call's last line.
+        """
+        while len(self.history) - self.context_start > 1 and (
+            len(self.history) - self.context_start > self.context_turns
+            or self.context_tokens + estimate_tokens(self.summarize_folded()) > self.context_token_budget
+        ):
+            for _ in range(min(self.context_fold_chunk, len(self.history) - self.context_start - 1)):
+                self._fold_oldest()
+    
+    def _fold_oldest(self):
+        """Move the oldest line of the context window into the summary."""
+        record = self.history[self.context_start]
+        speaker, message = record
+        self.folded_counts[speaker] = self.folded_counts.get(speaker, 0) + 1
+        if speaker == "System":
+            self.folded_notes = (self.folded_notes + [message])[-2:]
+        elif record.price is not None:
+            self.folded_prices += 1
+        self.context_tokens -= estimate_tokens(transcript_line(speaker, message))
+        self.context_start += 1
+    
+    def summarize_folded(self):
+        """Summarize the messages that no longer fit in the context window."""
+        if not self.context_start:
+            return ""
+        
+        counts = ", ".join(f"{count} from {speaker}" for speaker, count in self.folded_counts.items())
+        lines = [f"[Summary of {self.context_start} earlier messages ({counts})]"]
+        lines.extend(f"[Earlier note: {note}]" for note in self.folded_notes)
+        
+        # Price trajectory of the folded messages: the opening and the latest price points
+        count = self.folded_prices
+        shown = list(range(2)) + [None] + list(range(count - 5, count)) if count > 8 else range(count)
+        points = [
+            "..." if i is None else f"{PRICE_SPEAKERS[self.price_speakers[i]]} ${self.price_values[i]:,.2f}"
+            for i in shown
+        ]
+        if points:
+            lines.append(f"[Price trajectory ({count} prices): {' -> '.join(points)}]")
+        return "\n".join(lines)
+    
+    def get_context_blocks(self):
+        """
+        Return the conversation as it should appear in prompts, as a list of text
+        blocks: a summary of older messages and the price trajectory (if any),
+        followed by one block per recent message. Between folds the list only
+        grows at the end, which keeps prompt prefixes cacheable.
+        """
+        summary = self.summarize_folded()
+        recent = [transcript_line(speaker, message) for speaker, message in self.history[self.context_start:]]
+        return [summary] + recent if summary else recent
+    
+    def get_context(self):
+        """Return the conversation as it should appear in prompts, see `get_context_blocks`."""
+        return "\n".join(self.get_context_blocks())
     
     def get_last_buyer_price(self):
         """Get the last price offered by the buyer."""
-        for speaker, price in reversed(self.price_history):
-            if speaker == "Buyer":
-                return price
-        return None
+        return self.buyer_prices[-1] if self.buyer_prices else None
     
     def get_last_seller_price(self):
         """Get the last price offered by the seller."""
-        for speaker, price in reversed(self.price_history):
-            if speaker == "Seller":
-                return price
-        return None
+        return self.seller_prices[-1] if self.seller_prices else None
     
     def update_offer(self, price):
         """Update the current offer price."""
@@ -68,6 +203,22 @@ class NegotiationState:
         """Set the agreed-upon price, finalizing the negotiation."""
         self.agreed_price = price
     
+    def record_sentiment(self, sentiment):
+        """Append a sentiment reading to the metrics, remembering where in the history it was taken."""
+        self.metrics.setdefault('sentiment_history', []).append(sentiment)
+        self.sentiment_positions.append(len(self.history))
+    
+    def metrics_since(self, position):
+        """
+        The metrics as seen by a client that has the first `position` history
+        entries: the scalar metrics, and only the sentiment readings taken after that.
+        """
+        metrics = dict(self.metrics)
+        if 'sentiment_history' in metrics:
+            start = bisect_right(self.sentiment_positions, position)
+            metrics['sentiment_history'] = metrics['sentiment_history'][start:]
+        return metrics
+    
     def is_terminal(self):
         """Check if the negotiation has reached a terminal state."""
         return self.agreed_price is not None
@@ -84,19 +235,6 @@ class NegotiationState:
         if was_effective is None:
             return
         
-        # Initialize strategy_effectiveness in metrics if needed
-        if not hasattr(self, 'metrics'):
-            self.metrics = {
-                'rounds': 0,
-                'concessions_made': 0,
-                'average_concession': 0,
-                'strategy_effectiveness': {}
-            }
-        
-        # Ensure strategy_effectiveness exists in metrics
-        if 'strategy_effectiveness' not in self.metrics:
-            self.metrics['strategy_effectiveness'] = {}
-        
         # Initialize this strategy if first time seeing it
         if strategy_name not in self.metrics['strategy_effectiveness']:
             self.metrics['strategy_effectiveness'][strategy_name] = {
@@ -108,8 +246,11 @@ class NegotiationState:
         if was_effective:
             self.metrics['strategy_effectiveness'][strategy_name]['effective'] += 1
         
-        print(f"Strategy recorded: {strategy_name}, Effective: {was_effective}")
-        print(f"Strategy stats: {self.metrics['strategy_effectiveness'][strategy_name]}")
+        logger.debug("Strategy recorded", extra={
+            "strategy": strategy_name,
+            "effective": was_effective,
+            "stats": self.metrics['strategy_effectiveness'][strategy_name]
+        })
     
     def get_effective_strategies(self):
         """Return a list of strategies sorted by effectiveness."""
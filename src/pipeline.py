@@ -0,0 +1,84 @@
+import asyncio
+import inspect
+import time
+
+
+class Stage:
+    """A named step of a pipeline and the stages whose results it needs."""
+
+    def __init__(self, name, func, depends_on=(), timed=True):
+        """
+        Create a stage. `func` is called with the results of `depends_on` as
+        keyword arguments and may return a value or an awaitable. Stages with
+        `timed=False` (ones that only pick a field out of another's result) are
+        left out of the timings.
+        """
+        self.name = name
+        self.func = func
+        self.depends_on = tuple(depends_on)
+        self.timed = timed
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, depends_on={self.depends_on!r})"
+
+
+def _topological_order(stages):
+    """Return the stage names in dependency order, rejecting unknown deps and cycles."""
+    by_name = {stage.name: stage for stage in stages}
+    if len(by_name) != len(stages):
+        raise ValueError("Stage names must be unique")
+
+    order = []
+    visiting = set()
+    done = set()
+
+    def visit(name, path):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Dependency cycle: {' -> '.join(path + [name])}")
+        if name not in by_name:
+            raise ValueError(f"Unknown stage dependency: {name!r} (required by {path[-1]!r})")
+        visiting.add(name)
+        for dep in by_name[name].depends_on:
+            visit(dep, path + [name])
+        visiting.discard(name)
+        done.add(name)
+        order.append(name)
+
+    for stage in stages:
+        visit(stage.name, [])
+    return [by_name[name] for name in order]
+
+
+async def run_stages(stages, timings=None):
+    """
+    Run the stages concurrently, starting each one as soon as its dependencies
+    have finished. Returns a dict mapping stage name to result. If `timings`
+    is given, it is filled with the wall-clock seconds spent in each stage.
+    If any stage fails, the remaining stages are cancelled and the error is raised.
+    """
+    tasks = {}
+
+    async def run(stage):
+        kwargs = {dep: await tasks[dep] for dep in stage.depends_on}
+        start = time.perf_counter()
+        result = stage.func(**kwargs)
+        if inspect.isawaitable(result):
+            result = await result
+        if timings is not None and stage.timed:
+            timings[stage.name] = time.perf_counter() - start
+        return result
+
+    for stage in _topological_order(stages):
+        tasks[stage.name] = asyncio.ensure_future(run(stage))
+
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        raise
+
+    return {name: task.result() for name, task in tasks.items()}
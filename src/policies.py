@@ -0,0 +1,180 @@
+from .negotiation_logic import OFFER_STRATEGIES, extract_price_from_text
+from .strategy_stats import strategy_context, strategy_stats
+
+# Phrases that give away an untagged offer's strategy, checked in this order
+STRATEGY_PHRASES = (
+    ("stand_firm", ("standing firm", "stand firm", "holding at", "not willing to change")),
+    ("meet_minimum", ("your minimum",)),
+    ("split_difference", ("meet in the middle", "split the difference", "meet halfway", "meet you halfway")),
+    ("cash_offer", ("cash",)),
+    ("final_offer", ("final offer", "best offer", "last offer", "take it or leave it")),
+    ("market_comparison", ("similar cars", "comparable", "market", "research")),
+    ("value_add", ("warranty", "include", "throw in")),
+)
+
+
+def offer_strategy(state, offer):
+    """
+    Name the strategy an offer uses, as one of the OFFER_STRATEGIES tags: the tag
+    a structured call gave it, "stand_firm" if it repeats the buyer's last price,
+    else the first strategy its wording matches in STRATEGY_PHRASES ("other" if none).
+    """
+    tag = getattr(offer, "strategy", None)
+    if tag in OFFER_STRATEGIES:
+        return tag
+    last_price = state.get_last_buyer_price()
+    price = offer_price(offer)
+    if last_price is not None and price is not None and abs(price - last_price) < 0.01:
+        return "stand_firm"
+    text = str(offer).lower()
+    for strategy_name, phrases in STRATEGY_PHRASES:
+        if any(phrase in text for phrase in phrases):
+            return strategy_name
+    return "other"
+
+
+def offer_price(offer):
+    """An offer's price: the one a structured call returned, else the first price in its text."""
+    price = getattr(offer, "price", None)
+    return price if price is not None else extract_price_from_text(offer)
+
+
+def find_cheapest_offer(offers):
+    """Return the index of the lowest-priced offer (offers without a price are skipped), or None."""
+    priced = [(price, index) for index, price in enumerate(map(offer_price, offers)) if price is not None]
+    return min(priced)[1] if priced else None
+
+
+def find_stand_firm_offer(state, offers):
+    """Return the index of the offer that repeats the buyer's last price, or None."""
+    last_price = state.get_last_buyer_price()
+    if last_price is None:
+        return None
+    for index, price in enumerate(map(offer_price, offers)):
+        if price is not None and abs(price - last_price) < 0.01:
+            return index
+    return None
+
+
+class BuyerPolicy:
+    """Chooses which of the generated offers the buyer makes each round."""
+
+    name = "policy"
+
+    def choose(self, state, offers, rng):
+        """Return the index of the offer to make."""
+        raise NotImplementedError
+
+
+class FirstOfferPolicy(BuyerPolicy):
+    """Always take the first offer."""
+
+    name = "first"
+
+    def choose(self, state, offers, rng):
+        return 0
+
+
+class PickOfferPolicy(BuyerPolicy):
+    """Always take the offer at `index` (the last one if fewer were generated)."""
+
+    name = "pick"
+
+    def __init__(self, index=0):
+        self.index = index
+
+    def choose(self, state, offers, rng):
+        return min(self.index, len(offers) - 1)
+
+
+class CheapestOfferPolicy(BuyerPolicy):
+    """Take the lowest-priced offer."""
+
+    name = "cheapest"
+
+    def choose(self, state, offers, rng):
+        index = find_cheapest_offer(offers)
+        return 0 if index is None else index
+
+
+class StandFirmPolicy(BuyerPolicy):
+    """Open with the cheapest offer, then keep repeating the last price."""
+
+    name = "stand_firm"
+
+    def choose(self, state, offers, rng):
+        index = find_stand_firm_offer(state, offers)
+        if index is None:
+            index = find_cheapest_offer(offers)
+        return 0 if index is None else index
+
+
+class TargetPricePolicy(BuyerPolicy):
+    """Take the highest offer that does not exceed `target_price`, or the cheapest if all do."""
+
+    name = "target_price"
+
+    def __init__(self, target_price):
+        self.target_price = target_price
+
+    def choose(self, state, offers, rng):
+        priced = [(price, index) for index, price in enumerate(map(offer_price, offers))
+                  if price is not None and price <= self.target_price]
+        if priced:
+            return max(priced)[1]
+        index = find_cheapest_offer(offers)
+        return 0 if index is None else index
+
+
+class RecommendedPolicy(BuyerPolicy):
+    """Take the offer whose strategy ranks best in the cross-session strategy stats for the current context."""
+
+    name = "recommended"
+
+    def choose(self, state, offers, rng):
+        strategies = [offer_strategy(state, offer) for offer in offers]
+        ranking = strategy_stats.rank(strategy_context(state), list(dict.fromkeys(strategies)))
+        return strategies.index(ranking[0]["strategy"])
+
+
+class RandomOfferPolicy(BuyerPolicy):
+    """Pick an offer uniformly at random."""
+
+    name = "random"
+
+    def choose(self, state, offers, rng):
+        return rng.randrange(len(offers))
+
+
+class StandFirmAfterKPolicy(BuyerPolicy):
+    """Take the first offer for `k` rounds, then keep repeating the last price."""
+
+    name = "stand_firm_after_k"
+
+    def __init__(self, k=2):
+        self.k = k
+
+    def choose(self, state, offers, rng):
+        if state.metrics['rounds'] < self.k:
+            return 0
+        index = find_stand_firm_offer(state, offers)
+        return 0 if index is None else index
+
+
+POLICIES = {
+    FirstOfferPolicy.name: FirstOfferPolicy,
+    PickOfferPolicy.name: PickOfferPolicy,
+    CheapestOfferPolicy.name: CheapestOfferPolicy,
+    StandFirmPolicy.name: StandFirmPolicy,
+    TargetPricePolicy.name: TargetPricePolicy,
+    RecommendedPolicy.name: RecommendedPolicy,
+    RandomOfferPolicy.name: RandomOfferPolicy,
+    StandFirmAfterKPolicy.name: StandFirmAfterKPolicy,
+}
+
+
+def make_policy(name, **options):
+    """Build a buyer policy by name; `options` are passed to its constructor."""
+    if name not in POLICIES:
+        raise ValueError(f"Unknown buyer policy: {name!r} (choose from {', '.join(POLICIES)})")
+    return POLICIES[name](**options)
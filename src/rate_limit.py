@@ -0,0 +1,214 @@
+import asyncio
+import heapq
+import itertools
+import random
+import time
+
+# Request priorities: lower values are served first
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+# Provider statuses worth retrying: rate limited (429) and overloaded (529)
+RETRY_STATUS_CODES = frozenset({429, 529})
+
+
+class PriorityGroup:
+    """The priority of a group of calls (e.g. one speculative turn), which can be raised while they wait."""
+
+    __slots__ = ("priority",)
+
+    def __init__(self, priority):
+        self.priority = priority
+
+
+class LLMRateLimitError(RuntimeError):
+    """Raised when a call is still rate limited after all retries."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Refills at `per_minute` units per minute up to `per_minute`. Requests larger
+    than the bucket are clamped to its size so they can still go through.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount, now):
+        """Seconds until `amount` units are available."""
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.tokens
+        return missing / self.rate if missing > 0 else 0.0
+
+    def consume(self, amount, now):
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+
+class LLMLimiter:
+    """
+    Admission control for LLM calls: at most `max_concurrency` calls in flight,
+    and optional requests-per-minute and (input) tokens-per-minute budgets.
+    Waiting calls are admitted by priority, then in arrival order, so
+    interactive calls overtake queued background work.
+    """
+
+    def __init__(self, max_concurrency=16, requests_per_minute=0, tokens_per_minute=0):
+        self.max_concurrency = max_concurrency
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.active = 0
+        self._queue = []  # Heap of [priority, sequence, tokens, future, group]
+        self._sequence = itertools.count()
+        self._loop = None
+        self._timer = None
+        self.counts = {name: {"admitted": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+                       for name in PRIORITY_NAMES.values()}
+        self.retries = 0
+
+    def _bind(self, loop):
+        # Waiters and timers belong to one event loop; start afresh on a new one
+        if loop is not self._loop:
+            self._loop = loop
+            self._queue = []
+            self._timer = None
+            self.active = 0
+
+    def _delay(self, tokens, now):
+        delay = 0.0
+        if self.requests is not None:
+            delay = self.requests.delay(1, now)
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.delay(tokens, now))
+        return delay
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def _dispatch(self):
+        """Admit waiters from the front of the queue while there is capacity."""
+        while self._queue:
+            _, _, tokens, future, _ = self._queue[0]
+            if future.done():  # Cancelled while waiting
+                heapq.heappop(self._queue)
+                continue
+            if self.active >= self.max_concurrency:
+                return
+            now = time.monotonic()
+            delay = self._delay(tokens, now)
+            if delay > 0:
+                if self._timer is None:
+                    self._timer = self._loop.call_later(delay, self._on_timer)
+                return
+            heapq.heappop(self._queue)
+            if self.requests is not None:
+                self.requests.consume(1, now)
+            if self.tokens is not None:
+                self.tokens.consume(tokens, now)
+            self.active += 1
+            future.set_result(None)
+
+    async def acquire(self, priority=INTERACTIVE, tokens=0, group=None):
+        """
+        Wait for a slot. Returns the seconds spent waiting; call `release` when
+        done. A call made for a PriorityGroup waits at the group's priority, and
+        moves up the queue if the group is promoted.
+        """
+        loop = asyncio.get_running_loop()
+        self._bind(loop)
+        future = loop.create_future()
+        if group is not None:
+            priority = group.priority
+        entry = [priority, next(self._sequence), tokens, future, group]
+        heapq.heappush(self._queue, entry)
+        start = time.monotonic()
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # Admitted just as we were cancelled
+            raise
+        waited = time.monotonic() - start
+        counts = self.counts[PRIORITY_NAMES[entry[0]]]
+        counts["admitted"] += 1
+        counts["wait_seconds"] += waited
+        counts["max_wait_seconds"] = max(counts["max_wait_seconds"], waited)
+        return waited
+
+    def release(self):
+        self.active -= 1
+        self._dispatch()
+
+    def promote(self, group, priority=INTERACTIVE):
+        """Raise a group to `priority`: its waiting calls move up the queue, and its later calls start there."""
+        if priority >= group.priority:
+            return
+        group.priority = priority
+        for entry in self._queue:
+            if entry[4] is group:
+                entry[0] = priority
+        heapq.heapify(self._queue)
+        if self._loop is not None:
+            self._dispatch()
+
+    def queue_depth(self):
+        """Number of calls waiting, by priority name."""
+        depth = dict.fromkeys(PRIORITY_NAMES.values(), 0)
+        for priority, _, _, future, _ in self._queue:
+            if not future.done():
+                depth[PRIORITY_NAMES[priority]] += 1
+        return depth
+
+    def stats(self):
+        return {
+            "max_concurrency": self.max_concurrency,
+            "requests_per_minute": self.requests.capacity if self.requests else None,
+            "tokens_per_minute": self.tokens.capacity if self.tokens else None,
+            "active": self.active,
+            "queued": self.queue_depth(),
+            "admitted": {
+                name: {
+                    **counts,
+                    "mean_wait_seconds": counts["wait_seconds"] / counts["admitted"] if counts["admitted"] else 0.0
+                }
+                for name, counts in self.counts.items()
+            },
+            "retries": self.retries
+        }
+
+
+def retry_status(error):
+    """The provider status code of a retryable error, or None."""
+    status = getattr(error, "status_code", None)
+    return status if status in RETRY_STATUS_CODES else None
+
+
+def retry_after(error):
+    """Seconds the provider asked us to wait (Retry-After header), if any."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, base, cap, error=None):
+    """Full-jitter exponential backoff, never shorter than the provider's Retry-After."""
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    requested = retry_after(error) if error is not None else None
+    return max(delay, requested) if requested is not None else delay
@@ -0,0 +1,127 @@
+import re
+
+DIMENSIONS = ("positivity", "openness", "firmness", "flexibility")
+
+# Weight of each term on (positivity, openness, firmness, flexibility), added to a
+# neutral score of 5. Phrases are matched on word boundaries in lowercased text.
+LEXICON = {
+    # Agreement and warmth
+    "deal": (2.0, 1.0, -0.5, 1.5),
+    "we have a deal": (3.0, 1.0, -1.0, 2.0),
+    "accept": (2.0, 0.5, -0.5, 2.0),
+    "agreed": (2.5, 0.5, -0.5, 2.0),
+    "that works": (2.0, 1.0, -1.0, 2.0),
+    "you got it": (2.5, 0.5, -1.0, 2.0),
+    "happy to": (2.0, 1.5, -0.5, 1.5),
+    "appreciate": (1.5, 1.0, 0.0, 0.5),
+    "thank you": (1.0, 0.5, 0.0, 0.0),
+    "great": (1.0, 0.5, 0.0, 0.0),
+    "fair": (1.0, 1.0, 0.0, 1.0),
+    "understand": (0.5, 1.0, 0.0, 0.5),
+    # Willingness to keep negotiating
+    "meet in the middle": (1.0, 2.0, -1.5, 2.5),
+    "split the difference": (1.0, 2.0, -1.5, 2.5),
+    "come down": (0.5, 1.5, -1.0, 2.0),
+    "counter": (0.0, 1.5, 0.0, 1.0),
+    "consider": (0.5, 1.5, -0.5, 1.0),
+    "flexible": (0.5, 1.5, -1.5, 2.5),
+    "work with you": (1.0, 2.0, -1.0, 2.0),
+    "negotiate": (0.0, 1.5, -0.5, 1.0),
+    "how about": (0.5, 1.5, -0.5, 1.0),
+    "could do": (0.5, 1.0, -0.5, 1.5),
+    "willing": (0.5, 1.5, -0.5, 1.5),
+    # Firm positions and price floors
+    "cannot go below": (-1.0, -1.0, 3.0, -2.5),
+    "can't go below": (-1.0, -1.0, 3.0, -2.5),
+    "can't go any lower": (-1.0, -1.5, 3.0, -3.0),
+    "won't go below": (-1.0, -1.0, 3.0, -2.5),
+    "lowest i can go": (-0.5, -0.5, 2.5, -2.0),
+    "bottom line": (-0.5, -1.0, 2.5, -2.0),
+    "minimum": (-0.5, -0.5, 2.0, -1.5),
+    "firm": (-0.5, -1.0, 2.5, -2.0),
+    "final offer": (-0.5, -2.0, 3.0, -2.5),
+    "non-negotiable": (-1.0, -3.0, 3.5, -3.5),
+    "best i can do": (0.0, -1.0, 2.0, -1.0),
+    "already": (-0.5, -0.5, 1.0, -0.5),
+    # Rejection and negativity
+    "reject": (-2.0, -1.5, 2.0, -2.0),
+    "decline": (-2.0, -1.5, 1.5, -1.5),
+    "too low": (-1.5, -0.5, 1.5, -1.0),
+    "not acceptable": (-2.0, -1.0, 2.0, -2.0),
+    "can't accept": (-1.5, -0.5, 2.0, -1.5),
+    "cannot accept": (-1.5, -0.5, 2.0, -1.5),
+    "won't accept": (-1.5, -1.0, 2.5, -2.0),
+    "unfortunately": (-1.0, 0.0, 0.5, -0.5),
+    "sorry": (-0.5, 0.0, 0.5, -0.5),
+    "insulting": (-3.0, -2.0, 2.0, -2.0),
+    "walk away": (-2.0, -3.0, 2.0, -2.0),
+    "other buyers": (-0.5, -0.5, 1.5, -1.0),
+}
+
+
+class LocalSentimentScorer:
+    """
+    Lexicon-based sentiment scorer. Messages are turned into term-count vectors
+    and scored against the lexicon weight matrix in one matrix product, so a
+    batch of messages costs one regex pass per message plus a NumPy product.
+    NumPy and the weight matrix are only loaded once something is scored, so
+    the "llm" sentiment engine never imports them.
+    """
+
+    def __init__(self, lexicon=LEXICON, neutral=5.0, confidence_hits=2.0):
+        self.lexicon = lexicon
+        self.terms = list(lexicon)
+        self.index = {term: i for i, term in enumerate(self.terms)}
+        self._weights = None
+        self.neutral = neutral
+        self.confidence_hits = confidence_hits
+        self.pattern = re.compile(r"\b(?:" + "|".join(
+            re.escape(term) for term in sorted(self.terms, key=len, reverse=True)
+        ) + r")\b")
+
+    @property
+    def weights(self):
+        """(n_terms, 4) matrix of lexicon weights."""
+        if self._weights is None:
+            import numpy as np
+
+            self._weights = np.array([self.lexicon[term] for term in self.terms], dtype=np.float64)
+        return self._weights
+
+    def term_counts(self, texts):
+        """Return an (n_texts, n_terms) matrix of lexicon term counts."""
+        import numpy as np
+
+        counts = np.zeros((len(texts), len(self.terms)), dtype=np.float64)
+        rows = []
+        cols = []
+        for row, text in enumerate(texts):
+            for match in self.pattern.finditer(text.lower().replace("’", "'")):
+                rows.append(row)
+                cols.append(self.index[match.group(0)])
+        np.add.at(counts, (rows, cols), 1.0)
+        return counts
+
+    def score_batch(self, texts):
+        """
+        Score a batch of messages. Returns an (n_texts, 4) array of 0-10 scores in
+        DIMENSIONS order and an array of confidences in [0, 1) that grow with the
+        number of lexicon terms found.
+        """
+        import numpy as np
+
+        counts = self.term_counts(texts)
+        raw = counts @ self.weights
+        # Squash so that piling up terms saturates smoothly instead of clipping
+        scores = self.neutral + 5.0 * np.tanh(raw / 5.0)
+        hits = counts.sum(axis=1)
+        confidence = hits / (hits + self.confidence_hits)
+        return np.round(scores, 1), confidence
+
+    def score(self, text):
+        """Score one message. Returns the sentiment dict and its confidence."""
+        scores, confidence = self.score_batch([text])
+        return dict(zip(DIMENSIONS, scores[0].tolist())), float(confidence[0])
+
+
+local_scorer = LocalSentimentScorer()
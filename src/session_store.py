@@ -0,0 +1,524 @@
+import heapq
+import math
+import pickle
+import sqlite3
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from config import settings
+
+
+# Session statuses for listing: still negotiating, or a price was agreed
+SESSION_STATUSES = ("active", "agreed")
+
+
+def session_summary(negotiation_id, record):
+    """The listing entry for a session record, computed when the record is stored."""
+    state = record.get("state")
+    complete = state is not None and state.is_terminal()
+    return {
+        "negotiation_id": negotiation_id,
+        "created_at": record["created_at"],
+        "last_updated": record["last_updated"],
+        "status": "agreed" if complete else "active",
+        "rounds": state.metrics['rounds'] if state is not None else 0,
+        "message_count": len(state.history) if state is not None else 0,
+        "is_complete": complete,
+        "progress_score": state.get_negotiation_progress() if state is not None else 0
+    }
+
+
+def encode_cursor(summary):
+    """Opaque cursor for the page that continues after `summary` (newest first)."""
+    return f"{summary['last_updated']!r}:{summary['negotiation_id']}"
+
+
+def decode_cursor(cursor):
+    """The (last_updated, negotiation_id) key encoded by `encode_cursor`. Raises ValueError."""
+    last_updated, separator, negotiation_id = cursor.partition(":")
+    if not separator or not negotiation_id:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return float(last_updated), negotiation_id
+
+
+class SessionConflictError(Exception):
+    """The session was saved by someone else since the record being put was read."""
+
+
+class SessionQuery(NamedTuple):
+    """Filters for listing sessions. Lower bounds are inclusive, upper bounds exclusive."""
+    status: Optional[str] = None
+    created_after: Optional[float] = None
+    created_before: Optional[float] = None
+    updated_after: Optional[float] = None
+    updated_before: Optional[float] = None
+    min_rounds: Optional[int] = None
+
+
+class SessionIndex:
+    """
+    Summaries of a store's sessions, with two sorted lists per status: by
+    (last_updated, negotiation_id), so a page of the newest sessions is found
+    by bisection instead of a scan, and by (created_at, negotiation_id), so a
+    creation time filter only visits the sessions created in its range. Only
+    `min_rounds` is checked session by session. Updating a session adds new
+    entries and leaves the old ones stale; stale entries are skipped and
+    periodically compacted.
+    """
+
+    def __init__(self):
+        self.summaries = {}
+        self._order = {status: [] for status in SESSION_STATUSES}
+        self._created = {status: [] for status in SESSION_STATUSES}
+        self._entries = 0
+
+    def update(self, summary):
+        negotiation_id, status = summary["negotiation_id"], summary["status"]
+        previous = self.summaries.get(negotiation_id)
+        self.summaries[negotiation_id] = summary
+        insort(self._order[status], (summary["last_updated"], negotiation_id))
+        if previous is None or previous["status"] != status:  # created_at never changes
+            insort(self._created[status], (summary["created_at"], negotiation_id))
+        self._entries += 1
+        if self._entries > 2 * len(self.summaries) + 1024:
+            self._compact()
+
+    def remove(self, negotiation_id):
+        self.summaries.pop(negotiation_id, None)
+
+    def _compact(self):
+        for status in SESSION_STATUSES:
+            live = [summary for summary in self.summaries.values() if summary["status"] == status]
+            self._order[status] = sorted((summary["last_updated"], summary["negotiation_id"]) for summary in live)
+            self._created[status] = sorted((summary["created_at"], summary["negotiation_id"]) for summary in live)
+        self._entries = len(self.summaries)
+
+    def _live(self, status, negotiation_id):
+        summary = self.summaries.get(negotiation_id)
+        return summary if summary is not None and summary["status"] == status else None
+
+    def _newest_first(self, status, before):
+        """Live (last_updated, negotiation_id) keys of one status below `before`, newest first."""
+        entries = self._order[status]
+        for position in range(bisect_left(entries, before) - 1, -1, -1):
+            last_updated, negotiation_id = entries[position]
+            summary = self._live(status, negotiation_id)
+            if summary is not None and summary["last_updated"] == last_updated:
+                yield entries[position]
+
+    def _created_between(self, status, after, before):
+        """Live summaries of one status created at or after `after` and before `before` (None: unbounded)."""
+        entries = self._created[status]
+        start = bisect_left(entries, (after, "")) if after is not None else 0
+        end = bisect_left(entries, (before, "")) if before is not None else len(entries)
+        for position in range(start, end):
+            summary = self._live(status, entries[position][1])
+            if summary is not None:
+                yield summary
+
+    def page(self, query, cursor=None, limit=50, live_after=None):
+        """
+        Up to `limit` summaries matching `query`, newest first, starting after
+        `cursor`, and the cursor for the next page (None on the last page).
+        Sessions updated before `live_after` are treated as expired.
+        """
+        before = decode_cursor(cursor) if cursor else (math.inf, "")
+        if query.updated_before is not None:
+            before = min(before, (query.updated_before, ""))
+        lower = max(bound for bound in (query.updated_after, live_after, -math.inf) if bound is not None)
+        statuses = [query.status] if query.status else SESSION_STATUSES
+
+        def has_rounds(summary):
+            return query.min_rounds is None or summary["rounds"] >= query.min_rounds
+
+        if query.created_after is not None or query.created_before is not None:
+            # Only the sessions created in the range, of which the newest `limit` are kept
+            candidates = {
+                summary["negotiation_id"]: summary
+                for status in statuses
+                for summary in self._created_between(status, query.created_after, query.created_before)
+                if lower <= summary["last_updated"] and (summary["last_updated"], summary["negotiation_id"]) < before
+                and has_rounds(summary)
+            }
+            page = heapq.nlargest(limit + 1, candidates.values(),
+                                  key=lambda summary: (summary["last_updated"], summary["negotiation_id"]))
+            if len(page) > limit:
+                return page[:limit], encode_cursor(page[limit - 1])
+            return page, None
+
+        keys = heapq.merge(*(self._newest_first(status, before) for status in statuses), reverse=True)
+        page = []
+        for last_updated, negotiation_id in keys:
+            if last_updated < lower:
+                break
+            summary = self.summaries[negotiation_id]
+            if has_rounds(summary):
+                if len(page) == limit:
+                    return page, encode_cursor(page[-1])
+                page.append(summary)
+        return page, None
+
+
+class SessionStore:
+    """
+    Interface for storing negotiation sessions by id.
+
+    A session record is a dict holding the NegotiationState under "state", the
+    offers currently shown to the buyer under "available_offers", and the
+    "created_at" / "last_updated" timestamps. Records returned by `get` must be
+    written back with `put` after they are modified; a record from `checkout`
+    is a private copy, so changes to it are seen by no one until it is put back.
+    Records carry a "version" that `put` can compare and swap, so that of two
+    requests changing the same session one fails instead of being lost.
+
+    `on_evict`, if set, is called with the id of every session the store drops
+    on its own (expired or over the size limit), not for `delete`.
+    """
+
+    on_evict = None
+
+    def _evicted(self, negotiation_id):
+        if self.on_evict is not None:
+            self.on_evict(negotiation_id)
+
+    def get(self, negotiation_id):
+        """Return the session record, or None if it does not exist or has expired."""
+        raise NotImplementedError
+
+    def checkout(self, negotiation_id):
+        """Return a private copy of the session record to change and `put` back, or None."""
+        record = self.get(negotiation_id)
+        return None if record is None else pickle.loads(pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def put(self, negotiation_id, record, touch=True, expected_version=None):
+        """
+        Store the session record and mark it as updated now (unless `touch` is
+        False, when restoring). With `expected_version`, the record is only
+        stored if the stored one is still at that version (0: not stored yet);
+        otherwise SessionConflictError is raised.
+        """
+        raise NotImplementedError
+
+    def delete(self, negotiation_id):
+        """Remove a session. Returns True if it existed."""
+        raise NotImplementedError
+
+    def items(self):
+        """Iterate over (negotiation_id, record) pairs, least recently updated first."""
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def count_updated_since(self, since):
+        """Number of sessions updated at or after the `since` timestamp."""
+        return sum(1 for _, record in self.items() if record["last_updated"] >= since)
+
+    def list_sessions(self, query=SessionQuery(), cursor=None, limit=50):
+        """
+        Return up to `limit` session summaries matching `query`, most recently
+        updated first, continuing after `cursor`, and the cursor for the next
+        page (None on the last page). Raises ValueError for a malformed cursor.
+        """
+        index = SessionIndex()
+        for negotiation_id, record in self.items():
+            index.update(session_summary(negotiation_id, record))
+        return index.page(query, cursor, limit)
+
+    def __contains__(self, negotiation_id):
+        return self.get(negotiation_id) is not None
+
+    def stats(self):
+        """Return the backend name and current size."""
+        return {'backend': type(self).__name__, 'size': len(self)}
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    Process-local store with bounded size. Sessions are kept in update order;
+    the least recently updated session is evicted once `max_sessions` is
+    exceeded, and sessions idle for longer than `idle_ttl` seconds expire.
+    A SessionIndex of their summaries serves `list_sessions`.
+    """
+
+    def __init__(self, max_sessions=10000, idle_ttl=3600):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._sessions = OrderedDict()
+        self._index = SessionIndex()
+        self.evictions = 0
+
+    def _is_expired(self, record, now):
+        return self.idle_ttl is not None and record["last_updated"] + self.idle_ttl <= now
+
+    def _evict(self):
+        """Drop expired sessions from the front, then trim to `max_sessions`."""
+        now = time.time()
+        while self._sessions:
+            record = next(iter(self._sessions.values()))
+            if not self._is_expired(record, now):
+                break
+            self._drop_oldest()
+        while len(self._sessions) > self.max_sessions:
+            self._drop_oldest()
+
+    def _drop_oldest(self):
+        negotiation_id, _ = self._sessions.popitem(last=False)
+        self._index.remove(negotiation_id)
+        self.evictions += 1
+        self._evicted(negotiation_id)
+
+    def get(self, negotiation_id):
+        record = self._sessions.get(negotiation_id)
+        if record is None:
+            return None
+        if self._is_expired(record, time.time()):
+            del self._sessions[negotiation_id]
+            self._index.remove(negotiation_id)
+            self.evictions += 1
+            self._evicted(negotiation_id)
+            return None
+        return record
+
+    def put(self, negotiation_id, record, touch=True, expected_version=None):
+        if expected_version is not None:
+            stored = self._sessions.get(negotiation_id)
+            if (stored.get("version", 0) if stored is not None else 0) != expected_version:
+                raise SessionConflictError(negotiation_id)
+        if touch:
+            record["last_updated"] = time.time()
+        self._sessions[negotiation_id] = record
+        self._sessions.move_to_end(negotiation_id)
+        self._index.update(session_summary(negotiation_id, record))
+        self._evict()
+
+    def delete(self, negotiation_id):
+        self._index.remove(negotiation_id)
+        return self._sessions.pop(negotiation_id, None) is not None
+
+    def items(self):
+        self._evict()
+        return list(self._sessions.items())
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def count_updated_since(self, since):
+        # Sessions are kept in update order, so walk back from the newest
+        count = 0
+        for record in reversed(self._sessions.values()):
+            if record["last_updated"] < since:
+                break
+            count += 1
+        return count
+
+    def list_sessions(self, query=SessionQuery(), cursor=None, limit=50):
+        live_after = time.time() - self.idle_ttl if self.idle_ttl is not None else None
+        return self._index.page(query, cursor, limit, live_after)
+
+    def stats(self):
+        stats = super().stats()
+        stats.update({
+            'max_sessions': self.max_sessions,
+            'idle_ttl': self.idle_ttl,
+            'evictions': self.evictions
+        })
+        return stats
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Store backed by a SQLite database so sessions survive restarts and can be
+    shared by several worker processes on one host. Records are pickled; the
+    listing fields and the version are kept in columns next to them, and a put
+    with an expected version is a conditional insert or update. The size limit
+    is enforced when a session is inserted.
+    """
+
+    # Listing columns besides negotiation_id, created_at and last_updated
+    SUMMARY_COLUMNS = ("status", "rounds", "message_count", "progress_score")
+
+    def __init__(self, path, max_sessions=None, idle_ttl=3600):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " negotiation_id TEXT PRIMARY KEY,"
+            " created_at REAL NOT NULL,"
+            " last_updated REAL NOT NULL,"
+            " status TEXT NOT NULL DEFAULT 'active',"
+            " rounds INTEGER NOT NULL DEFAULT 0,"
+            " message_count INTEGER NOT NULL DEFAULT 0,"
+            " progress_score REAL NOT NULL DEFAULT 0,"
+            " version INTEGER NOT NULL DEFAULT 0,"
+            " data BLOB NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS sessions_last_updated ON sessions (last_updated)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS sessions_updated_id ON sessions (last_updated, negotiation_id)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS sessions_status_updated ON sessions (status, last_updated, negotiation_id)"
+        )
+
+    def _evict(self, trim=True):
+        """Drop expired sessions, and the least recently updated ones over `max_sessions` if `trim`."""
+        evicted = []
+        if self.idle_ttl is not None:
+            evicted += self._conn.execute(
+                "DELETE FROM sessions WHERE last_updated <= ? RETURNING negotiation_id", (time.time() - self.idle_ttl,)
+            ).fetchall()
+        if trim and self.max_sessions is not None:
+            evicted += self._conn.execute(
+                "DELETE FROM sessions WHERE negotiation_id IN ("
+                " SELECT negotiation_id FROM sessions ORDER BY last_updated DESC LIMIT -1 OFFSET ?)"
+                " RETURNING negotiation_id",
+                (self.max_sessions,)
+            ).fetchall()
+        for negotiation_id, in evicted:
+            self._evicted(negotiation_id)
+
+    def get(self, negotiation_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT last_updated, data FROM sessions WHERE negotiation_id = ?", (negotiation_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        if self.idle_ttl is not None and row[0] + self.idle_ttl <= time.time():
+            if self.delete(negotiation_id):
+                self._evicted(negotiation_id)
+            return None
+        return pickle.loads(row[1])
+
+    checkout = get  # Records are unpickled on every get, so they are private copies already
+
+    def put(self, negotiation_id, record, touch=True, expected_version=None):
+        if touch:
+            record["last_updated"] = time.time()
+        data = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        summary = session_summary(negotiation_id, record)
+        row = (record["created_at"], record["last_updated"], *(summary[column] for column in self.SUMMARY_COLUMNS),
+               record.get("version", 0), data, negotiation_id)
+        with self._lock:
+            inserted = expected_version in (None, 0) and self._conn.execute(
+                "INSERT OR IGNORE INTO sessions (created_at, last_updated, status, rounds, message_count,"
+                " progress_score, version, data, negotiation_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                row
+            ).rowcount > 0
+            if not inserted:
+                condition, params = ("", ()) if expected_version is None else (" AND version = ?", (expected_version,))
+                updated = expected_version != 0 and self._conn.execute(
+                    "UPDATE sessions SET created_at = ?, last_updated = ?, status = ?, rounds = ?, message_count = ?,"
+                    f" progress_score = ?, version = ?, data = ? WHERE negotiation_id = ?{condition}",
+                    row + params
+                ).rowcount > 0
+                if not updated:
+                    raise SessionConflictError(negotiation_id)
+            self._evict(trim=inserted)  # Only an insert can take the store over its size
+
+    def delete(self, negotiation_id):
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM sessions WHERE negotiation_id = ?", (negotiation_id,)
+            )
+        return cursor.rowcount > 0
+
+    def items(self):
+        with self._lock:
+            self._evict()
+            rows = self._conn.execute(
+                "SELECT negotiation_id, data FROM sessions ORDER BY last_updated"
+            ).fetchall()
+        return [(negotiation_id, pickle.loads(data)) for negotiation_id, data in rows]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def count_updated_since(self, since):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM sessions WHERE last_updated >= ?", (since,)
+            ).fetchone()[0]
+
+    def list_sessions(self, query=SessionQuery(), cursor=None, limit=50):
+        conditions, params = [], []
+        if cursor:
+            last_updated, negotiation_id = decode_cursor(cursor)
+            # Spelled out rather than as a row value so the index range is used
+            conditions.append("last_updated <= ? AND (last_updated < ? OR negotiation_id < ?)")
+            params += [last_updated, last_updated, negotiation_id]
+        if self.idle_ttl is not None:
+            conditions.append("last_updated > ?")
+            params.append(time.time() - self.idle_ttl)
+        for column, operator, value in (
+            ("status", "=", query.status),
+            ("created_at", ">=", query.created_after),
+            ("created_at", "<", query.created_before),
+            ("last_updated", ">=", query.updated_after),
+            ("last_updated", "<", query.updated_before),
+            ("rounds", ">=", query.min_rounds),
+        ):
+            if value is not None:
+                conditions.append(f"{column} {operator} ?")
+                params.append(value)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT negotiation_id, created_at, last_updated, status, rounds, message_count, progress_score"
+                f" FROM sessions{where} ORDER BY last_updated DESC, negotiation_id DESC LIMIT ?",
+                (*params, limit + 1)
+            ).fetchall()
+        page = [
+            {
+                "negotiation_id": negotiation_id,
+                "created_at": created_at,
+                "last_updated": last_updated,
+                "status": status,
+                "rounds": rounds,
+                "message_count": message_count,
+                "is_complete": status == "agreed",
+                "progress_score": progress_score
+            }
+            for negotiation_id, created_at, last_updated, status, rounds, message_count, progress_score in rows
+        ]
+        if len(page) > limit:
+            return page[:limit], encode_cursor(page[limit - 1])
+        return page, None
+
+    def stats(self):
+        stats = super().stats()
+        stats.update({
+            'path': self.path,
+            'max_sessions': self.max_sessions,
+            'idle_ttl': self.idle_ttl
+        })
+        return stats
+
+
+def create_session_store(backend=None):
+    """Build the session store selected in config/settings.py."""
+    backend = backend or settings.SESSION_STORE
+    if backend == "memory":
+        return InMemorySessionStore(
+            max_sessions=settings.SESSION_MAX_SESSIONS,
+            idle_ttl=settings.SESSION_IDLE_TTL
+        )
+    if backend == "sqlite":
+        return SQLiteSessionStore(
+            settings.SESSION_DB_PATH,
+            max_sessions=settings.SESSION_MAX_SESSIONS,
+            idle_ttl=settings.SESSION_IDLE_TTL
+        )
+    raise ValueError(f"Unknown session store backend: {backend!r}")
@@ -0,0 +1,143 @@
+import asyncio
+import copy
+from collections import Counter, OrderedDict
+from typing import NamedTuple
+
+from config import settings
+from .llm_interface import llm_priority, promote_llm_calls
+from .negotiation_logic import apply_counts, held_counts, precompute_seller_turn
+from .rate_limit import BACKGROUND, PriorityGroup
+
+
+class Speculation(NamedTuple):
+    """A seller turn being computed ahead of time for one displayed offer."""
+    offer: str
+    history_length: int  # Length of the history the offer was shown for
+    task: asyncio.Task
+    priority: PriorityGroup  # Background until claimed
+    counts: list  # Classification and sentiment counter updates, applied if claimed
+
+
+class SellerSpeculator:
+    """
+    Precomputes the seller's reply to offers while the buyer is still choosing.
+
+    After a session's offers are shown, `start` launches `precompute_seller_turn`
+    in the background for the `top_k` offer positions buyers pick most often.
+    When the buyer picks one of them unchanged, `claim` hands over the result
+    (raising its calls to interactive priority if it is still running) and
+    cancels the rest; only claimed turns count in the pipeline stats. At most
+    `max_per_session` speculations run per session and `max_global` overall;
+    offers beyond the caps are simply not precomputed.
+    """
+
+    def __init__(self, top_k=0, max_per_session=4, max_global=64, max_sessions=10000):
+        self.top_k = top_k
+        self.max_per_session = max_per_session
+        self.max_global = max_global
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # negotiation_id -> {offer_index: Speculation}
+        self.index_picks = Counter()  # How often each offer position was picked
+        self.in_flight = 0
+        self.counts = dict.fromkeys(("started", "skipped", "hits", "misses", "cancelled", "failed"), 0)
+
+    @property
+    def enabled(self):
+        return self.top_k > 0
+
+    def start(self, negotiation_id, state, offers):
+        """Start speculating on the offers just shown for a session, replacing earlier speculations."""
+        self.discard(negotiation_id)
+        if not self.enabled or not offers:
+            return
+
+        ranked = sorted(range(len(offers)), key=lambda index: (-self.index_picks[index], index))
+        speculations = {}
+        for index in ranked[:min(self.top_k, self.max_per_session)]:
+            if self.in_flight >= self.max_global:
+                self.counts["skipped"] += 1
+                continue
+            # Copy now: the live state changes as soon as the buyer makes the offer.
+            # The task inherits the background priority, so real turns overtake it.
+            with llm_priority(BACKGROUND) as priority, held_counts() as counts:
+                task = asyncio.ensure_future(precompute_seller_turn(copy.deepcopy(state), offers[index]))
+            task.add_done_callback(self._finished)
+            self.in_flight += 1
+            self.counts["started"] += 1
+            speculations[index] = Speculation(offers[index], len(state.history), task, priority, counts)
+
+        self._sessions[negotiation_id] = speculations
+        while len(self._sessions) > self.max_sessions:
+            _, evicted = self._sessions.popitem(last=False)
+            self._cancel(evicted.values())
+
+    async def claim(self, negotiation_id, offer_index, offer, state):
+        """
+        Return the precomputed SellerTurn for the offer the buyer just added to
+        `state`, or None if it was not speculated on (or the offer text changed).
+        Any other speculations for the session are cancelled.
+        """
+        if not self.enabled:
+            return None
+        self.index_picks[offer_index] += 1
+        speculations = self._sessions.pop(negotiation_id, {})
+        speculation = speculations.pop(offer_index, None)
+        self._cancel(speculations.values())
+
+        if speculation is None or speculation.offer != offer or len(state.history) != speculation.history_length + 1:
+            if speculation is not None:
+                self._cancel([speculation])
+            self.counts["misses"] += 1
+            return None
+        # The buyer is waiting on it now
+        promote_llm_calls(speculation.priority)
+        try:
+            turn = await speculation.task
+        except Exception:
+            self.counts["misses"] += 1
+            return None
+        self.counts["hits"] += 1
+        apply_counts(speculation.counts)
+        return turn
+
+    def discard(self, negotiation_id):
+        """Cancel a session's speculations."""
+        self._cancel(self._sessions.pop(negotiation_id, {}).values())
+
+    def close(self):
+        """Cancel every pending speculation (on shutdown)."""
+        while self._sessions:
+            self._cancel(self._sessions.popitem()[1].values())
+
+    def _cancel(self, speculations):
+        for speculation in speculations:
+            if not speculation.task.done():
+                speculation.task.cancel()
+                self.counts["cancelled"] += 1
+
+    def _finished(self, task):
+        self.in_flight -= 1
+        if not task.cancelled() and task.exception() is not None:
+            self.counts["failed"] += 1
+
+    def stats(self):
+        """Return the speculation counters and the share of picked offers that were precomputed."""
+        claims = self.counts["hits"] + self.counts["misses"]
+        return {
+            "enabled": self.enabled,
+            "top_k": self.top_k,
+            "in_flight": self.in_flight,
+            "sessions": len(self._sessions),
+            **self.counts,
+            "hit_rate": self.counts["hits"] / claims if claims else 0.0
+        }
+
+
+def create_speculator():
+    """Build the speculator configured by the SPECULATIVE_* settings in config/settings.py."""
+    return SellerSpeculator(
+        top_k=settings.SPECULATIVE_TOP_K,
+        max_per_session=settings.SPECULATIVE_MAX_PER_SESSION,
+        max_global=settings.SPECULATIVE_MAX_GLOBAL,
+        max_sessions=settings.SESSION_MAX_SESSIONS
+    )
@@ -0,0 +1,123 @@
+import math
+from typing import NamedTuple
+
+from config import settings
+
+# Context buckets: rounds played (the last one open-ended), the gap between the
+# buyer's price and the seller's minimum (or last price), and the seller's mood
+ROUND_BUCKETS = 6
+GAP_BANDS = ((0.0, "met"), (0.05, "close"), (0.15, "near"), (math.inf, "far"))
+SENTIMENT_BANDS = ((4.0, "negative"), (6.5, "neutral"), (math.inf, "positive"))
+
+
+class StrategyContext(NamedTuple):
+    """The situation a strategy was used in, as the bucket its outcome is counted under."""
+    round: int
+    gap: str
+    sentiment: str
+
+
+def gap_band(buyer_price, seller_price):
+    if buyer_price is None or not seller_price:
+        return "unknown"
+    gap = (seller_price - buyer_price) / seller_price
+    return next(name for limit, name in GAP_BANDS if gap <= limit)
+
+
+def sentiment_band(sentiment):
+    if not sentiment:
+        return "unknown"
+    mood = (sentiment.get("positivity", 5) + sentiment.get("openness", 5) + sentiment.get("flexibility", 5)) / 3
+    return next(name for limit, name in SENTIMENT_BANDS if mood < limit)
+
+
+def strategy_context(state):
+    """
+    Bucket the state a buyer chooses a strategy in: take it before the buyer's
+    offer is added to the history, so a recommendation and the outcome it is
+    later counted under see the same context.
+    """
+    seller_price = state.seller_minimum_price or state.get_last_seller_price() or state.initial_price
+    sentiments = state.metrics.get('sentiment_history')
+    return StrategyContext(
+        min(state.metrics['rounds'], ROUND_BUCKETS - 1),
+        gap_band(state.get_last_buyer_price(), seller_price),
+        sentiment_band(sentiments[-1] if sentiments else None)
+    )
+
+
+class StrategyStats:
+    """
+    How often each strategy was used and was effective, across all sessions:
+    overall and per context bucket. Strategies are named by the OFFER_STRATEGIES
+    tags (see `policies.offer_strategy`) unless a client picked its own name.
+    `record` is a handful of dict increments, so it runs on every evaluated
+    turn; `rank` scores strategies for a context with UCB1, backing off to a
+    strategy's overall rate where the bucket has few observations.
+    """
+
+    def __init__(self, exploration=1.0, prior_weight=2.0):
+        self.exploration = exploration
+        self.prior_weight = prior_weight  # Observations the overall rate counts as in a bucket
+        self.totals = {}  # strategy -> [used, effective]
+        self.buckets = {}  # (strategy, context) -> [used, effective]
+        self.context_totals = {}  # context -> strategies evaluated in it
+
+    def record(self, strategy_name, context, was_effective):
+        self._add(strategy_name, context, 1, int(bool(was_effective)))
+
+    def restore(self, outcomes):
+        """
+        Replace the counts with `outcomes`, (strategy, context, used, effective)
+        tuples such as the event log keeps (see `EventLog.strategy_outcomes`).
+        """
+        self.totals, self.buckets, self.context_totals = {}, {}, {}
+        for strategy_name, context, used, effective in outcomes:
+            self._add(strategy_name, context, used, effective)
+
+    def _add(self, strategy_name, context, used, effective):
+        for counts in (
+            self.totals.setdefault(strategy_name, [0, 0]),
+            self.buckets.setdefault((strategy_name, context), [0, 0])
+        ):
+            counts[0] += used
+            counts[1] += effective
+        self.context_totals[context] = self.context_totals.get(context, 0) + used
+
+    def rank(self, context, candidates):
+        """
+        Score `candidates` for `context`, best first. Each entry has the smoothed
+        effectiveness rate, the exploration bonus and the counts behind them;
+        untried strategies get the largest bonus, so they are tried too.
+        """
+        pulls = self.context_totals.get(context, 0)
+        ranking = []
+        for strategy_name in candidates:
+            used, effective = self.buckets.get((strategy_name, context), (0, 0))
+            overall_used, overall_effective = self.totals.get(strategy_name, (0, 0))
+            prior = (overall_effective + 1) / (overall_used + 2)
+            rate = (effective + self.prior_weight * prior) / (used + self.prior_weight)
+            bonus = self.exploration * math.sqrt(2 * math.log(pulls + 1) / (used + 1))
+            ranking.append({
+                "strategy": strategy_name,
+                "score": rate + bonus,
+                "rate": rate,
+                "bonus": bonus,
+                "used": used,
+                "effective": effective,
+                "overall_used": overall_used,
+                "overall_effective": overall_effective
+            })
+        ranking.sort(key=lambda entry: entry["score"], reverse=True)
+        return ranking
+
+    def stats(self):
+        return {
+            "strategies": {name: {"used": used, "effective": effective} for name, (used, effective) in self.totals.items()},
+            "contexts": len(self.context_totals),
+            "evaluations": sum(self.context_totals.values())
+        }
+
+
+# Shared by every session of this process; restored from the event log at startup
+strategy_stats = StrategyStats(exploration=settings.STRATEGY_EXPLORATION)
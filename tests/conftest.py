@@ -0,0 +1,4 @@
+import os
+
+# Run the suite offline against the deterministic fake LLM backend
+os.environ.setdefault("LLM_BACKEND", "fake")
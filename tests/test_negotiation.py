@@ -0,0 +1,1178 @@
+import asyncio
+import time
+
+import numpy as np
+import pytest
+
+from src.cache import TTLCache
+from src.pipeline import Stage, run_stages
+from src.session_store import InMemorySessionStore, SQLiteSessionStore
+
+
+def test_ttl_cache_counts_hits_and_misses():
+    cache = TTLCache(maxsize=2, ttl=60)
+    assert cache.get("a") is None
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert "a" in cache
+    assert "b" not in cache
+    assert len(cache) == 2
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(maxsize=2, ttl=0.01)
+    cache.set("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_run_stages_overlaps_independent_stages():
+    async def slow(value):
+        await asyncio.sleep(0.05)
+        return value
+
+    stages = [
+        Stage("seller", lambda: slow("reply")),
+        Stage("classification", lambda seller: slow(seller + ":label"), depends_on=["seller"]),
+        Stage("sentiment", lambda seller: slow(seller + ":mood"), depends_on=["seller"]),
+        Stage("offers", lambda classification, sentiment: [classification, sentiment],
+              depends_on=["classification", "sentiment"]),
+    ]
+    start = time.perf_counter()
+    results = asyncio.run(run_stages(stages))
+    elapsed = time.perf_counter() - start
+
+    assert results["offers"] == ["reply:label", "reply:mood"]
+    assert elapsed < 0.14  # two sequential waits on the critical path, not three
+
+
+def test_run_stages_rejects_cycles():
+    stages = [
+        Stage("a", lambda b: b, depends_on=["b"]),
+        Stage("b", lambda a: a, depends_on=["a"]),
+    ]
+    with pytest.raises(ValueError):
+        asyncio.run(run_stages(stages))
+
+
+def test_in_memory_session_store_evicts_least_recently_updated():
+    store = InMemorySessionStore(max_sessions=2, idle_ttl=None)
+    for negotiation_id in ("a", "b", "c"):
+        store.put(negotiation_id, {"created_at": time.time(), "available_offers": []})
+    assert store.get("a") is None
+    assert [negotiation_id for negotiation_id, _ in store.items()] == ["b", "c"]
+
+
+def test_in_memory_session_store_expires_idle_sessions():
+    store = InMemorySessionStore(max_sessions=10, idle_ttl=0.01)
+    store.put("a", {"created_at": time.time()})
+    time.sleep(0.02)
+    assert store.get("a") is None
+
+
+def test_sqlite_session_store_round_trip(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    store = SQLiteSessionStore(path, idle_ttl=None)
+    store.put("a", {"created_at": 1.0, "available_offers": ["I offer $20,000."]})
+
+    reopened = SQLiteSessionStore(path, idle_ttl=None)
+    record = reopened.get("a")
+    assert record["available_offers"] == ["I offer $20,000."]
+    assert record["last_updated"] > record["created_at"]
+    assert len(reopened) == 1
+    assert reopened.delete("a")
+    assert reopened.get("a") is None
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_session_store_puts_compare_and_swap_versions(backend, tmp_path):
+    from src.session_store import SessionConflictError
+
+    if backend == "sqlite":
+        store = SQLiteSessionStore(str(tmp_path / "sessions.db"), max_sessions=2, idle_ttl=None)
+    else:
+        store = InMemorySessionStore(max_sessions=2, idle_ttl=None)
+    store.put("a", {"created_at": 1.0, "version": 1}, expected_version=0)
+    with pytest.raises(SessionConflictError):
+        store.put("a", {"created_at": 1.0, "version": 1}, expected_version=0)  # Started twice
+    first, second = store.checkout("a"), store.checkout("a")
+    first["version"] = second["version"] = 2
+    store.put("a", first, expected_version=1)
+    with pytest.raises(SessionConflictError):
+        store.put("a", second, expected_version=1)  # Read before the first save: its turn would be lost
+    assert store.get("a")["version"] == 2
+
+    store.put("b", {"created_at": 2.0, "version": 1}, expected_version=0)
+    store.put("a", {"created_at": 1.0, "version": 3}, expected_version=2)
+    store.put("c", {"created_at": 3.0, "version": 1}, expected_version=0)  # Over the limit: b is the oldest
+    assert store.get("b") is None and store.get("a")["version"] == 3
+
+
+def test_make_offer_answers_conflict_when_the_negotiation_was_saved_meanwhile(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from src import api
+
+    client = TestClient(api.app)
+    negotiation_id = client.post("/negotiations/start").json()["negotiation_id"]
+    play_turn = api.play_turn
+
+    async def play_turn_while_another_worker_saves(state, *args, **kwargs):
+        results = await play_turn(state, *args, **kwargs)
+        other = api.app.state.negotiations.checkout(negotiation_id)
+        api.save_negotiation(api.app.state, negotiation_id, other)
+        return results
+
+    monkeypatch.setattr(api, "play_turn", play_turn_while_another_worker_saves)
+    response = client.post(f"/negotiations/{negotiation_id}/make_offer", json={"offer_index": 0})
+    assert response.status_code == 409
+    saved = client.get(f"/negotiations/{negotiation_id}").json()
+    assert (saved["version"], len(saved["history"])) == (2, 1)  # The other save, not the lost turn
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_session_listing_pages_newest_first_with_filters(backend, tmp_path):
+    from src.negotiation_stage import NegotiationState
+    from src.session_store import SessionQuery
+
+    if backend == "memory":
+        store = InMemorySessionStore(max_sessions=100, idle_ttl=None)
+    else:
+        store = SQLiteSessionStore(str(tmp_path / "sessions.db"), idle_ttl=None)
+    for number in range(7):
+        state = NegotiationState()
+        state.metrics['rounds'] = number
+        if number % 3 == 0:
+            state.set_agreed_price(20000)
+        store.put(f"s{number}", {"state": state, "created_at": float(number), "available_offers": []})
+    store.put("s1", store.get("s1"))  # Updating a session moves it to the front
+
+    def pages(query=SessionQuery(), limit=3):
+        pages, cursor = [], None
+        while True:
+            page, cursor = store.list_sessions(query, cursor=cursor, limit=limit)
+            pages.append([summary["negotiation_id"] for summary in page])
+            if cursor is None:
+                return pages
+
+    assert pages() == [["s1", "s6", "s5"], ["s4", "s3", "s2"], ["s0"]]
+    # A creation time range is read off its own index, still newest update first
+    assert pages(SessionQuery(created_after=1.0, created_before=6.0), limit=2) == [["s1", "s5"], ["s4", "s3"], ["s2"]]
+    assert pages(SessionQuery(status="active", created_after=2.0, min_rounds=4)) == [["s5", "s4"]]
+
+    agreed, _ = store.list_sessions(SessionQuery(status="agreed"))
+    assert [summary["negotiation_id"] for summary in agreed] == ["s6", "s3", "s0"]
+    assert all(summary["is_complete"] for summary in agreed)
+    filtered, _ = store.list_sessions(SessionQuery(status="active", min_rounds=2, created_before=5.0))
+    assert [summary["negotiation_id"] for summary in filtered] == ["s4", "s2"]
+    with pytest.raises(ValueError):
+        store.list_sessions(cursor="not-a-cursor")
+
+
+def test_context_keeps_recent_turns_and_summarizes_the_rest():
+    from src.negotiation_stage import NegotiationState
+
+    state = NegotiationState()
+    state.context_turns, state.context_fold_chunk = 6, 4
+    previous, folds = [], 0
+    for i in range(10):
+        state.add_to_history("Buyer", f"I offer ${20000 + i * 100:,}.")
+        state.add_to_history("Seller", f"I can do ${26000 - i * 100:,}.")
+        blocks = state.get_context_blocks()
+        # Between folds the context only grows at the end; a fold drops a whole chunk
+        if blocks[:len(previous)] != previous:
+            folds += 1
+            assert len(blocks) - 1 >= state.context_turns - state.context_fold_chunk + 1
+        previous = blocks
+
+    context = state.get_context()
+    assert context.endswith("\n".join(f"{speaker}: {message}" for speaker, message in state.history[state.context_start:]))
+    assert not hasattr(state, "transcript")  # Derived from the history, not kept twice
+    assert folds == state.context_start // 4 == 4
+    assert "[Summary of 16 earlier messages" in context
+    # The trajectory covers the folded messages only, so it changes with the folds alone
+    trajectory = state.summarize_folded().splitlines()[-1]
+    assert trajectory.startswith("[Price trajectory (16 prices)") and trajectory.endswith("Buyer $20,700.00]")
+
+
+def test_state_tracks_prices_and_concessions_per_side():
+    import pickle
+
+    from src.negotiation_stage import NegotiationState
+
+    state = NegotiationState()
+    for buyer, seller in [(20000, 25000), (21000, 24000), (21000, 23500)]:
+        state.add_to_history("Buyer", f"I offer ${buyer:,}.")
+        state.add_to_history("Seller", f"I can do ${seller:,}.")
+
+    assert not hasattr(state, "__dict__")
+    assert state.price_history[0] == ("Seller", round(state.initial_price, 2))
+    assert len(state.price_history) == 7
+    assert state.get_last_buyer_price() == 21000
+    assert state.get_last_seller_price() == 23500
+    assert state.buyer_concessions == 1
+    assert state.get_average_buyer_concession() == 1000
+    assert state.seller_concessions == 2 + (state.seller_prices[0] > 25000)  # The asking price is random
+
+    restored = pickle.loads(pickle.dumps(state))
+    assert restored.price_history == state.price_history
+    assert list(restored.buyer_prices) == [20000, 21000, 21000]
+
+
+def test_replay_serves_recorded_responses(tmp_path):
+    from src.llm_interface import CassetteMissError, FakeBackend, RecordingBackend, ReplayBackend
+
+    cassette = str(tmp_path / "cassette.jsonl")
+    recorder = RecordingBackend(FakeBackend(), cassette)
+    recorded = asyncio.run(recorder.acomplete("You are an experienced car seller. The buyer's current offer is: $20,000.00"))
+
+    replay = ReplayBackend(cassette)
+    assert replay.complete("You are an experienced car seller. The buyer's current offer is: $20,000.00") == recorded
+    with pytest.raises(CassetteMissError):
+        replay.complete("an unrecorded prompt")
+
+
+def test_prompts_mark_cache_breakpoints_and_record_usage():
+    from types import SimpleNamespace
+
+    from src.llm_interface import AnthropicBackend, llm_usage_log
+    from src.negotiation_logic import NEGOTIATION_SYSTEM_PROMPT, build_offer_prompt, build_seller_prompt
+    from src.negotiation_stage import NegotiationState
+
+    class StubMessages:
+        def __init__(self):
+            self.requests = []
+
+        async def create(self, **request):
+            self.requests.append(request)
+            usage = SimpleNamespace(input_tokens=40, cache_creation_input_tokens=0,
+                                    cache_read_input_tokens=300, output_tokens=25)
+            return SimpleNamespace(content=[SimpleNamespace(text="I could do $24,000.")], usage=usage)
+
+    stub = SimpleNamespace(messages=StubMessages())
+    backend = AnthropicBackend(client=stub, async_client=stub)
+
+    state = NegotiationState()
+    state.add_to_history("Buyer", "I offer $20,000.")
+    seller_prompt = build_seller_prompt(state, "I offer $20,000.")
+    assert asyncio.run(backend.acomplete(seller_prompt)) == "I could do $24,000."
+    state.add_to_history("Seller", "I could do $24,000.")
+    offer_prompt, _ = asyncio.run(build_offer_prompt(state))
+    asyncio.run(backend.acomplete(offer_prompt))
+
+    first, second = stub.messages.requests
+    assert first["system"] == second["system"] == [
+        {"type": "text", "text": NEGOTIATION_SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}
+    ]
+    first_blocks = first["messages"][0]["content"]
+    second_blocks = second["messages"][0]["content"]
+    # The transcript only grows at the end, with a breakpoint after its last block
+    assert [block["text"] for block in first_blocks[:-1]] == [block["text"] for block in second_blocks[:len(first_blocks) - 1]]
+    assert first_blocks[-2]["cache_control"] == second_blocks[-2]["cache_control"] == {"type": "ephemeral"}
+    assert "cache_control" not in second_blocks[-1]
+    assert [record["name"] for record in list(llm_usage_log)[-2:]] == ["seller", "offers"]
+    assert llm_usage_log[-1]["cache_read_input_tokens"] == 300
+
+
+def test_turn_prompts_share_the_cached_prefix(monkeypatch):
+    from config import settings
+    from src import llm_interface, negotiation_logic
+    from src.cache import TTLCache
+    from src.negotiation_logic import NEGOTIATION_SYSTEM_PROMPT, classify_response, play_turn
+    from src.negotiation_stage import NegotiationState
+
+    prompts = []
+    respond = llm_interface.current_llm_client().backend.acomplete
+
+    async def recording(prompt, max_tokens=1000):
+        prompts.append(prompt)
+        return await respond(prompt, max_tokens)
+
+    monkeypatch.setattr(llm_interface.current_llm_client().backend, "acomplete", recording)
+    monkeypatch.setattr(settings, "SENTIMENT_ENGINE", "llm")
+    monkeypatch.setattr(negotiation_logic, "sentiment_cache", TTLCache())
+    state = NegotiationState()
+    state.context_turns, state.context_fold_chunk = 8, 4
+    for i in range(6):
+        offer = f"I can offer ${17000 + i * 100:,}."
+        state.add_to_history("Buyer", offer)
+        asyncio.run(play_turn(state, offer))
+    asyncio.run(classify_response("Let me think about it.", offer, state))  # Ambiguous: asks the LLM
+
+    assert {prompt.system for prompt in prompts} == {NEGOTIATION_SYSTEM_PROMPT}
+    names = [prompt.name for prompt in prompts]
+    assert names[:3] == ["seller", "sentiment", "offers"] and names[-1] == "classification"
+    # Each call extends the previous call's transcript, except right after a fold
+    breaks = sum(
+        current.transcript[:len(previous.transcript)] != previous.transcript
+        for previous, current in zip(prompts, prompts[1:])
+    )
+    assert state.context_start and breaks <= state.context_start // 4
+    # Sentiment and classification see the same context as the call before them
+    for previous, current in zip(prompts, prompts[1:]):
+        if current.name in ("sentiment", "classification"):
+            assert current.transcript == previous.transcript
+
+
+def test_fake_backend_plays_a_full_turn():
+    from src.negotiation_logic import classify_response, generate_buyer_offers, simulate_seller_response, update_state
+    from src.negotiation_stage import NegotiationState
+
+    async def turn():
+        state = NegotiationState()
+        offers = await generate_buyer_offers(state)
+        reply = await simulate_seller_response(state, offers[0])
+        classification = await classify_response(reply, offers[0])
+        await update_state(state, offers[0], reply, classification)
+        return offers, classification, state
+
+    offers, classification, state = asyncio.run(turn())
+    assert len(offers) == 4
+    assert all("$" in offer for offer in offers)
+    assert classification in ("accept", "counter-offer", "reject")
+    assert state.metrics["rounds"] == 1
+    assert set(state.metrics["sentiment_history"][0]) == {"positivity", "openness", "firmness", "flexibility"}
+
+
+def test_concurrent_sessions_overlap_their_llm_calls():
+    from src import api
+    from src.llm_interface import FakeBackend, create_llm_client, use_llm_client
+
+    app = api.create_app()
+    app.state.llm = create_llm_client(FakeBackend(latency=0.05))
+    sessions = 8
+
+    async def start(count):
+        use_llm_client(app.state.llm)
+        begin = time.perf_counter()
+        started = await asyncio.gather(*(api.open_negotiation(app.state) for _ in range(count)))
+        return started, time.perf_counter() - begin
+
+    _, one = asyncio.run(start(1))
+    started, many = asyncio.run(start(sessions))
+    assert len({negotiation_id for negotiation_id, _ in started}) == sessions
+    assert one >= 0.05  # At least one call's latency
+    assert many < one * 3  # About one session's latency, not eight of them in a row
+
+
+def test_scan_seller_phrases_finds_minimum_price():
+    from src.negotiation_logic import scan_seller_phrases
+
+    scan = scan_seller_phrases("Sorry, but the lowest I can go is $21,500.00 on this one.")
+    assert scan.has_rejection and not scan.has_acceptance
+    assert scan.constraint_price == scan.minimum_price == 21500.0
+
+    scan = scan_seller_phrases("That's too low. I could do $24,000.00 instead.")
+    assert scan.has_rejection
+    assert scan.constraint_price == 24000.0
+    assert scan.minimum_price is None  # "too low" does not state a floor
+
+    scan = scan_seller_phrases("I can't accept that, but we have a deal at $23,000.")
+    assert scan.has_acceptance and scan.has_rejection
+
+    # Letters whose lowercase is longer ("İ" -> "i̇") do not shift the phrase offsets off the prices
+    scan = scan_seller_phrases("İİİİİ says: I cannot go below $21,000.")
+    assert scan.constraint_price == scan.minimum_price == 21000.0
+    assert scan_seller_phrases("MY MİNİMUM İS $20,500.").minimum_price == 20500.0
+
+
+def test_classify_response_counts_llm_fallbacks():
+    from src.negotiation_logic import classify_response, classification_stats
+
+    before = dict(classification_stats)
+    assert asyncio.run(classify_response("I cannot go below $22,000.", "I offer $20,000.")) == "reject"
+    assert asyncio.run(classify_response("You got it, $20,000 it is!", "I offer $20,000.")) == "accept"
+    asyncio.run(classify_response("Let me think about it.", "I offer $20,000."))
+    assert classification_stats["total"] - before["total"] == 3
+    assert classification_stats["llm_fallback"] - before["llm_fallback"] == 1
+
+
+def test_local_sentiment_scores_a_batch():
+    from src.sentiment import DIMENSIONS, local_scorer
+
+    scores, confidence = local_scorer.score_batch([
+        "I cannot go below $22,000, that's my bottom line.",
+        "We have a deal, happy to meet in the middle.",
+        "Let me think about it.",
+    ])
+    firm, agreeable, neutral = (dict(zip(DIMENSIONS, row)) for row in scores)
+    assert firm["firmness"] > neutral["firmness"] > agreeable["firmness"]
+    assert agreeable["flexibility"] > firm["flexibility"]
+    assert neutral == {dimension: 5.0 for dimension in DIMENSIONS}
+    assert confidence[2] == 0.0 < confidence[0]
+
+
+def test_hybrid_sentiment_uses_llm_only_when_unsure(monkeypatch):
+    from config import settings
+    from src import negotiation_logic
+
+    monkeypatch.setattr(settings, "SENTIMENT_ENGINE", "hybrid")
+    before = dict(negotiation_logic.sentiment_stats)
+    asyncio.run(negotiation_logic.analyze_negotiation_sentiment("Sorry, I cannot go below $21,000. That's firm."))
+    asyncio.run(negotiation_logic.analyze_negotiation_sentiment("Let me sleep on it overnight."))
+    assert negotiation_logic.sentiment_stats["local"] - before["local"] == 1
+    assert negotiation_logic.sentiment_stats["llm"] - before["llm"] == 1
+
+
+def test_structured_mode_plays_a_turn_in_two_calls(monkeypatch):
+    from config import settings
+    from src import llm_interface, negotiation_logic
+    from src.negotiation_stage import NegotiationState
+
+    monkeypatch.setattr(settings, "LLM_OUTPUT_MODE", "structured")
+    text_calls = []
+    acomplete = llm_interface.current_llm_client().backend.acomplete
+
+    async def counting_acomplete(prompt, max_tokens=1000):
+        text_calls.append(prompt)
+        return await acomplete(prompt, max_tokens)
+
+    monkeypatch.setattr(llm_interface.current_llm_client().backend, "acomplete", counting_acomplete)
+
+    async def turn():
+        state = NegotiationState()
+        offers = await negotiation_logic.generate_buyer_offers(state)
+        state.add_to_history("Buyer", offers[0])
+        before = dict(negotiation_logic.structured_stats)
+        text_calls.clear()  # The greeting's sentiment was scored separately
+        results = await negotiation_logic.play_turn(state, offers[0], offers[0].strategy, timings=timings)
+        return offers, results, before
+
+    timings = {}
+    offers, results, before = asyncio.run(turn())
+    # The reply, classification and sentiment come out of the one timed "turn" call
+    assert "turn" in timings and not {"seller", "classification", "sentiment"} & set(timings)
+    assert all(isinstance(offer, negotiation_logic.Offer) and offer.strategy for offer in offers)
+    assert results["classification"] in negotiation_logic.CLASSIFICATIONS
+    assert results["sentiment"] == results["turn"].sentiment
+    assert negotiation_logic.structured_stats["calls"] - before["calls"] == (1 if results["offers"] == [] else 2)
+    assert negotiation_logic.structured_stats["fallbacks"] == before["fallbacks"]
+    assert text_calls == []
+
+
+def test_structured_output_validation_rejects_malformed_data():
+    from src.negotiation_logic import parse_seller_turn, parse_structured_offers
+
+    sentiment = {"positivity": 6, "openness": 7, "firmness": 4, "flexibility": 6}
+    turn = parse_seller_turn({"message": "I could do $24,000.", "classification": "counter-offer",
+                              "minimum_price": None, "sentiment": sentiment})
+    assert turn.classification == "counter-offer" and turn.sentiment == sentiment
+    assert parse_seller_turn({"message": "Sure.", "classification": "maybe", "sentiment": sentiment}) is None
+    assert parse_seller_turn({"message": "Sure.", "classification": "accept",
+                              "sentiment": {**sentiment, "firmness": 12}}) is None
+
+    offers = parse_structured_offers({"offers": [
+        {"text": "I can offer $21,000 today.", "price": 21000, "strategy": "cash_offer"},
+        {"text": "How about $19,500?", "price": 21000, "strategy": "final_offer"},  # Price mismatch
+        {"text": "Let's say $20,500.", "price": 20500, "strategy": "charm"},
+    ]})
+    assert offers == ["I can offer $21,000 today.", "Let's say $20,500."]
+    assert [offer.strategy for offer in offers] == ["cash_offer", "other"]
+    assert parse_structured_offers("not json") == []
+
+
+def test_speculator_serves_precomputed_seller_turns():
+    from src.negotiation_logic import generate_buyer_offers, play_turn
+    from src.negotiation_stage import NegotiationState
+    from src.speculation import SellerSpeculator
+
+    speculator = SellerSpeculator(top_k=2, max_per_session=4, max_global=3)
+
+    async def session():
+        state = NegotiationState()
+        offers = await generate_buyer_offers(state)
+        speculator.start("a", state, offers)
+        speculator.start("b", NegotiationState(), offers)  # Over the global cap after one more
+        await asyncio.sleep(0)
+
+        state.add_to_history("Buyer", offers[1])
+        turn = await speculator.claim("a", 1, offers[1], state)
+        results = await play_turn(state, offers[1], seller_turn=turn)
+
+        custom = "I offer $19,000."
+        state.add_to_history("Buyer", custom)
+        missed = await speculator.claim("b", 0, custom, state)
+        return turn, results, missed
+
+    turn, results, missed = asyncio.run(session())
+    assert turn is not None and results["seller"] == turn.message
+    assert missed is None
+    stats = speculator.stats()
+    assert (stats["started"], stats["skipped"]) == (3, 1)
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+    assert stats["in_flight"] == 0
+
+
+def test_claimed_speculations_run_interactive_and_only_claimed_turns_count(monkeypatch, tmp_path):
+    import sqlite3
+
+    from fastapi.testclient import TestClient
+
+    from config import settings
+    from src import api, llm_interface
+    from src.event_log import EventLog
+    from src.negotiation_logic import classification_stats, generate_buyer_offers, sentiment_stats
+    from src.negotiation_stage import NegotiationState
+    from src.rate_limit import LLMLimiter
+    from src.speculation import SellerSpeculator
+
+    monkeypatch.setattr(settings, "SENTIMENT_ENGINE", "llm")
+    monkeypatch.setattr(llm_interface.current_llm_client(), "limiter", LLMLimiter(max_concurrency=1))
+    limiter = llm_interface.current_llm_client().limiter
+    speculator = SellerSpeculator(top_k=2)
+
+    async def session():
+        state = NegotiationState()
+        offers = await generate_buyer_offers(state)
+        await limiter.acquire()  # Hold the only slot: the speculations queue behind it
+        speculator.start("a", state, offers)
+        await asyncio.sleep(0)
+        assert limiter.queue_depth() == {"interactive": 0, "background": 2}
+
+        state.add_to_history("Buyer", offers[0])
+        claim = asyncio.ensure_future(speculator.claim("a", 0, offers[0], state))
+        await asyncio.sleep(0)
+        # The other speculation is cancelled and the claimed one waits as interactive
+        assert limiter.queue_depth() == {"interactive": 1, "background": 0}
+        limiter.release()
+        assert await claim is not None
+
+        counted = dict(classification_stats), dict(sentiment_stats)
+        speculator.start("a", state, offers)
+        while speculator.in_flight:
+            await asyncio.sleep(0.01)
+        speculator.discard("a")  # Finished but never claimed
+        assert (dict(classification_stats), dict(sentiment_stats)) == counted
+
+    asyncio.run(session())
+
+    # The event log only sees the turns that were played
+    log = EventLog(str(tmp_path / "events.db"), flush_interval=60)
+    monkeypatch.setattr(api.app.state, "event_log", log)
+    monkeypatch.setattr(api.app.state, "speculator", SellerSpeculator(top_k=4))
+    with TestClient(api.app) as client:
+        negotiation_id = client.post("/negotiations/start").json()["negotiation_id"]
+        client.post(f"/negotiations/{negotiation_id}/make_offer", json={"offer_index": 1})
+        log.flush()
+        kinds = [kind for kind, in sqlite3.connect(log.path).execute("SELECT kind FROM events ORDER BY seq")]
+    assert kinds.count("classification") == kinds.count("seller_reply") == 1
+
+
+def test_metrics_render_the_text_exposition_format():
+    from prometheus_client import CollectorRegistry
+    from prometheus_client.parser import text_string_to_metric_families
+
+    from src.metrics import REGISTRY, STAGE_LATENCY, CallbackMetric, render
+
+    registry = CollectorRegistry()
+    CallbackMetric("requests_total", "Requests by path", "counter", lambda: {("/a",): 2, ("/b",): 1},
+                   labelnames=["path"], registry=registry)
+    CallbackMetric("temperature", "Reading", "gauge", lambda: 21.5, registry=registry)
+    families = {family.name: family for family in text_string_to_metric_families(render(registry).decode())}
+    assert families["requests"].type == "counter"
+    assert {sample.labels["path"]: sample.value for sample in families["requests"].samples} == {"/a": 2, "/b": 1}
+    assert [sample.value for sample in families["temperature"].samples] == [21.5]
+    with pytest.raises(ValueError):
+        CallbackMetric("latency", "Not a callback type", "histogram", lambda: 0, registry=None)
+
+    # The app's own metrics parse, and histogram buckets are cumulative
+    for seconds in (0.05, 0.5, 2):
+        STAGE_LATENCY.labels("test").observe(seconds)
+    families = {family.name: family for family in text_string_to_metric_families(render(REGISTRY).decode())}
+    buckets = {sample.labels["le"]: sample.value for sample in families["negotiation_stage_seconds"].samples
+               if sample.name.endswith("_bucket") and sample.labels["stage"] == "test"}
+    assert (buckets["0.1"], buckets["1.0"], buckets["+Inf"]) == (1, 2, 3)
+
+
+def test_metrics_endpoint_reports_turn_stages():
+    from fastapi.testclient import TestClient
+
+    from src.api import app
+
+    client = TestClient(app)
+    negotiation = client.post("/negotiations/start").json()
+    client.post(f"/negotiations/{negotiation['negotiation_id']}/make_offer", json={"offer_index": 0})
+
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain")
+    for sample in ('negotiation_stage_seconds_count{stage="seller"}', 'llm_calls_total{kind="seller"}',
+                   "llm_calls_per_turn_count", "negotiation_sessions", "negotiation_classification_fallback_ratio"):
+        assert sample in response.text
+
+
+def test_batch_simulation_collects_columnar_outcomes():
+    from src.main import run_simulations, summarize
+
+    columns, strategy_counts = run_simulations(6, "stand_firm_after_k", {"k": 1}, max_rounds=5, workers=1)
+    assert columns["seed"].tolist() == list(range(6))
+    assert columns["rounds"].max() <= 5
+    assert (columns["agreed"] == ~np.isnan(columns["agreed_price"])).all()
+
+    summary = summarize(columns, strategy_counts)
+    assert summary["runs"] == 6
+    assert 0.0 <= summary["agreement_rate"] <= 1.0
+
+
+def test_llm_limiter_serves_interactive_calls_first():
+    from src.rate_limit import BACKGROUND, INTERACTIVE, LLMLimiter
+
+    limiter = LLMLimiter(max_concurrency=1)
+    order = []
+
+    async def call(name, priority):
+        await limiter.acquire(priority)
+        order.append(name)
+        await asyncio.sleep(0)
+        limiter.release()
+
+    async def session():
+        await limiter.acquire(INTERACTIVE)  # Hold the only slot while the others queue
+        waiters = [asyncio.ensure_future(call("sentiment", BACKGROUND)),
+                   asyncio.ensure_future(call("seller", INTERACTIVE))]
+        await asyncio.sleep(0)
+        assert limiter.queue_depth() == {"interactive": 1, "background": 1}
+        limiter.release()
+        await asyncio.gather(*waiters)
+
+    asyncio.run(session())
+    assert order == ["seller", "sentiment"]
+    assert limiter.stats()["admitted"]["background"]["admitted"] == 1
+
+
+def test_turn_llm_calls_are_admitted_as_interactive(monkeypatch):
+    from config import settings
+    from src import llm_interface
+    from src.negotiation_logic import analyze_negotiation_sentiment, play_turn
+    from src.negotiation_stage import NegotiationState
+    from src.rate_limit import BACKGROUND, LLMLimiter
+
+    monkeypatch.setattr(settings, "SENTIMENT_ENGINE", "llm")
+    monkeypatch.setattr(llm_interface.current_llm_client(), "limiter", LLMLimiter(max_concurrency=4))
+    state = NegotiationState()
+    state.add_to_history("Buyer", "I can offer $20,000.")
+    asyncio.run(play_turn(state, "I can offer $20,000."))  # The seller's reply, its sentiment and the next offers
+    admitted = llm_interface.current_llm_client().limiter.stats()["admitted"]
+    assert admitted["interactive"]["admitted"] >= 3 and admitted["background"]["admitted"] == 0
+
+    async def background_sentiment():
+        with llm_interface.llm_priority(BACKGROUND):
+            await analyze_negotiation_sentiment("Fine, I could maybe do $23,900 for you.")
+
+    asyncio.run(background_sentiment())
+    assert llm_interface.current_llm_client().limiter.stats()["admitted"]["background"]["admitted"] == 1
+
+
+def test_llm_calls_retry_rate_limited_responses(monkeypatch):
+    from config import settings
+    from src import llm_interface
+    from src.rate_limit import LLMRateLimitError
+
+    class Overloaded(Exception):
+        status_code = 529
+
+    failures = []
+
+    async def flaky(prompt, max_tokens):
+        if len(failures) < 2:
+            failures.append(prompt)
+            raise Overloaded()
+        return "Deal."
+
+    monkeypatch.setattr(llm_interface.current_llm_client().backend, "acomplete", flaky)
+    monkeypatch.setattr(settings, "LLM_BACKOFF_BASE", 0.001)
+    retries = llm_interface.current_llm_client().limiter.retries
+    assert asyncio.run(llm_interface.get_llm_response_async("Reply.")) == "Deal."
+    assert llm_interface.current_llm_client().limiter.retries == retries + 2
+
+    monkeypatch.setattr(settings, "LLM_MAX_RETRIES", 1)
+    failures.clear()
+    with pytest.raises(LLMRateLimitError):
+        asyncio.run(llm_interface.get_llm_response_async("Reply."))
+    assert llm_interface.current_llm_client().limiter.active == 0
+
+
+def test_negotiation_polling_with_etag_and_since():
+    from fastapi.testclient import TestClient
+
+    from src.api import app
+
+    client = TestClient(app)
+    started = client.post("/negotiations/start")
+    negotiation_id, etag = started.json()["negotiation_id"], started.headers["etag"]
+    url = f"/negotiations/{negotiation_id}"
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+    known = len(started.json()["history"])
+    offered = client.post(f"{url}/make_offer", json={"offer_index": 0})
+    assert offered.headers["etag"] != etag
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 200
+
+    full = client.get(url).json()
+    delta = client.get(url, params={"since": known}).json()
+    assert delta["since"] == known and delta["version"] == full["version"]
+    assert delta["history"] == full["history"][known:]
+    assert delta["metrics"]["sentiment_history"] == full["metrics"]["sentiment_history"]
+    assert client.get(url, params={"since": len(full["history"])}).json()["metrics"]["sentiment_history"] == []
+    assert client.get(url, params={"since": len(full["history"]) + 1}).status_code == 400
+
+    # An invalid since is rejected before the turn is played, so nothing is lost
+    for since in (-1, len(full["history"]) + 1):
+        assert client.post(f"{url}/make_offer", params={"since": since}, json={"offer_index": 0}).status_code == 400
+    unchanged = client.get(url).json()
+    assert (unchanged["version"], unchanged["history"]) == (full["version"], full["history"])
+
+
+def sse_events(text):
+    """(event, data) pairs of a Server-Sent Events response body."""
+    import json
+
+    return [
+        (block.split("\n")[0].removeprefix("event: "), json.loads(block.split("\n")[1].removeprefix("data: ")))
+        for block in text.strip().split("\n\n")
+    ]
+
+
+def test_offer_stream_sends_events_in_order_and_saves_the_turn():
+    from fastapi.testclient import TestClient
+
+    from src.api import app
+
+    client = TestClient(app)
+    started = client.post("/negotiations/start").json()
+    url = f"/negotiations/{started['negotiation_id']}"
+    with client.stream("POST", f"{url}/make_offer/stream", json={"offer_index": 0}) as response:
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = sse_events(response.read().decode())
+
+    names = [event for event, _ in events]
+    tokens = names.index("seller_message")
+    offers = len(names) - tokens - 5
+    assert tokens >= 1 and set(names[:tokens]) == {"seller_token"}
+    assert names[tokens:] == ["seller_message", "classification", "state", "metrics"] + ["offer"] * offers + ["done"]
+    data = [data for _, data in events]
+    reply = data[tokens]["text"]
+    assert data[tokens + 1]["classification"] in ("accept", "counter-offer", "reject")
+    assert "".join(token["text"] for token in data[:tokens]) == reply
+
+    # The saved negotiation is the one the done event describes
+    done = data[-1]
+    saved = client.get(url).json()
+    assert (saved["history"], saved["version"]) == (done["history"], done["version"])
+    assert saved["history"][:len(started["history"])] == started["history"]
+    assert saved["history"][len(started["history"]):] == [["Buyer", started["available_offers"][0]], ["Seller", reply]]
+    assert saved["available_offers"] == [offer["text"] for offer in data[-1 - offers:-1]]
+    assert (saved["current_offer"], saved["agreed_price"]) == (data[tokens + 2]["current_offer"], data[tokens + 2]["agreed_price"])
+
+
+def test_abandoned_offer_stream_leaves_the_negotiation_unchanged(tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from src import api
+    from src.event_log import EventLog
+
+    log = EventLog(str(tmp_path / "events.db"), flush_interval=60)
+    monkeypatch.setattr(api.app.state, "event_log", log)
+    client = TestClient(api.app)
+    started = client.post("/negotiations/start").json()
+    negotiation_id = started["negotiation_id"]
+
+    async def disconnect_after_first_token():
+        response = await api.make_offer_stream(negotiation_id, api.OfferRequest(offer_index=0), api.app.state)
+        events = response.body_iterator
+        assert (await events.__anext__()).startswith("event: seller_token")
+        await events.aclose()  # What the server does when the client goes away
+
+    asyncio.run(disconnect_after_first_token())
+    saved = client.get(f"/negotiations/{negotiation_id}").json()
+    assert (saved["history"], saved["version"]) == (started["history"], started["version"])
+    assert saved["available_offers"] == started["available_offers"]
+    assert [kind for _, kind, _, _ in log._queue if kind is not None] == ["start"]
+
+
+def test_app_factory_starts_without_credentials(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from src.api import create_app
+    from src.llm_interface import AnthropicBackend, FakeBackend
+
+    class CountingBackend(FakeBackend):
+        def __init__(self):
+            super().__init__()
+            self.calls, self.closed = 0, False
+
+        async def acomplete(self, prompt, max_tokens=1000):
+            self.calls += 1
+            return await super().acomplete(prompt, max_tokens)
+
+        async def aclose(self):
+            self.closed = True
+
+    monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
+    backend = AnthropicBackend()  # Clients are only built on first use
+    with pytest.raises(ValueError):
+        backend.async_client
+
+    with TestClient(create_app()) as client:  # Runs the lifespan hooks
+        negotiation = client.post("/negotiations/start").json()
+    assert len(negotiation["available_offers"]) > 0
+
+    # Each app has its own session store, event log, speculator and LLM client
+    first, second = create_app(), create_app()
+    assert first.state.negotiations is not second.state.negotiations
+    first.state.llm.backend, second.state.llm.backend = CountingBackend(), CountingBackend()
+    with TestClient(second) as other:
+        with TestClient(first) as client:
+            negotiation_id = client.post("/negotiations/start").json()["negotiation_id"]
+            assert other.get(f"/negotiations/{negotiation_id}").status_code == 404
+            assert "negotiation_sessions 1" in client.get("/metrics").text
+            assert "negotiation_sessions 0" in other.get("/metrics").text
+        assert first.state.llm.backend.calls > 0 and second.state.llm.backend.calls == 0
+        assert first.state.llm.backend.closed and not second.state.llm.backend.closed
+        assert other.post("/negotiations/start").status_code == 200  # Still open after the first app shut down
+    assert second.state.llm.backend.calls > 0 and second.state.llm.backend.closed
+
+
+def test_price_extractor_handles_shorthand_and_ranges():
+    from src.messages import extract_price_from_text, parse_prices
+
+    assert extract_price_from_text("I can do $21,500.50 today.") == 21500.5
+    assert extract_price_from_text("How about 20k?") == 20000
+    assert extract_price_from_text("Would you take $20.5K cash?") == 20500
+    assert extract_price_from_text("It has 45k miles and I want $23,000.") == 23000
+    assert extract_price_from_text("The 2019 model is in great shape.") is None
+
+    text = "Somewhere between $21k and $22,500 works, or 20-22k if you pay cash."
+    first, second = parse_prices(text)
+    assert (first.value, first.high) == (21000, 22500)
+    assert text[first.start:first.end] == "$21k and $22,500"
+    assert (second.value, second.high) == (20000, 22000)
+
+
+def test_stand_firm_rewrites_shorthand_prices():
+    from fastapi.testclient import TestClient
+
+    from src import api
+    from src.messages import replace_prices
+
+    assert replace_prices("Standing firm at $20.5K, 45k miles or not.", 20000) == "Standing firm at $20,000.00, 45k miles or not."
+    assert replace_prices("Firm at $20k-$21k.", 20500) == "Firm at $20,500.00."
+
+    client = TestClient(api.app)
+    negotiation_id = client.post("/negotiations/start").json()["negotiation_id"]
+    url = f"/negotiations/{negotiation_id}/make_offer"
+    client.post(url, json={"offer_index": 0, "offer_text": "I can offer $20.5K.", "explicit_price": 20500})
+    client.post(url, json={"offer_index": 0, "strategy": "stand_firm", "explicit_price": 21000,
+                           "offer_text": "I'm standing firm at $21K."})
+    state = api.app.state.negotiations.get(negotiation_id)["state"]
+    buyer = [message for message in state.history if message.speaker == "Buyer"][-1]
+    assert (buyer.text, buyer.price) == ("I'm standing firm at $20,500.00.", 20500)
+    assert state.get_last_buyer_price() == 20500
+
+
+def test_history_keeps_parsed_prices_and_the_pair_shape():
+    import copy
+    import pickle
+
+    from src.api import NegotiationResponse
+    from src.negotiation_stage import NegotiationState
+
+    state = NegotiationState()
+    message = state.add_to_history("Buyer", "Could you do 21.5k?")
+    assert message == ("Buyer", "Could you do 21.5k?") and message.price == 21500
+    assert state.get_last_buyer_price() == 21500
+    for restored in (pickle.loads(pickle.dumps(state)).history[-1], copy.deepcopy(state).history[-1]):
+        assert restored.prices == message.prices
+
+    response = NegotiationResponse(
+        negotiation_id="n", history=state.history, current_offer=None, agreed_price=None,
+        available_offers=[], progress_score=0, metrics={}, sentiment=None
+    )
+    assert response.model_dump(mode="json")["history"][-1] == ["Buyer", "Could you do 21.5k?"]
+
+
+@pytest.mark.parametrize("snapshot_every", [3, 1000])  # Snapshot every turn, or replay every event
+def test_event_log_recovers_sessions_from_snapshots_and_events(tmp_path, monkeypatch, snapshot_every):
+    from fastapi.testclient import TestClient
+
+    from src import api
+    from src.event_log import EventLog
+
+    log = EventLog(str(tmp_path / "events.db"), flush_interval=60, snapshot_every=snapshot_every)
+    monkeypatch.setattr(api.app.state, "event_log", log)
+    client = TestClient(api.app)
+    negotiation_id = client.post("/negotiations/start").json()["negotiation_id"]
+    for round_number in range(3):
+        client.post(f"/negotiations/{negotiation_id}/make_offer",
+                    json={"offer_index": round_number % 2, "strategy": "split_difference"})
+    log.close()
+
+    live = api.app.state.negotiations.get(negotiation_id)
+    recovered = EventLog(str(tmp_path / "events.db"), flush_interval=60).recover()[negotiation_id]
+    assert (recovered["version"], recovered["available_offers"]) == (live["version"], live["available_offers"])
+    for field in ("history", "metrics", "current_offer", "agreed_price", "seller_minimum_price", "strategies_used"):
+        assert getattr(recovered["state"], field) == getattr(live["state"], field), field
+    assert list(recovered["state"].buyer_prices) == list(live["state"].buyer_prices)
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_event_log_tombstones_deleted_and_evicted_sessions(backend, tmp_path, monkeypatch):
+    import threading
+
+    from fastapi.testclient import TestClient
+
+    from src import api
+    from src.event_log import EventLog
+
+    if backend == "sqlite":
+        store = SQLiteSessionStore(str(tmp_path / "sessions.db"), max_sessions=3, idle_ttl=None)
+    else:
+        store = InMemorySessionStore(max_sessions=3, idle_ttl=None)
+    log = EventLog(str(tmp_path / "events.db"), flush_interval=60)
+    monkeypatch.setattr(api.app.state, "negotiations", store)
+    monkeypatch.setattr(api.app.state, "event_log", log)
+    assert not any(thread.name == "event-log" for thread in threading.enumerate())
+    with TestClient(api.app) as client:  # The writer runs between startup and shutdown
+        assert any(thread.name == "event-log" for thread in threading.enumerate())
+        evicted, deleted, kept, newest = (client.post("/negotiations/start").json()["negotiation_id"] for _ in range(4))
+        assert client.delete(f"/negotiations/{deleted}").status_code == 200
+    assert not any(thread.name == "event-log" for thread in threading.enumerate())
+    assert store.get(evicted) is None and log.counts["tombstones"] == 2
+
+    reopened = EventLog(str(tmp_path / "events.db"), flush_interval=60)
+    assert set(reopened.recover()) == {kept, newest}
+    assert reopened._conn.execute("SELECT COUNT(*) FROM events WHERE kind = 'tombstone'").fetchone()[0] == 0
+    reopened.close()
+
+
+def test_event_log_keeps_the_batch_when_a_flush_fails(tmp_path):
+    import sqlite3
+
+    from src.event_log import EventLog
+    from src.negotiation_stage import NegotiationState
+
+    path = str(tmp_path / "events.db")
+    log = EventLog(path, flush_interval=60)
+    log._conn.execute("PRAGMA busy_timeout = 0")
+    log.append("a", "start", {})
+    log.snapshot("a", {"state": NegotiationState(), "available_offers": [], "last_updated": time.time()}, force=True)
+    log.append("a", "offers", {"offers": ["I offer $20,000."]})
+
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")  # Another writer holds the lock
+    with pytest.raises(sqlite3.OperationalError):
+        log.flush()
+    assert log.stats()["queued"] == 2 and log.counts["flushes"] == 0
+    other.execute("ROLLBACK")
+    log.close()  # The next flush writes the batch
+
+    recovered = EventLog(path, flush_interval=60).recover()
+    assert recovered["a"]["available_offers"] == ["I offer $20,000."]
+
+
+def test_event_logs_of_several_workers_share_one_file(tmp_path):
+    from src.event_log import EventLog
+    from src.negotiation_stage import NegotiationState
+
+    path = str(tmp_path / "events.db")
+    workers = [EventLog(path, flush_interval=60), EventLog(path, flush_interval=60)]
+    for round_number in range(3):
+        for worker, negotiation_id in zip(workers, ("a", "b")):
+            if round_number == 0:
+                worker.append(negotiation_id, "start", {})
+                record = {"state": NegotiationState(), "available_offers": [], "last_updated": time.time()}
+                worker.snapshot(negotiation_id, record, force=True)
+            worker.append(negotiation_id, "offers", {"offers": [f"{negotiation_id} offers ${20000 + round_number:,}."]})
+            worker.flush()  # Interleaved writes get distinct sequence numbers
+    for worker in workers:
+        worker.close()
+
+    recovered = EventLog(path, flush_interval=60).recover()
+    assert {negotiation_id: record["available_offers"] for negotiation_id, record in recovered.items()} == {
+        "a": ["a offers $20,002."], "b": ["b offers $20,002."]
+    }
+    assert recovered["a"]["version"] == 3  # Each logged offers event, replayed after the snapshot
+
+
+def test_turns_on_one_negotiation_wait_for_each_other(monkeypatch):
+    from fastapi import HTTPException, Response
+    from fastapi.testclient import TestClient
+
+    from src import api, llm_interface
+    from src.llm_interface import FakeBackend
+
+    monkeypatch.setattr(llm_interface.current_llm_client(), "backend", FakeBackend(latency=0.01))  # Turns overlap unless they wait
+    client = TestClient(api.app)
+    started = client.post("/negotiations/start").json()
+    negotiation_id = started["negotiation_id"]
+
+    async def make_offer():
+        try:
+            await api.make_offer(negotiation_id, api.OfferRequest(offer_index=0), Response(), None, api.app.state)
+            return 200
+        except HTTPException as e:
+            return e.status_code
+
+    async def autopilot_and_make_offer():
+        response = await api.autopilot(negotiation_id, api.AutopilotRequest(max_rounds=2), api.app.state)
+
+        async def run():
+            return [chunk async for chunk in response.body_iterator]
+
+        autopilot = asyncio.ensure_future(run())
+        await asyncio.sleep(0.005)  # Into the autopilot's first turn
+        return await make_offer(), await autopilot
+
+    status, events = asyncio.run(autopilot_and_make_offer())
+    saved = api.app.state.negotiations.get(negotiation_id)
+    played = sum(1 for event in events if event.startswith("event: turn")) + (status == 200)
+    assert status in (200, 400) and events[-1].startswith("event: done")  # 400: the autopilot reached a deal first
+    assert saved["version"] == started["version"] + played
+    assert sum(speaker == "Buyer" for speaker, _ in saved["state"].history) == played
+
+
+def test_batch_endpoints_stream_results_and_isolate_errors():
+    import json
+
+    from fastapi.testclient import TestClient
+
+    from src.api import app
+
+    client = TestClient(app)
+    started = client.post("/negotiations/batch/start", json=[None, {"num_offers": 2}, {"num_offers": "many"}, "oops"])
+    assert started.headers["content-type"] == "application/x-ndjson"
+    started = sorted((json.loads(line) for line in started.text.splitlines()), key=lambda item: item["index"])
+    assert [item["status"] for item in started] == [200, 200, 422, 422]  # Malformed items fail alone
+    assert started[2]["detail"][0]["loc"] == ["num_offers"]
+    assert len(started[1]["negotiation"]["available_offers"]) == 2
+    first, second = (item["negotiation"]["negotiation_id"] for item in started[:2])
+
+    offered = client.post("/negotiations/batch/offers", json=[
+        {"negotiation_id": first, "offer_index": 0},
+        {"negotiation_id": "missing", "offer_index": 0},
+        {"negotiation_id": first, "offer_index": 0},  # Played after the first offer to the same negotiation
+        {"negotiation_id": second, "offer_index": 5},
+        {"negotiation_id": second},
+    ])
+    results = {item["index"]: item for item in map(json.loads, offered.text.splitlines())}
+    assert (results[1]["status"], results[3]["status"], results[4]["status"]) == (404, 400, 422)
+    assert len(results[2]["negotiation"]["history"]) == len(results[0]["negotiation"]["history"]) + 2
+    assert client.post("/negotiations/batch/offers", json=[]).status_code == 400
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])  # The sqlite store hands out copies of the records
+def test_autopilot_plays_a_policy_until_it_stops(backend, tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from src import api
+    from src.negotiation_logic import Offer
+    from src.negotiation_stage import NegotiationState
+    from src.policies import make_policy
+
+    offers = ["I offer $21,000.", Offer("Meet me at 20k?", price=20000.0), "Any flexibility?", "$22,500 is my limit."]
+    assert make_policy("cheapest").choose(NegotiationState(), offers, None) == 1
+    assert make_policy("target_price", target_price=21500).choose(NegotiationState(), offers, None) == 0
+    assert make_policy("pick", index=9).choose(NegotiationState(), offers, None) == 3
+
+    if backend == "sqlite":
+        monkeypatch.setattr(api.app.state, "negotiations", SQLiteSessionStore(str(tmp_path / "sessions.db"), idle_ttl=None))
+    client = TestClient(api.app)
+    started = client.post("/negotiations/start").json()
+    negotiation_id = started["negotiation_id"]
+    response = client.post(f"/negotiations/{negotiation_id}/autopilot", json={"policy": "first", "max_rounds": 2})
+    events = sse_events(response.text)
+    turns = [data for event, data in events if event == "turn"]
+    (event, done), = events[len(turns):]
+    assert event == "done" and 1 <= len(turns) <= 2 and done["rounds"] == len(turns)
+    assert done["reason"] == ("agreed" if turns[-1]["agreed_price"] is not None else "max_rounds")
+    assert [speaker for speaker, _ in turns[0]["history"]] == ["Buyer", "Seller"]
+    # The turn events add up to the saved negotiation
+    final = done["negotiation"]
+    assert started["history"] + [entry for turn in turns for entry in turn["history"]] == final["history"]
+    assert (turns[-1]["current_offer"], turns[-1]["agreed_price"]) == (final["current_offer"], final["agreed_price"])
+    assert client.post(f"/negotiations/{negotiation_id}/autopilot", json={"policy": "unknown"}).status_code == 400
+
+
+def test_strategy_stats_rank_by_context_with_exploration():
+    from fastapi.testclient import TestClient
+
+    from src.api import app
+    from src.negotiation_stage import NegotiationState
+    from src.strategy_stats import StrategyContext, StrategyStats, strategy_context
+
+    stats = StrategyStats()
+    early, late = StrategyContext(0, "far", "neutral"), StrategyContext(3, "close", "positive")
+    for _ in range(10):
+        stats.record("stand_firm", early, True)
+        stats.record("split_difference", early, False)
+        stats.record("split_difference", late, True)
+    ranking = stats.rank(early, ["split_difference", "stand_firm", "final_offer"])
+    # Untried strategies come first (largest exploration bonus), then by smoothed effectiveness
+    assert [entry["strategy"] for entry in ranking] == ["final_offer", "stand_firm", "split_difference"]
+    stats.record("stand_firm", late, False)
+    stats.exploration = 0  # Pure exploitation: the bucket's own record outweighs stand_firm's overall one
+    assert stats.rank(late, ["stand_firm", "split_difference"])[0]["strategy"] == "split_difference"
+    assert stats.stats()["evaluations"] == 31
+
+    state = NegotiationState()
+    assert strategy_context(state) == StrategyContext(0, "unknown", "unknown")
+    state.add_to_history("Buyer", "I can offer $18,000.")
+    state.seller_minimum_price = 20000
+    state.metrics['rounds'] = 9
+    state.record_sentiment({"positivity": 8, "openness": 7, "flexibility": 7, "firmness": 3})
+    assert strategy_context(state) == StrategyContext(5, "near", "positive")
+
+    client = TestClient(app)
+    negotiation_id = client.post("/negotiations/start").json()["negotiation_id"]
+    client.post(f"/negotiations/{negotiation_id}/make_offer", json={"offer_index": 0, "strategy": "split_difference"})
+    recommendation = client.get(f"/negotiations/{negotiation_id}/strategy_recommendation",
+                                params={"candidates": "split_difference,stand_firm"}).json()
+    assert recommendation["recommended"] in ("split_difference", "stand_firm")
+    assert {entry["strategy"] for entry in recommendation["strategies"]} == {"split_difference", "stand_firm"}
+    assert client.get("/stats").json()["strategies"]["strategies"]["split_difference"]["used"] >= 1
+
+
+def test_strategy_stats_use_offer_tags_and_are_restored_from_the_event_log(tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from src import api
+    from src.event_log import EventLog
+    from src.negotiation_logic import OFFER_STRATEGIES, Offer
+    from src.negotiation_stage import NegotiationState
+    from src.policies import offer_strategy
+    from src.strategy_stats import strategy_stats
+
+    state = NegotiationState()
+    state.add_to_history("Buyer", "I can offer $18,000.")
+    assert offer_strategy(state, Offer("How about $19,000?", 19000, "cash_offer")) == "cash_offer"
+    assert offer_strategy(state, "I'm standing firm at $18,000.") == "stand_firm"
+    assert offer_strategy(state, "Let's meet in the middle at $20,000.") == "split_difference"
+    assert offer_strategy(state, "How about $19,500?") == "other"
+
+    for name in ("totals", "buckets", "context_totals"):  # Put the process-wide counts back afterwards
+        monkeypatch.setattr(strategy_stats, name, getattr(strategy_stats, name))
+    monkeypatch.setattr(api.app.state, "event_log", EventLog(str(tmp_path / "events.db"), flush_interval=60))
+    with TestClient(api.app) as client:
+        negotiation_id = client.post("/negotiations/start").json()["negotiation_id"]
+        for strategy_name in ("split_difference", "cash_offer"):
+            client.post(f"/negotiations/{negotiation_id}/make_offer", json={"offer_index": 0, "strategy": strategy_name})
+        recommendation = client.get(f"/negotiations/{negotiation_id}/strategy_recommendation").json()
+        assert {entry["strategy"] for entry in recommendation["strategies"]} == set(OFFER_STRATEGIES) - {"other"}
+        client.delete(f"/negotiations/{negotiation_id}")  # Outcomes outlive their session
+        counted = client.get("/stats").json()["strategies"]
+    assert set(counted["strategies"]) == {"split_difference", "cash_offer"} and counted["evaluations"] == 2
+
+    strategy_stats.restore([])  # A fresh process
+    monkeypatch.setattr(api.app.state, "event_log", EventLog(str(tmp_path / "events.db"), flush_interval=60))
+    with TestClient(api.app) as client:
+        assert client.get("/stats").json()["strategies"] == counted